@@ -1,2 +1,2 @@
 """This file contains main functions for learning and generation using pixel RNNs."""
-from .nn_generator import learn, generate, parse, construct_training_datasets, train_networks
\ No newline at end of file
+from .nn_generator import learn, generate, generate_many, parse, construct_training_datasets, train_networks, load_models, unload_models
\ No newline at end of file
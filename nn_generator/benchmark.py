@@ -0,0 +1,270 @@
+"""Benchmarks of parsing, dataset construction, training and generation on synthetic data.
+
+Results are saved as JSON, so results of two commits can be compared by compare_benchmarks():
+    python -m nn_generator.benchmark new.json [old.json]
+"""
+
+from .libraries.parse import parse_image, parse_heights
+from .libraries.normalize_heights import normalize_heights
+from .libraries.process_training_data import process_training_data, candidates, dataset_folder
+from .libraries.train import train, build_model
+from .libraries.generate import generate_map
+from .libraries.basic.pgm import write_pgm
+from .nn_generator import dataset_variants, networks
+import tensorflow as tf
+import numpy as np
+import subprocess
+import platform
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+import cv2
+
+MODES = ["heights", "roads", "rivers", "buildings"]
+
+# Structures of the networks used by the generation, see generation_config.txt
+GENERATION_STRUCTURES = {"heights_64-16": "heights2", "heights_64-16-4": "heights1", "heights_16-4-1": "heights0"}
+for _mode in MODES[1:]:
+    GENERATION_STRUCTURES.update({
+        f"{_mode}_64-16": f"{_mode}2",
+        f"{_mode}_64-16-4": f"{_mode}1",
+        f"{_mode}_16-4-blurry": f"{_mode}0_blurry",
+        f"{_mode}_sharp": f"{_mode}0_sharp"})
+
+
+def synthetic_images(folder, size, seed=0):
+    """Writes heights.pgm, roads.pgm, rivers.pgm and buildings.pgm of shape (size, size) into folder.
+    Heights are 16-bit noise of several scales, roads are straight lines, rivers random walks
+    and buildings small rectangles, all of them 8-bit with values 0 and 255."""
+    rng = np.random.RandomState(seed)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    heights = np.zeros((size, size))
+    for scale in (4, 16, 64):
+        noise = rng.standard_normal((size // scale + 2, size // scale + 2))
+        heights += scale * cv2.resize(noise, (size, size), interpolation=cv2.INTER_CUBIC)
+    heights = (heights - heights.min()) / (heights.max() - heights.min())
+    write_pgm(np.round(heights * 65535).astype(np.uint16), f"{folder}/heights.pgm")
+
+    roads = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(size // 16):
+        x0, y0, x1, y1 = (int(value) for value in rng.randint(size, size=4))
+        cv2.line(roads, (x0, y0), (x1, y1), 255, 1)
+    write_pgm(roads, f"{folder}/roads.pgm")
+
+    rivers = np.zeros((size, size), dtype=np.uint8)
+    count = size // 32 + 1
+    for i in range(count):
+        # From the top edge down, spread evenly over the columns
+        steps = rng.randint(-2, 3, size=(size, 2)) + [0, 1]
+        points = np.cumsum(steps, axis=0) + [int((i + rng.rand()) * size / count), 0]
+        cv2.polylines(rivers, [points.astype(np.int32)], False, 255, 2)
+    write_pgm(rivers, f"{folder}/rivers.pgm")
+
+    buildings = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(size * size // 2000):
+        x, y, width, height = (int(value) for value in rng.randint(size, size=4))
+        cv2.rectangle(buildings, (x, y), (x + width % 6 + 1, y + height % 6 + 1), 255, -1)
+    write_pgm(buildings, f"{folder}/buildings.pgm")
+
+
+def random_models(structures_folder, folder, seed=0):
+    """Saves randomly initialized networks of the generation into folder, built from the structures.
+    Returns a config file of them for generate_map()."""
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    tf.keras.utils.set_random_seed(seed)
+    config_file = f"{folder}/config.txt"
+    with open(config_file, "w") as config:
+        for name, structure in GENERATION_STRUCTURES.items():
+            model_file = os.path.abspath(f"{folder}/{name}.h5")
+            build_model(f"{structures_folder}/{structure}.txt").save(model_file)
+            config.write(f"{name}={model_file}\n")
+
+    return config_file
+
+
+def measure(results, stage, image_size, function, *arguments, **keywords):
+    """Calls function(*arguments, **keywords) and appends its time into results."""
+    start = time.perf_counter()
+    result = function(*arguments, **keywords)
+    seconds = time.perf_counter() - start
+
+    results.append({"stage": stage, "size": image_size, "seconds": seconds})
+    print(f"BENCHMARK {stage} [{image_size}]: {seconds:.3f} s")
+
+    return result
+
+
+def environment():
+    """Returns the commit and versions the benchmark runs with."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "tensorflow": tf.__version__
+    }
+
+
+def run_benchmark(
+    output_file,
+    image_sizes = (400, 800),
+    generation_sizes = (64, 128),
+    dataset_size = 2000,
+    structures_folder = "nn_generator/examples/model_structures",
+    work_folder = None,
+    seed = 0
+    ):
+    """Times every stage of learning and generation on synthetic images and saves the times into a JSON file.
+    Stages are parse_image of every image, normalize_heights, parse_heights, process_training_data of every
+    dataset, one epoch of training of every network and every stage of generate_map. No data or trained
+    networks are needed, the generation uses randomly initialized networks.
+    output_file: str
+        JSON file with the results, see compare_benchmarks().
+    image_sizes: [int]
+        Sizes of the square training images. They have to be bigger than 322.
+    generation_sizes: [int]
+        Sizes of the square user inputs for the generation.
+    dataset_size: int
+        Number of examples in training datasets. Smaller if the images do not have enough.
+    structures_folder: str
+        Folder with structures of the networks.
+    work_folder: str
+        Folder for the images, datasets and networks. A temporary folder, which is removed afterwards, if None.
+    seed: int
+    """
+    work = work_folder or tempfile.mkdtemp(prefix="nn_generator_benchmark_")
+    results = []
+
+    try:
+        for size in image_sizes:
+            images = f"{work}/images_{size}"
+            folder = f"{work}/training_{size}"
+            synthetic_images(images, size, seed)
+
+            # Parsing
+            #================
+            for mode in MODES:
+                layers = f"{folder}/{mode}_layers"
+                measure(results, f"parse_image {mode}", size, parse_image, f"{images}/{mode}.pgm", layers)
+                if mode != "heights":
+                    measure(results, f"parse_image {mode} blurry", size,
+                        parse_image, f"{images}/{mode}.pgm", layers, reductions=[1], blur=True)
+
+            measure(results, "normalize_heights", size, normalize_heights, folder)
+            measure(results, "parse_heights", size, parse_heights, f"{images}/heights.pgm", f"{folder}/heights_layers")
+
+            # Datasets
+            #================
+            np.random.seed(seed)
+            sizes = {}
+            for mode in MODES:
+                sizes[mode] = min([dataset_size] + [len(candidates(mode, variant[1], folder)) for variant in dataset_variants()])
+                if sizes[mode] == 0:
+                    print(f"No {mode} in the middle of the synthetic images of size {size}.")
+                    continue
+
+                for variant in dataset_variants():
+                    name = os.path.basename(dataset_folder(folder, mode, *variant, sizes[mode]))
+                    measure(results, f"process_training_data {name}", size,
+                        process_training_data, mode, *variant, training_folder=folder, size=sizes[mode])
+
+            # Training
+            #================
+            for mode in MODES:
+                if sizes[mode] == 0:
+                    continue
+                for structure, data, network, _ in networks(mode, structures_folder, f"{work}/networks_{size}", size=sizes[mode], data_folder=folder):
+                    measure(results, f"train {os.path.basename(network)}", size, train, structure, data, network, epochs=1)
+
+        # Generation
+        #================
+        config_file = random_models(structures_folder, f"{work}/random_models", seed)
+        for size in generation_sizes:
+            synthetic_images(f"{work}/input_{size}", size, seed)
+            timings = {}
+            measure(results, "generate_map", size,
+                generate_map, f"{work}/input_{size}", f"{work}/generated_{size}",
+                config_file=config_file, seed=seed, save_stages=False, timings=timings)
+            for name, seconds in timings.items():
+                results.append({"stage": f"generate {name}", "size": size, "seconds": seconds})
+    finally:
+        if work_folder is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    benchmark = {
+        "environment": environment(),
+        "parameters": {
+            "image_sizes": list(image_sizes),
+            "generation_sizes": list(generation_sizes),
+            "dataset_size": dataset_size,
+            "seed": seed
+        },
+        "results": results
+    }
+
+    with open(output_file, "w") as f:
+        json.dump(benchmark, f, indent=1)
+
+    return benchmark
+
+
+def compare_benchmarks(old_file, new_file, tolerance=0.2, minimum=0.05):
+    """Prints times of stages of two results of run_benchmark() side by side.
+    Returns [(stage, size, old seconds, new seconds)] of stages slower by more than tolerance (0.2 = 20 %).
+    Stages faster than minimum seconds in both results are never reported, their times are mostly noise."""
+    def load(file_name):
+        with open(file_name) as f:
+            benchmark = json.load(f)
+        return benchmark["environment"].get("commit"), benchmark["results"]
+
+    old_commit, old_results = load(old_file)
+    new_commit, new_results = load(new_file)
+    old_times = {(result["stage"], result["size"]): result["seconds"] for result in old_results}
+
+    print(f"{'stage':<50} {'size':>6} {str(old_commit)[:9]:>9} {str(new_commit)[:9]:>9} {'ratio':>6}")
+    slower = []
+    for result in new_results:
+        key = (result["stage"], result["size"])
+        if key not in old_times:
+            continue
+
+        old = old_times[key]
+        new = result["seconds"]
+        ratio = new / old if old > 0 else float("inf")
+        mark = ""
+        if max(old, new) >= minimum:
+            if ratio > 1 + tolerance:
+                mark = "SLOWER"
+                slower.append((key[0], key[1], old, new))
+            elif ratio < 1 / (1 + tolerance):
+                mark = "faster"
+
+        print(f"{key[0]:<50} {key[1]:>6} {old:>9.3f} {new:>9.3f} {ratio:>6.2f} {mark}")
+
+    return slower
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m nn_generator.benchmark results.json [previous_results.json]")
+        sys.exit()
+
+    run_benchmark(sys.argv[1])
+    if len(sys.argv) > 2:
+        compare_benchmarks(sys.argv[2], sys.argv[1])
@@ -0,0 +1,192 @@
+import numpy as np
+import shutil
+import os
+
+# Number of rows encoded or decoded at once
+CHUNK_ROWS = 1 << 13
+# Fractional values are quantized into this many levels between minimum and maximum of their column
+LEVELS = 255
+
+
+def save_compact(matrix, folder):
+    """Saves a matrix of training examples into a folder in a compact form.
+    Unary encodings consist almost only of 0, 1 and -1. Those are stored as bits:
+        ones.npy, negative.npy: packed bits of entries equal to 1 and -1,
+        fractions.npy: packed bits of the other nonzero entries.
+    Values of the other entries are quantized into uint8 per column:
+        values.npy: the quantized values, row by row,
+        offsets.npy: index of the first value of every row in values.npy,
+        scale.npy: (minimum, step) of every column,
+        shape.npy: shape of the matrix.
+    Every file can be memory-mapped, see CompactMatrix.
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    shape = np.shape(matrix)
+    matrix = np.reshape(matrix, (shape[0], -1))
+    rows, cols = matrix.shape
+
+    def fractional(chunk):
+        return (chunk != 0) & (chunk != 1) & (chunk != -1)
+
+    # Range of the fractional values of every column and number of them in every row
+    minimum = np.full(cols, np.inf)
+    maximum = np.full(cols, -np.inf)
+    counts = np.zeros(rows, dtype=np.int64)
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = matrix[start : start + CHUNK_ROWS]
+        mask = fractional(chunk)
+        minimum = np.minimum(minimum, np.min(np.where(mask, chunk, np.inf), axis=0))
+        maximum = np.maximum(maximum, np.max(np.where(mask, chunk, -np.inf), axis=0))
+        counts[start : start + CHUNK_ROWS] = np.count_nonzero(mask, axis=1)
+
+    minimum[np.isinf(minimum)] = 0
+    step = np.where(maximum > minimum, (maximum - minimum) / LEVELS, 1)
+    # Quantized by the same numbers they are decoded with
+    minimum = minimum.astype(np.float32)
+    step = step.astype(np.float32)
+    offsets = np.zeros(rows + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    def open_file(name, dtype, file_shape):
+        return np.lib.format.open_memmap(f"{folder}/{name}.npy", mode="w+", dtype=dtype, shape=file_shape)
+
+    packed_shape = (rows, (cols + 7) // 8)
+    ones = open_file("ones", np.uint8, packed_shape)
+    negative = open_file("negative", np.uint8, packed_shape)
+    fractions = open_file("fractions", np.uint8, packed_shape)
+    values = open_file("values", np.uint8, (offsets[-1],))
+
+    for start in range(0, rows, CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, rows)
+        chunk = matrix[start : end]
+        mask = fractional(chunk)
+        ones[start : end] = np.packbits(chunk == 1, axis=1)
+        negative[start : end] = np.packbits(chunk == -1, axis=1)
+        fractions[start : end] = np.packbits(mask, axis=1)
+        # Boolean indexing goes row by row, the same order as offsets
+        quantized = np.round((chunk - minimum) / step)[mask]
+        values[offsets[start] : offsets[end]] = np.clip(quantized, 0, LEVELS)
+
+    for array in (ones, negative, fractions, values):
+        array.flush()
+    del ones, negative, fractions, values
+
+    np.save(f"{folder}/offsets.npy", offsets)
+    np.save(f"{folder}/scale.npy", np.stack((minimum, step)))
+    np.save(f"{folder}/shape.npy", np.array(shape, dtype=np.int64))
+
+
+def is_compact(folder):
+    return os.path.exists(f"{folder}/shape.npy")
+
+
+class CompactMatrix:
+    """Matrix saved by save_compact(), memory-mapped. Nothing is read until it is indexed.
+    Indexing it by a slice or by indices of rows returns the decoded rows as float32.
+    """
+
+    def __init__(self, folder):
+        def load(name):
+            return np.load(f"{folder}/{name}.npy", mmap_mode="r")
+
+        self.ones = load("ones")
+        self.negative = load("negative")
+        self.fractions = load("fractions")
+        self.values = load("values")
+        self.offsets = np.load(f"{folder}/offsets.npy")
+        self.minimum, self.step = np.load(f"{folder}/scale.npy")
+        self.shape = tuple(np.load(f"{folder}/shape.npy"))
+        self.cols = len(self.minimum)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(self.shape[0])
+            if stride == 1:
+                return self.decode(slice(start, stop), self.values[self.offsets[start] : self.offsets[stop]])
+            index = np.arange(start, stop, stride)
+
+        indices = np.asarray(index)
+        # Values of the rows are consecutive runs in values.npy
+        counts = self.offsets[indices + 1] - self.offsets[indices]
+        starts = np.repeat(self.offsets[indices] - np.cumsum(counts) + counts, counts)
+        positions = starts + np.arange(np.sum(counts))
+
+        return self.decode(indices, self.values[positions])
+
+    def decode(self, rows, values):
+        def unpack(bits):
+            return np.unpackbits(bits[rows], axis=1, count=self.cols)
+
+        matrix = unpack(self.ones).astype(np.float32)
+        matrix -= unpack(self.negative)
+        positions = np.flatnonzero(unpack(self.fractions))
+        columns = positions % self.cols
+        np.ravel(matrix)[positions] = self.minimum[columns] + values * self.step[columns]
+
+        return np.reshape(matrix, (len(matrix),) + self.shape[1:])
+
+    def load(self):
+        """Returns the whole decoded matrix, decoded by chunks of rows."""
+        matrix = np.empty(self.shape, dtype=np.float32)
+        for start in range(0, self.shape[0], CHUNK_ROWS):
+            matrix[start : start + CHUNK_ROWS] = self[start : start + CHUNK_ROWS]
+
+        return matrix
+
+
+def save_dataset(folder, inputs, outputs, compact=True):
+    """Saves a training dataset into a folder, either compact (see save_compact()) or as .npy files.
+    A dataset saved before in the other form is removed."""
+    for name, matrix in (("inputs", inputs), ("outputs", outputs)):
+        if compact:
+            if os.path.exists(f"{folder}/{name}.npy"):
+                os.remove(f"{folder}/{name}.npy")
+            save_compact(matrix, f"{folder}/{name}")
+        else:
+            if os.path.exists(f"{folder}/{name}"):
+                shutil.rmtree(f"{folder}/{name}")
+            np.save(f"{folder}/{name}", matrix)
+
+
+def open_dataset(folder):
+    """Opens (inputs, outputs) of a training dataset saved by save_dataset() without reading it.
+    Returns memory-mapped matrices or CompactMatrix objects, both can be indexed by rows."""
+    def open_matrix(name):
+        if is_compact(f"{folder}/{name}"):
+            return CompactMatrix(f"{folder}/{name}")
+        return np.load(f"{folder}/{name}.npy", mmap_mode="r")
+
+    return (open_matrix("inputs"), open_matrix("outputs"))
+
+
+def dataset_shards(folder):
+    """Returns folders of the parts of a training dataset. A dataset can be split into subfolders
+    named shard_*, for example datasets of several regions. Otherwise it is the folder itself."""
+    shards = sorted(
+        f"{folder}/{name}" for name in os.listdir(folder)
+        if name.startswith("shard_") and os.path.isdir(f"{folder}/{name}"))
+
+    return shards or [folder]
+
+
+def load_dataset(folder):
+    """Loads (inputs, outputs) of a training dataset saved by save_dataset() in any of the forms.
+    Shards of the dataset are concatenated, see dataset_shards()."""
+    def load(matrix):
+        if isinstance(matrix, CompactMatrix):
+            return matrix.load()
+        return np.array(matrix)
+
+    shards = [open_dataset(shard) for shard in dataset_shards(folder)]
+    if len(shards) == 1:
+        return (load(shards[0][0]), load(shards[0][1]))
+
+    inputs = np.concatenate([load(inputs) for inputs, _ in shards])
+    outputs = np.concatenate([load(outputs) for _, outputs in shards])
+
+    return (inputs, outputs)
@@ -4,7 +4,13 @@ import matplotlib
 matplotlib.use("agg")
 import numpy as np
 from numpy.core.shape_base import block
+import threading
+import queue
 import cv2
+from .pgm import write_pgm, write_pgm_rescaled
+
+# pyplot is not thread safe, maps generated in parallel threads draw one by one
+_pyplot_lock = threading.Lock()
 
 def register_colormap(cmap):
     """Creates and registers alpha-fading version of a colormap.
@@ -26,35 +32,29 @@ def init_cmaps():
     Returns list of names of colormaps to be used to draw the final map.
     Color maps are for heights, rivers, roads and buildings in that order.
     """
-    register_colormap("Blues")
-    register_colormap("Greens")
-    register_colormap("turbo")
+    with _pyplot_lock:
+        register_colormap("Blues")
+        register_colormap("Greens")
+        register_colormap("turbo")
 
     return ['copper', 'Blues_alpha', 'Greens_alpha', 'turbo_alpha']
 
 def save_as_pgm(matrix, file_name):
-    """Saves a 2d array as a pgm image.
+    """Saves a 2d array as a binary pgm image.
+    Integer matrices are saved as they are, others are rescaled to 16 bits.
     """
-    _max = np.max(matrix)
-    with open(file_name + ".pgm", "w") as f:
-        f.write("P2\n") # P2 -> PGM mark
-        f.write(f"{matrix.shape[1]}\n")
-        f.write(f"{matrix.shape[0]}\n")
-        f.write(f"{_max}")
-
-        for row in range(matrix.shape[0]):
-            separator = ""
-            f.write("\n")
-            for col in range(matrix.shape[1]):
-                f.write(separator)
-                f.write(str(matrix[row, col]))
-
-                separator = " "
+    if np.issubdtype(np.asarray(matrix).dtype, np.integer):
+        write_pgm(matrix, file_name + ".pgm")
+    else:
+        write_pgm_rescaled(matrix, file_name + ".pgm")
 
 def save_image(img, name):
-    plt.gca().set_axis_off()
-    plt.imshow(img, cmap='viridis')
-    plt.savefig(name, bbox_inches='tight', pad_inches=0)
+    with _pyplot_lock:
+        plt.gca().set_axis_off()
+        plt.imshow(img, cmap='viridis')
+        plt.savefig(name, bbox_inches='tight', pad_inches=0)
+        # Otherwise the images pile up in the figure and every following save draws all of them
+        plt.clf()
 
 def show_image(img):
     plt.imshow(img)
@@ -78,8 +78,107 @@ def show_all(images, colors):
 
 def save_all(images, colors, name):
     """Shows images layered on top of each other with respective color maps."""
-    plt.gca().set_axis_off()
-    for i in range(len(images)):
-        plt.imshow(images[i], cmap=colors[i])
-    
-    plt.savefig(name, bbox_inches='tight', pad_inches=0)
\ No newline at end of file
+    with _pyplot_lock:
+        plt.gca().set_axis_off()
+        for i in range(len(images)):
+            plt.imshow(images[i], cmap=colors[i])
+
+        plt.savefig(name, bbox_inches='tight', pad_inches=0)
+        plt.clf()
+
+def colormap_lut(cmap):
+    """Returns colors of a colormap for values 0 to 255 as a lookup table of RGBA colors in [0,1]."""
+    with _pyplot_lock:
+        return plt.get_cmap(cmap)(np.arange(256))
+
+def colorize(img, lut):
+    """Colors an image by a lookup table the same way as imshow: the image is rescaled to [0,1]
+    and split into as many bins as there are colors."""
+    minimum = np.min(img)
+    length = np.max(img) - minimum
+    if (length == 0):
+        return lut[np.zeros(img.shape, dtype=np.intp)]
+
+    indices = ((img - minimum) / length * len(lut)).astype(np.intp)
+    return lut[np.clip(indices, 0, len(lut) - 1)]
+
+def compose(images, luts):
+    """Returns images layered on top of each other with respective lookup tables
+    as an RGB image in [0,1] on a white background."""
+    result = np.ones(images[0].shape + (3,))
+    for img, lut in zip(images, luts):
+        colors = colorize(img, lut)
+        alpha = colors[..., 3:]
+        result = result * (1 - alpha) + colors[..., :3] * alpha
+
+    return result
+
+
+class ImageWriter:
+    """Writes images as PNG files on a background thread, so that the generation does not wait for them.
+    Images are colored by lookup tables of colormaps and written by cv2 with one pixel per value,
+    instead of being drawn by pyplot.
+    intermediate: bool
+        Write images of intermediate stages, otherwise save_stage() does nothing.
+    Used as a context manager, it is closed at the end of the block, see close().
+    """
+
+    def __init__(self, intermediate=True):
+        self.intermediate = intermediate
+        # {colormap: lookup table}, used only by the writing thread
+        self.luts = {}
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save_image(self, img, name, cmap='viridis'):
+        """Writes an image colored by a colormap. The image is copied, it can be changed right after."""
+        self.queue.put(([np.array(img)], [cmap], name))
+
+    def save_stage(self, img, name):
+        """Writes an image of an intermediate stage, if they are written."""
+        if self.intermediate:
+            self.save_image(img, name)
+
+    def save_all(self, images, colors, name):
+        """Writes images layered on top of each other with respective color maps, see init_cmaps()."""
+        self.queue.put(([np.array(img) for img in images], colors, name))
+
+    def close(self):
+        """Waits until all images are written. Raises the first error of writing."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is None:
+            self.close()
+        else:
+            # Images queued before the error are still written, the error is not replaced by errors of writing
+            self.queue.put(None)
+            self.thread.join()
+
+    def lut(self, cmap):
+        if cmap not in self.luts:
+            self.luts[cmap] = colormap_lut(cmap)
+        return self.luts[cmap]
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            images, colors, name = item
+            try:
+                rgb = compose(images, [self.lut(cmap) for cmap in colors])
+                if not cv2.imwrite(name, np.round(rgb[..., ::-1] * 255).astype(np.uint8)):
+                    raise IOError(f"Could not write '{name}'.")
+            except Exception as error:
+                if self.error is None:
+                    self.error = error
@@ -1,4 +1,5 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 def rescale(matrix):
     """Rescales the matrix to [0,1] interval."""
@@ -12,6 +13,23 @@ def rescale(matrix):
     return (matrix - minimum) / length   
 
 
+def rescale_quantized(matrix):
+    """Same as rescale, returns (rescaled matrix, scale). If the matrix contains integers, such as pixels
+    of an image, values of the rescaled matrix are integers divided by scale, see quantize.
+    Otherwise scale is None."""
+    if not np.issubdtype(np.asarray(matrix).dtype, np.integer):
+        return (rescale(matrix), None)
+
+    length = int(np.max(matrix)) - int(np.min(matrix))
+    return (rescale(matrix), max(length, 1))
+
+
+def quantize(matrix, scale):
+    """Returns the integers, which values of a matrix are divided from by scale, see rescale_quantized.
+    They are exact, as long as the values differ from them by less than half of 1 / scale."""
+    return np.rint(np.asarray(matrix) * scale).astype(np.int64)
+
+
 def rescale2(matrix):
     """Rescales matrix to [-1,1] interval, retaining signs."""
     minimum = np.min(matrix)
@@ -23,6 +41,16 @@ def rescale2(matrix):
     return matrix / scalar
 
 
+def rescale2_rows(matrix):
+    """Applies rescale2 to every row of a matrix."""
+    minimum = np.min(matrix, axis=-1)
+    maximum = np.max(matrix, axis=-1)
+    scalar = np.maximum(abs(maximum), abs(minimum))
+    scalar = np.where(scalar == 0, 1, scalar)
+
+    return matrix / scalar[..., None]
+
+
 def derivatives(matrix):
     """Returns 2 matrices, containing differences in x and y direction respectively."""
     rows = matrix.shape[0]
@@ -30,17 +58,34 @@ def derivatives(matrix):
     r_ders = np.zeros((rows, cols))
     c_ders = np.zeros((rows, cols))
 
-    for r in range(rows - 1):
-        for c in range(cols):
-            r_ders[r, c] = matrix[r + 1, c] - matrix[r, c]
-
-    for r in range(rows):
-        for c in range(cols - 1):
-            c_ders[r, c] = matrix[r, c + 1] - matrix[r, c]
+    # The last row and column stay zero
+    np.subtract(matrix[1:], matrix[:-1], out=r_ders[:-1])
+    np.subtract(matrix[:, 1:], matrix[:, :-1], out=c_ders[:, :-1])
 
     return (r_ders, c_ders)
 
 
+def reflect_indices(size, padding):
+    """Indices, that pad an axis of given size the same way as np.pad(..., padding, 'reflect')."""
+    if size == 1:
+        return np.zeros(size + 2 * padding, dtype=np.intp)
+
+    # Reflection repeats with the period 2 * (size - 1)
+    period = 2 * (size - 1)
+    indices = np.arange(-padding, size + padding) % period
+    return np.where(indices < size, indices, period - indices)
+
+
+def padded_derivatives(matrix, padding):
+    """Same as derivatives() with both results padded by np.pad(..., padding, 'reflect').
+    Padded matrices are gathered directly from the differences, without padding copies."""
+    r_ders, c_ders = derivatives(matrix)
+    rows = reflect_indices(matrix.shape[0], padding)[:, None]
+    cols = reflect_indices(matrix.shape[1], padding)[None, :]
+
+    return (r_ders[rows, cols], c_ders[rows, cols])
+
+
 def cutout(matrix, row, col, r, c):
     return matrix[row : row + r, col : col + c]
 
@@ -54,3 +99,68 @@ def scale_down(matrix, reduction):
     new_matrix = np.reshape(matrix, (new_rows, reduction, new_cols, reduction)).mean(-1).mean(1)
 
     return new_matrix
+
+
+def block_means(matrix, reduction):
+    """Computes means of all (reduction, reduction) blocks of a matrix.
+    Element [r, c] of the result is the mean of matrix[r : r + reduction, c : c + reduction].
+    Values are summed in the same order as in scale_down, so the results are identical."""
+    rows = matrix.shape[0]
+    cols = matrix.shape[1]
+    row_stride, col_stride = matrix.strides
+
+    # Means of rows first, the same as .mean(-1) in scale_down
+    horizontal = as_strided(
+        matrix,
+        (rows, cols - reduction + 1, reduction),
+        (row_stride, col_stride, col_stride)).mean(-1)
+
+    # Then columns, summed one row after another as .mean(1) does
+    new_rows = rows - reduction + 1
+    means = horizontal[0 : new_rows].copy()
+    for i in range(1, reduction):
+        means += horizontal[i : i + new_rows]
+    means /= reduction
+
+    return means
+
+
+def block_sums(matrix, reduction):
+    """Computes sums of all (reduction, reduction) blocks of a matrix of integers, exactly in int64.
+    Element [r, c] of the result is the sum of matrix[r : r + reduction, c : c + reduction].
+    Sums of rows are differences of prefix sums of the rows, then the same is done for columns."""
+    rows = matrix.shape[0]
+    cols = matrix.shape[1]
+
+    prefix = np.zeros((rows, cols + 1), dtype=np.int64)
+    np.cumsum(matrix, axis=1, out=prefix[:, 1:])
+    horizontal = prefix[:, reduction:] - prefix[:, :-reduction]
+
+    prefix = np.zeros((rows + 1, cols - reduction + 1), dtype=np.int64)
+    np.cumsum(horizontal, axis=0, out=prefix[1:])
+    del horizontal
+
+    return prefix[reduction:] - prefix[:-reduction]
+
+
+def coarser_sums(sums, reduction, factor):
+    """Computes sums of all (reduction * factor, reduction * factor) blocks from sums of (reduction, reduction) blocks.
+    sums[r, c] is the sum of a block at [r, c], see block_sums. Element [r, c] of the result
+    is the sum of sums[r + i * reduction, c + j * reduction] for i, j in range(factor),
+    so every element costs 2 * factor additions instead of 2 * reduction * factor.
+    Integers are summed exactly, so the result is the same as block_sums of the matrix."""
+    rows = sums.shape[0]
+    cols = sums.shape[1]
+    span = reduction * (factor - 1)
+    new_rows = rows - span
+    new_cols = cols - span
+
+    horizontal = sums[:, 0 : new_cols].copy()
+    for j in range(1, factor):
+        horizontal += sums[:, j * reduction : j * reduction + new_cols]
+
+    coarser = horizontal[0 : new_rows].copy()
+    for i in range(1, factor):
+        coarser += horizontal[i * reduction : i * reduction + new_rows]
+
+    return coarser
@@ -1,6 +1,13 @@
-from .matrix_manipulation import cutout, scale_down
+from .matrix_manipulation import cutout, scale_down, block_means, block_sums, coarser_sums, quantize
 from .images import save_image
 import numpy as np
+import os
+import re
+
+# Layers are stored as float32 matrices of shape (pixels, cut * cut)
+LAYER_DTYPE = np.float32
+# Number of windows processed at once while reading or writing a layer
+CHUNK_SIZE = 1 << 20
 
 
 def get_window(image, row, col, reduction, cut):
@@ -17,29 +24,491 @@ def get_window(image, row, col, reduction, cut):
     return window
 
 
-def parse(image, cut, reduction, file_name):
-    """Parses an image into layer specified by the reduction. Saves the result into file."""
+def get_windows(image, row_start, row_end, col_start, col_end, reduction, cut, out=None):
+    """Cuts out windows for all pixels in rows [row_start, row_end) and columns [col_start, col_end) at once.
+    Returns matrix of shape (pixels, cut * cut). Row i contains the same values as
+    get_window(...).flatten() for i-th pixel in row by row order.
+    If out is given, windows are written into it instead of a new matrix."""
+    window_size = cut * reduction
+    row_range = row_end - row_start
+    col_range = col_end - col_start
+
+    # Part of the image covered by all the windows
+    region = cutout(image,
+        row_start - 2 - window_size // 2,
+        col_start - window_size // 2,
+        row_range + window_size - 1,
+        col_range + window_size - 1)
+    means = block_means(region, reduction)
+
+    if out is None:
+        out = np.empty((row_range * col_range, cut * cut), dtype=means.dtype)
+
+    windows = np.reshape(out, (row_range, col_range, cut * cut))
+    for i in range(cut):
+        for j in range(cut):
+            windows[:, :, i * cut + j] = cutout(means, i * reduction, j * reduction, row_range, col_range)
+
+    return out
+
+
+def level_windows(means, row_start, row_end, col_start, col_end, reduction, cut, out=None):
+    """Same as get_windows() read from block means of the whole image, see block_means and pyramid().
+    Windows of every pixel are read from means at offsets of reduction, nothing is averaged again."""
+    window_size = cut * reduction
+    row_range = row_end - row_start
+    col_range = col_end - col_start
+    top = row_start - 2 - window_size // 2
+    left = col_start - window_size // 2
+
+    if out is None:
+        out = np.empty((row_range * col_range, cut * cut), dtype=means.dtype)
+
+    windows = np.reshape(out, (row_range, col_range, cut * cut))
+    for i in range(cut):
+        for j in range(cut):
+            windows[:, :, i * cut + j] = cutout(means, top + i * reduction, left + j * reduction, row_range, col_range)
+
+    return out
+
+
+def level_means(image, reduction, scale=None):
+    """Returns block means of the image for the reduction, a level of pyramid().
+    scale: number
+        If values of the image are integers divided by scale, see rescale_quantized, blocks are summed
+        exactly in integers and divided once. Otherwise the means are the same as of block_means."""
+    if reduction == 1:
+        return image
+    if scale is None:
+        return block_means(image, reduction)
+
+    return block_sums(quantize(image, scale), reduction) / (reduction * reduction * scale)
+
+
+def pyramid(image, reductions, scale=None):
+    """Yields (reduction, block means of the image) for the reductions in increasing order, see level_means().
+    If values of the image are integers divided by scale, every level is summed from the previous one if its
+    reduction is a multiple of the previous reduction, see coarser_sums, so coarse levels cost less than
+    fine ones. Sums are exact, so every level is the same as level_means(image, reduction, scale).
+    Only the sums of the previous level are kept. Otherwise every level is computed from the image."""
+    previous = None
+    previous_reduction = 1
+
+    for reduction in sorted(reductions):
+        if reduction == 1 or scale is None:
+            yield (reduction, level_means(image, reduction, scale))
+            continue
+
+        if previous is None or reduction % previous_reduction != 0:
+            sums = block_sums(quantize(image, scale), reduction)
+        else:
+            sums = coarser_sums(previous, previous_reduction, reduction // previous_reduction)
+
+        yield (reduction, sums / (reduction * reduction * scale))
+        previous = sums
+        previous_reduction = reduction
+
+
+def get_windows_at(image, rows, cols, reduction, cut):
+    """Cuts out windows for pixels at given positions at once.
+    rows, cols: arrays of the same length with coordinates of the pixels.
+    Returns matrix of shape (pixels, cut * cut). Row i contains the same values as
+    get_window(image, rows[i], cols[i], reduction, cut).flatten()."""
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    window_size = cut * reduction
+    tops = rows - 2 - window_size // 2
+    lefts = cols - window_size // 2
+
+    if len(rows) == 0:
+        return np.empty((0, cut * cut), dtype=image.dtype)
+
+    # Block means only of the part of the image covered by the windows
+    top = np.min(tops)
+    left = np.min(lefts)
+    region = image[top : np.max(tops) + window_size, left : np.max(lefts) + window_size]
+    means = block_means(region, reduction) if reduction != 1 else region
+
+    offsets = np.arange(cut) * reduction
+    windows = means[
+        (tops - top)[:, None, None] + offsets[None, :, None],
+        (lefts - left)[:, None, None] + offsets[None, None, :]]
+
+    return np.reshape(windows, (len(rows), cut * cut))
+
+
+def level_windows_at(means, rows, cols, reduction, cut):
+    """Same as get_windows_at() read from block means of the whole image, see block_means and level_means().
+    Windows of every pixel are gathered from means at offsets of reduction, nothing is averaged again."""
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    window_size = cut * reduction
+    offsets = np.arange(cut) * reduction
+    tops = (rows - 2 - window_size // 2)[:, None, None] + offsets[None, :, None]
+    lefts = (cols - window_size // 2)[:, None, None] + offsets[None, None, :]
+
+    return np.reshape(means[tops, lefts], (len(rows), cut * cut))
+
+
+class SummedAreaTable:
+    """Integral image of an image, which values are integers divided by scale, see rescale_quantized.
+    Any block mean of the image is computed from it in 4 lookups, so windows of all reductions
+    are cut out in O(cut * cut) per window, see windows_at().
+    The integers are summed exactly in int64, so every mean is an exact sum divided once.
+    """
+
+    def __init__(self, image, scale):
+        self.dtype = image.dtype
+        self.scale = scale
+        self.sums = self.integral(quantize(image, scale))
+
+    @staticmethod
+    def integral(image):
+        table = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype=image.dtype)
+        np.cumsum(image, axis=0, out=table[1:, 1:])
+        np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+        return table
+
+    @staticmethod
+    def block_sums(table, corners, size):
+        # corners: flat indices of top left corners of the blocks in the table
+        width = table.shape[1]
+        table = np.ravel(table)
+        return (table[corners + size * width + size] - table[corners + size]
+            - table[corners + size * width] + table[corners])
+
+    def windows_at(self, rows, cols, reduction, cut):
+        """Same as get_windows_at() for the image of the table, the same as level_means(image, reduction, scale).
+        Values may differ from get_windows_at() in the last bits, but zeros and signs are exact."""
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        window_size = cut * reduction
+        offsets = np.arange(cut) * reduction
+        tops = (rows - 2 - window_size // 2)[:, None, None] + offsets[None, :, None]
+        lefts = (cols - window_size // 2)[:, None, None] + offsets[None, None, :]
+
+        corners = tops * self.sums.shape[1] + lefts
+        means = self.block_sums(self.sums, corners, reduction) / (reduction * reduction * self.scale)
+
+        return np.reshape(means, (len(rows), cut * cut)).astype(self.dtype, copy=False)
+
+
+def chunk_ranges(count, chunk_size=CHUNK_SIZE):
+    """Splits range(count) into consecutive (start, end) pairs of at most chunk_size elements."""
+    for start in range(0, count, chunk_size):
+        yield (start, min(start + chunk_size, count))
+
+
+def layer_geometry(rows, cols):
+    """Returns (row_start, row_end, col_start, col_end) of pixels parsed into layers from an image of given shape.
+    The range is the same for every reduction, so rows of all layers of an image correspond to each other."""
+    half_width = 160
+    return (half_width + 2, rows - half_width, half_width, cols - half_width)
+
+
+class SourceLayer:
+    """Layer that is not stored, but sampled from block means saved by parse_source.
+    It can be used instead of a memory-mapped layer: it has a shape and indexing it
+    by indices or a slice returns the same windows as the parsed layer would.
+    """
+
+    def __init__(self, file_name, reduction, cut=5):
+        self.means = np.load(file_name, mmap_mode="r")
+        self.reduction = reduction
+        self.cut = cut
+
+        rows = self.means.shape[0] + reduction - 1
+        cols = self.means.shape[1] + reduction - 1
+        self.row_start, row_end, self.col_start, col_end = layer_geometry(rows, cols)
+        self.col_range = col_end - self.col_start
+
+        self.dtype = self.means.dtype
+        self.shape = ((row_end - self.row_start) * self.col_range, cut * cut)
+        self.size = self.shape[0] * self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = np.arange(*index.indices(self.shape[0]))
+        else:
+            indices = np.asarray(index)
+
+        window_size = self.cut * self.reduction
+        offsets = np.arange(self.cut) * self.reduction
+        rows = self.row_start + indices // self.col_range - 2 - window_size // 2
+        cols = self.col_start + indices % self.col_range - window_size // 2
+
+        windows = self.means[
+            rows[:, None, None] + offsets[None, :, None],
+            cols[:, None, None] + offsets[None, None, :]]
+
+        return np.reshape(windows, (len(indices), self.cut * self.cut))
+
+    def nonzero_rows(self):
+        """Returns indices of windows, that contain at least one nonzero value, see nonzero_rows().
+        Windows are not cut out, nonzero block means are combined over the window pattern instead:
+        first over its columns, then over its rows. The block means are read by chunks of rows."""
+        window_size = self.cut * self.reduction
+        span = (self.cut - 1) * self.reduction
+        top = self.row_start - 2 - window_size // 2
+        left = self.col_start - window_size // 2
+        row_range = self.shape[0] // self.col_range
+
+        indices = [np.empty(0, dtype=np.intp)]
+        chunk_rows = max(1, CHUNK_SIZE // self.col_range)
+        for start, end in chunk_ranges(row_range, chunk_rows):
+            nonzero = np.asarray(self.means[top + start : top + end + span, left : left + self.col_range + span]) != 0
+
+            columns = np.zeros((nonzero.shape[0], self.col_range), dtype=bool)
+            for j in range(self.cut):
+                columns |= nonzero[:, j * self.reduction : j * self.reduction + self.col_range]
+
+            windows = np.zeros((end - start, self.col_range), dtype=bool)
+            for i in range(self.cut):
+                windows |= columns[i * self.reduction : i * self.reduction + end - start]
+
+            indices.append(np.flatnonzero(windows) + start * self.col_range)
+
+        return np.concatenate(indices)
+
+
+def source_weights(rows, cols, reduction, cut=5):
+    """Returns (row weights, column weights) of block means of an image of shape (rows, cols) saved by parse_source.
+    A block mean appears in row_weights[row] * col_weights[col] windows of the layer sampled from them,
+    so weighted statistics of the block means are the statistics of the whole layer."""
+    row_start, row_end, col_start, col_end = layer_geometry(rows, cols)
+    window_size = cut * reduction
+    row_weights = np.zeros(rows - reduction + 1)
+    col_weights = np.zeros(cols - reduction + 1)
+
+    for i in range(cut):
+        top = row_start - 2 - window_size // 2 + i * reduction
+        left = col_start - window_size // 2 + i * reduction
+        row_weights[top : top + row_end - row_start] += 1
+        col_weights[left : left + col_end - col_start] += 1
+
+    return (row_weights, col_weights)
+
+
+class NormalizedLayer:
+    """Layer normalized by standard score when it is indexed, see normalize_heights.
+    It is used instead of storing a normalized copy of the layer."""
+
+    def __init__(self, layer, mean, std):
+        self.layer = layer
+        self.mean = mean
+        self.std = std
+        self.dtype = layer.dtype
+        self.shape = layer.shape
+        self.size = layer.size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return ((self.layer[index] - self.mean) / self.std).astype(self.dtype, copy=False)
+
+
+class RunningStatistics:
+    """Mean and standard deviation of values seen by chunks in a single pass.
+    Statistics of every chunk are merged into the running ones as in Welford's algorithm
+    (the parallel variant by Chan et al.), so they stay precise for any number of chunks."""
+
+    def __init__(self):
+        self.count = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values, weights=None):
+        """Adds values of a chunk, each of them weights times if weights are given.
+        weights are broadcast to the shape of values.
+        Values of any type are accumulated in float64."""
+        if weights is None:
+            count = np.size(values)
+            mean = np.mean(values, dtype=np.float64)
+            m2 = np.sum(np.subtract(values, mean, dtype=np.float64) ** 2)
+        else:
+            weights = np.broadcast_to(weights, np.shape(values))
+            count = np.sum(weights)
+            if count == 0:
+                return
+            mean = np.sum(weights * values, dtype=np.float64) / count
+            m2 = np.sum(weights * np.subtract(values, mean, dtype=np.float64) ** 2)
+
+        if count == 0:
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+
+def layer_files(file_name):
+    """For a layer file returns (file of the layer it is normalized from, file of block means it can be
+    sampled from, file with its normalization statistics). The first and the last are None if the layer
+    is not normalized, all of them if the name is not a name of a layer. See load_layer()."""
+    folder, name = os.path.split(file_name)
+    match = re.fullmatch(r"(normalized_)?(.*)layer(.*)_(\d+)x\.npy", name)
+    if match is None:
+        return (None, None, None)
+
+    normalized, prefix, suffix, reduction = match.groups()
+    source = os.path.join(folder, f"{prefix}source{suffix}_{reduction}x.npy")
+    if not normalized:
+        return (None, source, None)
+
+    plain = os.path.join(folder, f"{prefix}layer{suffix}_{reduction}x.npy")
+    statistics = os.path.join(folder, f"{prefix}normalization{suffix}_{reduction}x.npy")
+
+    return (plain, source, statistics)
+
+
+def load_layer(file_name):
+    """Opens a parsed layer memory-mapped, read only. Nothing is read until the layer is indexed.
+    If the image was parsed with sample_first, returns SourceLayer sampling the same windows.
+    A normalized layer, that is not stored, is returned as NormalizedLayer of the plain layer."""
+    plain, source, statistics = layer_files(file_name)
+
+    if os.path.exists(file_name) or source is None:
+        return np.load(file_name, mmap_mode="r")
+
+    if statistics is not None and os.path.exists(statistics):
+        mean, std = np.load(statistics)
+        return NormalizedLayer(load_layer(plain), mean, std)
+
+    if not os.path.exists(source):
+        return np.load(file_name, mmap_mode="r")
+
+    reduction = int(re.search(r"_(\d+)x\.npy$", file_name).group(1))
+    return SourceLayer(source, reduction)
+
+
+def gather_rows(layer, indices, chunk_size=CHUNK_SIZE):
+    """Returns layer[indices]. Indices are sorted and gathered by chunks of chunk_size,
+    so a memory-mapped layer is read from the start to the end, every part of it at most once."""
+    indices = np.asarray(indices)
+    order = np.argsort(indices, kind="stable")
+    sorted_indices = indices[order]
+
+    rows = np.empty((len(indices),) + tuple(layer.shape[1:]), dtype=layer.dtype)
+    for start, end in chunk_ranges(len(indices), chunk_size):
+        rows[order[start : end]] = layer[sorted_indices[start : end]]
+
+    return rows
+
+
+class LayerCache:
+    """Layers opened by load_layer(), every layer is opened only once.
+    Used to construct several datasets from the same layers, see process_training_data."""
+
+    def __init__(self):
+        # {file name: memory-mapped layer or SourceLayer}
+        self.layers = {}
+
+    def __getitem__(self, file_name):
+        if file_name not in self.layers:
+            self.layers[file_name] = load_layer(file_name)
+
+        return self.layers[file_name]
+
+    def gather(self, file_name, indices):
+        """Returns rows of a layer at given indices, see gather_rows()."""
+        return gather_rows(self[file_name], indices)
+
+
+def nonzero_rows(layer):
+    """Returns indices of windows in a layer, that contain at least one nonzero value.
+    Windows of a SourceLayer are not cut out for it, see SourceLayer.nonzero_rows()."""
+    if isinstance(layer, SourceLayer):
+        return layer.nonzero_rows()
+
+    indices = [np.empty(0, dtype=np.intp)]
+    for start, end in chunk_ranges(layer.shape[0]):
+        chunk = np.asarray(layer[start : end])
+        indices.append(np.flatnonzero(np.any(chunk != 0, axis=1)) + start)
+
+    return np.concatenate(indices)
+
+
+def parse(image, cut, reduction, file_name, statistics=None, means=None, scale=None):
+    """Parses an image into layer specified by the reduction. Saves the result into file.
+    The layer is written by chunks of rows into a memory-mapped file, so it never has to fit into memory.
+    statistics: RunningStatistics
+        If given, values of the layer are added into it while they are written.
+    means: matrix
+        Block means of the image for the reduction, see pyramid(). Computed from the image if not given.
+    scale: number
+        Values of the image are integers divided by scale, see level_means()."""
 
     rows = image.shape[0]
     cols = image.shape[1]
 
-    half_width = 160
-    row_start = half_width + 2
-    row_end = rows - half_width
-    row_range = row_end - row_start
-    col_start = half_width
-    col_end = cols - half_width
+    row_start, row_end, col_start, col_end = layer_geometry(rows, cols)
     col_range = col_end - col_start
-    
-    tokens = [None] * (row_range * col_range)
-    indices = [[x] for x in range(len(tokens))]
-
-    
-    def func(_index):
-        i = _index[0]
-        row = row_start + i // col_range
-        col = col_start + i % col_range
-        tokens[i] = get_window(image, row, col, reduction, cut).flatten()
-        
-    np.apply_along_axis(func, 1, indices)
-    np.save(file_name, tokens, allow_pickle=True)
\ No newline at end of file
+
+    tokens = np.lib.format.open_memmap(
+        f"{file_name}.npy",
+        mode="w+",
+        dtype=LAYER_DTYPE,
+        shape=((row_end - row_start) * col_range, cut * cut))
+
+    if means is None:
+        means = level_means(image, reduction, scale)
+
+    chunk_rows = max(1, CHUNK_SIZE // col_range)
+    for start, end in chunk_ranges(row_end - row_start, chunk_rows):
+        level_windows(
+            means,
+            row_start + start, row_start + end,
+            col_start, col_end,
+            reduction, cut,
+            out=tokens[start * col_range : end * col_range])
+        if statistics is not None:
+            statistics.update(tokens[start * col_range : end * col_range])
+
+    tokens.flush()
+    del tokens
+
+
+def parse_source(image, reduction, file_name, statistics=None, cut=5, means=None, scale=None):
+    """Saves means of all (reduction, reduction) blocks of an image into file.
+    Windows of the layer specified by the reduction are later sampled from them by SourceLayer,
+    so the layer itself, which is cut * cut times bigger, is never stored.
+    statistics: RunningStatistics
+        If given, values of the layer sampled from the block means are added into it, see source_weights().
+    means: matrix
+        Block means of the image for the reduction, see pyramid(). Computed by chunks from the image if not given.
+    scale: number
+        Values of the image are integers divided by scale, see level_means()."""
+
+    rows = image.shape[0]
+    cols = image.shape[1]
+
+    saved = np.lib.format.open_memmap(
+        f"{file_name}.npy",
+        mode="w+",
+        dtype=LAYER_DTYPE,
+        shape=(rows - reduction + 1, cols - reduction + 1))
+
+    if statistics is not None:
+        row_weights, col_weights = source_weights(rows, cols, reduction, cut)
+
+    chunk_rows = max(reduction, CHUNK_SIZE // cols)
+    for start, end in chunk_ranges(saved.shape[0], chunk_rows):
+        if means is None:
+            saved[start : end] = level_means(image[start : end + reduction - 1], reduction, scale)
+        else:
+            saved[start : end] = means[start : end]
+        if statistics is not None:
+            statistics.update(saved[start : end], row_weights[start : end, None] * col_weights[None, :])
+
+    saved.flush()
+    del saved
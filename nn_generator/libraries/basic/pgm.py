@@ -0,0 +1,87 @@
+import numpy as np
+import re
+
+# Header of a PGM file: magic number, width, height and maximal value, separated by whitespace or comments
+HEADER = re.compile(rb"(P[25])(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+([\d.]+)\s")
+
+
+def pgm_dtype(maxval):
+    """Type of PGM values: 8 bits up to 255, otherwise 16 bits, big-endian as in the format."""
+    if maxval < 256:
+        return np.dtype(np.uint8)
+    return np.dtype(">u2")
+
+
+def read_pgm_header(file_name):
+    """Returns (magic number, shape, maximal value, offset of the data) of a PGM file."""
+    with open(file_name, "rb") as f:
+        start = f.read(1024)
+
+    match = HEADER.match(start)
+    if match is None:
+        raise ValueError(f"'{file_name}' is not a PGM image.")
+
+    magic, width, height, maxval = match.groups()
+    maxval = float(maxval)
+    if maxval == int(maxval):
+        maxval = int(maxval)
+
+    return (magic.decode(), (int(height), int(width)), maxval, match.end())
+
+
+def read_pgm(file_name, mmap=False):
+    """Reads a PGM image into a matrix of shape (height, width).
+    Binary (P5) images are read directly with np.fromfile, 8-bit as uint8 and 16-bit as big-endian uint16.
+    mmap: bool
+        Returns the data of a binary image memory-mapped instead, nothing is read until it is used.
+    ASCII (P2) images are parsed, their values are uint8 or uint16 by the maximal value, or float64
+    if they are not integers.
+    """
+    magic, shape, maxval, offset = read_pgm_header(file_name)
+
+    if magic == "P5":
+        dtype = pgm_dtype(maxval)
+        if mmap:
+            return np.memmap(file_name, dtype=dtype, mode="r", offset=offset, shape=shape)
+        with open(file_name, "rb") as f:
+            f.seek(offset)
+            return np.reshape(np.fromfile(f, dtype=dtype, count=shape[0] * shape[1]), shape)
+
+    with open(file_name, "rb") as f:
+        f.seek(offset)
+        text = re.sub(rb"#[^\n]*", b"", f.read())
+    values = np.array(text.split()[: shape[0] * shape[1]], dtype=np.float64)
+    if isinstance(maxval, int) and np.all(values == np.trunc(values)):
+        values = values.astype(pgm_dtype(maxval).newbyteorder("="))
+
+    return np.reshape(values, shape)
+
+
+def write_pgm(matrix, file_name, maxval=None):
+    """Writes a matrix of integers into a binary (P5) PGM image, 8-bit if maxval < 256, otherwise 16-bit.
+    maxval: int
+        Maximal value of the image, maximum of the matrix by default.
+    """
+    if maxval is None:
+        maxval = max(int(np.max(matrix)), 1)
+    if np.min(matrix) < 0:
+        raise ValueError("PGM values can not be negative.")
+    if maxval > 65535:
+        raise ValueError(f"PGM values can have at most 16 bits, maximal value is {maxval}.")
+
+    with open(file_name, "wb") as f:
+        f.write(f"P5\n{matrix.shape[1]} {matrix.shape[0]}\n{maxval}\n".encode())
+        np.ascontiguousarray(matrix, dtype=pgm_dtype(maxval)).tofile(f)
+
+
+def write_pgm_rescaled(matrix, file_name, bits=16):
+    """Writes a matrix of any values into a binary PGM image, rescaled to the full range of given bits."""
+    maxval = (1 << bits) - 1
+    minimum = np.min(matrix)
+    length = np.max(matrix) - minimum
+    if length == 0:
+        scaled = np.zeros(matrix.shape)
+    else:
+        scaled = (matrix - minimum) / length * maxval
+
+    write_pgm(np.round(scaled), file_name, maxval)
@@ -1,10 +1,11 @@
 import numpy as np
 import math
 
-def noisify_exp(matrix, val):
-    """Applies random noise with exponential distribution to a matrix."""
+def noisify_exp(matrix, val, generator=np.random):
+    """Applies random noise with exponential distribution to a matrix.
+    generator: numpy.random or numpy.random.RandomState to draw the noise from."""
     l = abs(np.max(matrix) - np.min(matrix))
-    return matrix + np.random.exponential(l / val, matrix.shape)
+    return matrix + generator.exponential(l / val, matrix.shape)
 
 def noisify_cauchy(matrix, rng):
     """Applies random noise with cauchy distribution to a matrix."""
@@ -129,4 +130,179 @@ def relativization(arr):
     """Changes array elements to be relative to some absolute value."""
     absolute = np.average(arr)
     arr -= absolute
-    return absolute
\ No newline at end of file
+    return absolute
+
+
+# Batched versions
+#==================
+# The following functions work on whole matrices of shape (N, k) at once.
+# Their results are bit-identical to the functions above applied row by row.
+
+def _scalar_dtype(matrix):
+    # Type of arithmetic between a single element of the matrix and a python number.
+    # Older numpy promotes float32 scalars to float64 there, while whole arrays stay float32.
+    return (np.asarray(matrix).dtype.type(0) + 0.0).dtype
+
+def noisify_exp_rows(matrix, val, generator=np.random):
+    """Applies noisify_exp to every row of a matrix.
+    Random numbers are drawn in the same order as when noisifying row by row.
+    generator: numpy.random or numpy.random.RandomState to draw the noise from."""
+    l = np.abs(np.max(matrix, axis=-1) - np.min(matrix, axis=-1))
+    l = l.astype(_scalar_dtype(matrix))
+    return matrix + generator.exponential((l / val)[..., None], matrix.shape)
+
+def relativization_matrix(matrix):
+    """Applies relativization to every row of a matrix. Returns the absolute value of each row."""
+    absolute = np.average(matrix, axis=-1)
+    matrix -= absolute[..., None]
+    return absolute
+
+def _log2(matrix):
+    # math.log2 for every element, vectorized np.log2 may differ from it in the last bit
+    matrix = np.asarray(matrix, dtype=np.float64)
+    logs = np.fromiter(map(math.log2, matrix.ravel()), dtype=np.float64, count=matrix.size)
+    return np.reshape(logs, matrix.shape)
+
+def _power_of_two(matrix):
+    # 2**x for every element with the same scalar arithmetic as the unbatched decoders
+    powers = np.asarray([2 ** x for x in np.ravel(matrix)], dtype=_scalar_dtype(matrix))
+    return np.reshape(powers, np.shape(matrix))
+
+def _log_values(matrix, encoding_length, exact=True):
+    # Values encoded by unary_log_encoding, encoding_length for zeros.
+    # Not exact values are computed faster, but may differ in the last bit.
+    magnitudes = np.abs(np.asarray(matrix, dtype=np.float64))
+    nonzero = magnitudes != 0
+    x = np.full(magnitudes.shape, float(encoding_length))
+    x[nonzero] = -(_log2 if exact else np.log2)(magnitudes[nonzero])
+    return x
+
+def _unary_encoding_matrix(matrix, encoding_length, reversed):
+    x = np.ravel(matrix)
+    # int() never returns negative zero
+    _int = np.trunc(x) + 0.0
+    _max = np.minimum(_int, encoding_length)
+
+    ones = np.arange(encoding_length)[None, :] < _max[:, None]
+    if reversed:
+        encoded = np.where(ones, 0.0, 1.0)
+    else:
+        encoded = np.where(ones, 1.0, 0.0)
+
+    # Negative positions wrap around, the same as in unary_encoding
+    partial = np.flatnonzero(_max < encoding_length)
+    fractions = x[partial] - _int[partial]
+    if reversed:
+        fractions = 1 - fractions
+    encoded[partial, _max[partial].astype(np.intp)] = fractions
+
+    return encoded
+
+def _encoded_shape(shape, encoding_length):
+    return tuple(shape[:-1]) + (shape[-1] * encoding_length,)
+
+def unary_encoding_matrix(matrix, encoding_length):
+    """Batched unary_encoding. Returns matrix of shape (N, k * encoding_length)."""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    encoded = _unary_encoding_matrix(matrix, encoding_length, False)
+    return np.reshape(encoded, _encoded_shape(matrix.shape, encoding_length))
+
+def unary_encoding_matrix_reversed(matrix, encoding_length):
+    """Batched unary_encoding_reversed. Returns matrix of shape (N, k * encoding_length)."""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    encoded = _unary_encoding_matrix(matrix, encoding_length, True)
+    return np.reshape(encoded, _encoded_shape(matrix.shape, encoding_length))
+
+def unary_log_encoding_matrix(matrix, encoding_length):
+    """Batched unary_log_encoding_array. Returns matrix of shape (N, k * encoding_length)."""
+    matrix = np.asarray(matrix)
+    encoded = _unary_encoding_matrix(_log_values(matrix, encoding_length), encoding_length, False)
+    encoded[np.ravel(matrix) < 0] *= -1
+    return np.reshape(encoded, _encoded_shape(matrix.shape, encoding_length))
+
+def unary_log_encoding_matrix_reversed(matrix, encoding_length):
+    """Batched unary_log_encoding_array_reversed. Returns matrix of shape (N, k * encoding_length)."""
+    matrix = np.asarray(matrix)
+    encoded = _unary_encoding_matrix(_log_values(matrix, encoding_length), encoding_length, True)
+    encoded[np.ravel(matrix) < 0] *= -1
+    return np.reshape(encoded, _encoded_shape(matrix.shape, encoding_length))
+
+def unary_linear_encoding_matrix(matrix, encoding_length):
+    """Batched unary_linear_encoding_array. Returns matrix of shape (N, k * encoding_length)."""
+    matrix = np.asarray(matrix)
+    x = np.abs(matrix.astype(_scalar_dtype(matrix)) * encoding_length)
+    encoded = _unary_encoding_matrix(np.asarray(x, dtype=np.float64), encoding_length, False)
+    encoded[np.ravel(matrix) < 0] *= -1
+    return np.reshape(encoded, _encoded_shape(matrix.shape, encoding_length))
+
+def unary_log_decoding_matrix(matrix, encoding_length):
+    """Batched unary_log_decoding_array. Decodes every encoding_length elements of a row.
+    Returns matrix of shape (N, k / encoding_length)."""
+    matrix = np.asarray(matrix)
+    groups = np.reshape(matrix, matrix.shape[:-1] + (-1, encoding_length))
+    s = np.sum(groups, axis=-1)
+    sum = np.sum(abs(groups), axis=-1)
+
+    return _power_of_two(-abs(sum)) * np.sign(s)
+
+def unary_log_decoding_matrix_reversed(matrix):
+    """Batched unary_log_decoding_reversed. Decodes every row of a matrix, returns vector of N values."""
+    matrix = np.asarray(matrix)
+    _sum = 0
+    for k in range(matrix.shape[-1]):
+        column = matrix[..., k].astype(_scalar_dtype(matrix))
+        term = -_power_of_two(-abs(column) - k) + 2**-k
+        term[column < 0] *= -1
+        _sum = _sum + term
+
+    return _sum
+
+
+# Unary encodings without encoding
+#==================================
+# A unary encoding of a value is a run of ones (or zeros, if reversed) followed by one partial entry.
+# The following functions describe the encodings of every element of a matrix by four matrices of its shape:
+# signs (-1 for negative values), counts of leading ones (leading zeros if reversed),
+# positions of the partial entries and deltas, by which the partial entries differ from the runs.
+# Encoding of an element is then signs * (run + deltas * one_hot(positions)).
+# Partial entries may differ from the encoders in the last bit, logarithms are not computed exactly here.
+
+def _unary_runs(matrix, encoding_length, reversed):
+    x = np.ravel(matrix)
+    _int = np.trunc(x) + 0.0
+    _max = np.minimum(_int, encoding_length)
+    counts = np.clip(_max, 0, encoding_length).astype(np.intp)
+
+    # Negative positions wrap around, the same as in unary_encoding
+    partial = _max < encoding_length
+    positions = np.where(partial, _max, 0).astype(np.intp) % encoding_length
+
+    fractions = x - _int
+    if reversed:
+        values = 1 - fractions
+        run = positions >= counts
+    else:
+        values = fractions
+        run = positions < counts
+    deltas = np.where(partial, values - run, 0.0)
+
+    return (np.reshape(counts, np.shape(matrix)),
+        np.reshape(positions, np.shape(matrix)),
+        np.reshape(deltas, np.shape(matrix)))
+
+def _signs(matrix):
+    return np.where(np.asarray(matrix) < 0, -1.0, 1.0)
+
+def unary_log_runs(matrix, encoding_length):
+    """unary_log_encoding_matrix described as (signs, counts, positions, deltas)."""
+    return (_signs(matrix),) + _unary_runs(_log_values(matrix, encoding_length, False), encoding_length, False)
+
+def unary_log_runs_reversed(matrix, encoding_length):
+    """unary_log_encoding_matrix_reversed described as (signs, counts, positions, deltas)."""
+    return (_signs(matrix),) + _unary_runs(_log_values(matrix, encoding_length, False), encoding_length, True)
+
+def unary_linear_runs(matrix, encoding_length):
+    """unary_linear_encoding_matrix described as (signs, counts, positions, deltas)."""
+    matrix = np.asarray(matrix)
+    x = np.abs(matrix.astype(_scalar_dtype(matrix)) * encoding_length)
+    return (_signs(matrix),) + _unary_runs(np.asarray(x, dtype=np.float64), encoding_length, False)
@@ -0,0 +1,113 @@
+from .numpy_model import row_independent
+import numpy as np
+import threading
+
+
+class ModelBatcher:
+    """Evaluates calls of networks coming from several threads together.
+    Every thread generates one map. A call waits until all running threads are waiting for a call too,
+    then calls of the same function with the same network are stacked into a single call.
+    The functions have to process every input row independently, so that each thread gets
+    the same outputs as without batching. BatchedModel evaluates NumpyModels row independently for it,
+    see NumpyModel.row_independent().
+    """
+
+    def __init__(self, threads):
+        self.condition = threading.Condition()
+        self.running = threads
+        # [(thread index, network, function, arguments, result)]
+        self.pending = []
+
+    def call(self, index, model, function, arguments):
+        """Returns function(model, *arguments), evaluated together with calls of other threads.
+        arguments: matrices with a row for every input, or lists and tuples of them."""
+        result = {}
+        with self.condition:
+            self.pending.append((index, model, function, arguments, result))
+            if len(self.pending) == self.running:
+                self.evaluate()
+            while not result:
+                self.condition.wait()
+
+        if "error" in result:
+            raise result["error"]
+        return result["output"]
+
+    def finish(self):
+        """Called by a thread, that does not evaluate networks anymore."""
+        with self.condition:
+            self.running -= 1
+            if self.pending and len(self.pending) == self.running:
+                self.evaluate()
+
+    def evaluate(self):
+        # Groups are stacked in the order of threads, so they are the same in every run
+        groups = {}
+        for call in sorted(self.pending, key=lambda call: call[0]):
+            groups.setdefault((id(call[1]), call[2]), []).append(call)
+
+        for calls in groups.values():
+            model, function = calls[0][1], calls[0][2]
+            try:
+                outputs = np.asarray(function(model, *stack([arguments for _, _, _, arguments, _ in calls])))
+                start = 0
+                for _, _, _, arguments, result in calls:
+                    count = rows(arguments)
+                    result["output"] = outputs[start : start + count]
+                    start += count
+            except Exception as error:
+                for _, _, _, _, result in calls:
+                    result["error"] = error
+
+        self.pending = []
+        self.condition.notify_all()
+
+
+def stack(items):
+    # Concatenates matrices of the same place in the items
+    if isinstance(items[0], np.ndarray):
+        return np.concatenate(items)
+    if isinstance(items[0], (tuple, list)):
+        return type(items[0])(stack(parts) for parts in zip(*items))
+    return items[0]
+
+def rows(arguments):
+    # Number of inputs in arguments of a call
+    if isinstance(arguments, np.ndarray):
+        return len(arguments)
+    return rows(next(argument for argument in arguments if isinstance(argument, (np.ndarray, tuple, list))))
+
+def call_model(model, inputs):
+    return model(inputs)
+
+
+class BatchedModel:
+    """Network, whose calls are evaluated together with calls of other threads by ModelBatcher."""
+
+    def __init__(self, batcher, index, model):
+        self.batcher = batcher
+        self.index = index
+        self.model = row_independent(model)
+
+    def __call__(self, inputs):
+        return self.batcher.call(self.index, self.model, call_model, (np.asarray(inputs),))
+
+    def evaluate(self, function, *arguments):
+        """Returns function(network, *arguments) evaluated together with other threads."""
+        return self.batcher.call(self.index, self.model, function, arguments)
+
+    def first_layer(self, *args, **kwargs):
+        # Needs only the kernel, it is not worth to wait for other threads
+        return self.model.first_layer(*args, **kwargs)
+
+
+class BatchedModelSet:
+    """ModelSet, whose networks are BatchedModels."""
+
+    def __init__(self, batcher, index, models):
+        self.batcher = batcher
+        self.index = index
+        self.models = models
+
+    def __getitem__(self, name):
+        return BatchedModel(self.batcher, self.index, self.models[name])
@@ -0,0 +1,162 @@
+from .tracing import skip
+import hashlib
+import json
+import os
+import sys
+import types
+
+# Number of bytes hashed at once
+HASH_CHUNK = 1 << 20
+
+
+def file_digest(file_name):
+    """Returns SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def code_version(*objects):
+    """Returns a digest of the source of modules of this package, that the functions or classes use.
+    Modules are followed through their imports, so the digest changes with any code they depend on."""
+    package = __name__.rsplit(".", 1)[0]
+    modules = set()
+
+    def visit(name):
+        if not isinstance(name, str) or name in modules or not name.startswith(package) or name not in sys.modules:
+            return
+        modules.add(name)
+
+        for value in vars(sys.modules[name]).values():
+            visit(value.__name__ if isinstance(value, types.ModuleType) else getattr(value, "__module__", None))
+
+    for obj in objects:
+        visit(obj.__module__)
+
+    digest = hashlib.sha256()
+    for name in sorted(modules):
+        digest.update(name.encode())
+        digest.update(file_digest(sys.modules[name].__file__).encode())
+
+    return digest.hexdigest()
+
+
+def snapshot(paths):
+    """Returns {file: (size, modification time)} of files and of all files in folders."""
+    files = {}
+    for path in paths:
+        if os.path.isfile(path):
+            names = [path]
+        else:
+            names = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+
+        for name in names:
+            stat = os.stat(name)
+            files[name] = (stat.st_size, stat.st_mtime_ns)
+
+    return files
+
+
+def digest_of(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class CachedStage:
+    """Stage of learn(), that runs only if its manifest changed since its last run.
+    The manifest of a stage contains digests of:
+        its input files,
+        the arguments it is called with,
+        the code it uses, see code_version(),
+        outputs of the stages it depends on.
+    After a run, the manifest is saved into folder together with sizes and modification times
+    of the files the stage wrote into its outputs. Next time the stage is skipped if the manifest
+    is the same and those files are unchanged. Stages depending on it run again whenever it does.
+    name: str
+        Unique name of the stage.
+    function:
+        Called with the arguments of the stage.
+    inputs: [str]
+        Files read by the stage, that are not written by other stages.
+    outputs: [str]
+        Files or folders written by the stage.
+    code: [function or class]
+        Code of the stage, see code_version().
+    dependencies: [str]
+        Names of stages, whose outputs the stage reads.
+    """
+
+    def __init__(self, folder, name, function, inputs=(), outputs=(), code=(), dependencies=()):
+        self.folder = folder
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code) or [function]
+        self.dependencies = list(dependencies)
+
+    def manifest_file(self, name):
+        return f"{self.folder}/{name.replace(' ', '_')}.json"
+
+    def load_manifest(self, name):
+        if not os.path.exists(self.manifest_file(name)):
+            return None
+        with open(self.manifest_file(name)) as f:
+            return json.load(f)
+
+    def manifest(self, arguments, keywords):
+        def dependency_digest(name):
+            manifest = self.load_manifest(name)
+            return None if manifest is None else digest_of([manifest["key"], manifest["outputs"]])
+
+        manifest = {
+            "inputs": {name: file_digest(name) for name in self.inputs if os.path.exists(name)},
+            "parameters": digest_of([arguments, keywords]),
+            "code": code_version(*self.code),
+            "dependencies": {name: dependency_digest(name) for name in self.dependencies}
+        }
+        manifest["key"] = digest_of(manifest)
+
+        return manifest
+
+    def up_to_date(self, manifest):
+        previous = self.load_manifest(self.name)
+        if previous is None or previous["key"] != manifest["key"]:
+            return False
+
+        for name, (size, time) in previous["outputs"].items():
+            if not os.path.exists(name):
+                return False
+            stat = os.stat(name)
+            if (stat.st_size, stat.st_mtime_ns) != (size, time):
+                return False
+
+        return True
+
+    def __call__(self, *arguments, **keywords):
+        manifest = self.manifest(arguments, keywords)
+        if self.up_to_date(manifest):
+            print(f"Stage '{self.name}' is up to date, skipped.")
+            skip()
+            return None
+
+        # A stage that fails has no manifest, so it runs again next time
+        if os.path.exists(self.manifest_file(self.name)):
+            os.remove(self.manifest_file(self.name))
+
+        before = snapshot(self.outputs)
+        result = self.function(*arguments, **keywords)
+        after = snapshot(self.outputs)
+        manifest["outputs"] = {name: stat for name, stat in after.items() if before.get(name) != stat}
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+
+        temporary = self.manifest_file(self.name) + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temporary, self.manifest_file(self.name))
+
+        return result
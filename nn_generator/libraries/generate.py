@@ -1,9 +1,17 @@
-from .basic.matrix_manipulation import rescale, cutout, derivatives
-from .basic.images import save_image, init_cmaps, save_all, show_image
-from .basic.parsing import get_window
-from .basic.utilities import noisify_exp, unary_log_encoding_array, unary_log_decoding, relativization, unary_linear_encoding,  unary_log_encoding_array_reversed, unary_log_decoding_reversed
-from tensorflow.keras.models import load_model
+from .basic.matrix_manipulation import rescale, rescale_quantized, cutout, padded_derivatives, block_means
+from .basic.images import init_cmaps, show_image, ImageWriter
+from .basic.parsing import get_windows_at, level_windows_at, SummedAreaTable
+from .basic.pgm import read_pgm, write_pgm_rescaled
+from .basic.utilities import noisify_exp, relativization_matrix, unary_linear_encoding_matrix, unary_log_encoding_matrix, unary_log_encoding_matrix_reversed, unary_log_decoding_matrix, unary_log_decoding_matrix_reversed
+from .model_registry import registry
+from .numpy_model import row_independent as independent_rows
+from .batching import ModelBatcher, BatchedModel, BatchedModelSet
+from .tracing import stage, record_call, tracing, active
+from .processes import process_context, share, unshare
 from copy import deepcopy
+import threading
+import queue
+import time
 import sys
 import os
 import numpy as np
@@ -15,25 +23,339 @@ def check_path(path):
         print(f"'{path}' does not exist.")
         sys.exit()
 
-def load_data(model_file, data_folder, result_folder, data_name):
+def wavefronts(rows, cols, padding):
+    """Splits positions of the generated area into groups of pixels that can be generated at once.
+    Yields pairs of arrays (rows, cols) of the groups in the order they have to be generated.
+
+    Recurrent window of a pixel contains 2 pixels to the left in its row and pixels
+    up to 2 columns to the right in previous rows. So pixel [r, c] only depends on pixels
+    with smaller col + 3 * row, and all pixels with the same col + 3 * row are independent.
+    """
+    for front in range(cols + 3 * (rows - 1)):
+        first_row = max(0, (front - cols + 3) // 3)
+        last_row = min(rows - 1, front // 3)
+        front_rows = np.arange(first_row, last_row + 1)
+        yield (front_rows + padding, front - 3 * front_rows + padding)
+
+def tile_pixels(rows, cols, i, j, height, width):
+    """Positions of pixels of a tile, see generate_tiles(). Returns arrays (rows, cols) ordered by col + 3 * row."""
+    tile_rows = np.arange(i * height, min(rows, (i + 1) * height))
+    first = np.clip(j * width - 3 * tile_rows, 0, cols)
+    last = np.clip((j + 1) * width - 3 * tile_rows, 0, cols)
+    counts = last - first
+
+    rs = np.repeat(tile_rows, counts)
+    cs = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts - first, counts)
+    order = np.lexsort((rs, cs + 3 * rs))
+    return (rs[order], cs[order])
+
+# StageModel generated by the workers of generate_tiles()
+_tile_stage = None
+
+def _init_tile_worker(data, arrays):
+    global _tile_stage
+    _tile_stage = unshare(data, arrays)
+
+def _generate_tile(task):
+    """Generates one tile. patch contains the tile with 4 rows above it and 2 columns on both sides,
+    which are read by recurrent windows of its pixels. Returns positions and generated values of the tile."""
+    i, j, rows, cols, height, width, top, left, patch = task
+    rs, cs = tile_pixels(rows, cols, i, j, height, width)
+    padding = _tile_stage.context.padding
+
+    contexts = _tile_stage.contexts(rs + padding, cs + padding)
+    patch_rs = rs + padding - top
+    patch_cs = cs + padding - left
+    fronts = np.flatnonzero(np.diff(cs + 3 * rs)) + 1
+    for front in np.split(np.arange(len(rs)), fronts):
+        _tile_stage.step(contexts[front], patch, patch_rs[front], patch_cs[front])
+
+    return (i, j, rs, cs, patch[patch_rs, patch_cs])
+
+def generate_tiles(stage_model, generated, padding, rows, cols, tile_size, workers):
+    """Generates a stage by tiles on a pool of workers, see StageModel.
+
+    Pixel [r, c] only depends on pixels in rows r - 4 to r with col + 3 * row smaller by 1 to 14, see wavefronts().
+    Tiles are skewed along the wavefronts: tile [i, j] contains pixels with rows in [i * height, (i + 1) * height)
+    and col + 3 * row in [j * width, (j + 1) * width), with height and width of at least 4 and 14.
+    A tile depends only on the tiles [i - 1, j - 1], [i - 1, j] and [i, j - 1], and it is generated once they
+    are done. So every pixel sees the same generated pixels as without tiles, and the result is the same
+    as the generation without tiles with any number of workers.
+    Workers are started by a fork server, they get the stage in shared memory, see processes.py.
+    Scripts generating with tiles have to guard their code by if __name__ == "__main__", because the workers
+    import the main module. With a single worker, tiles are generated in this process.
+    """
+    global _tile_stage
+    height = max(tile_size, 4)
+    width = max(tile_size, 14)
+    tile_rows = -(-rows // height)
+    tile_cols = -(-(cols + 3 * (rows - 1)) // width)
+
+    waiting = {}
+    for i in range(tile_rows):
+        for j in range(tile_cols):
+            waiting[(i, j)] = len([(a, b) for a, b in [(i - 1, j - 1), (i - 1, j), (i, j - 1)] if 0 <= a and 0 <= b])
+
+    def task(i, j):
+        rs, cs = tile_pixels(rows, cols, i, j, height, width)
+        if len(rs) == 0:
+            return None
+        top = padding + np.min(rs) - 4
+        left = padding + np.min(cs) - 2
+        patch = generated[top : padding + np.max(rs) + 1, left : padding + np.max(cs) + 3].copy()
+        return (i, j, rows, cols, height, width, top, left, patch)
+
+    def finish(i, j, rs=None, cs=None, values=None):
+        # Stores a generated tile and returns tiles, that can be generated now
+        if rs is not None:
+            generated[rs + padding, cs + padding] = values
+        ready = []
+        for a, b in [(i, j + 1), (i + 1, j), (i + 1, j + 1)]:
+            if (a, b) in waiting:
+                waiting[(a, b)] -= 1
+                if waiting[(a, b)] == 0:
+                    ready.append((a, b))
+        return ready
+
+    ready = [(0, 0)]
+    if workers == 1:
+        _tile_stage = stage_model
+        while ready:
+            i, j = ready.pop(0)
+            tile = task(i, j)
+            ready.extend(finish(*_generate_tile(tile)) if tile else finish(i, j))
+        _tile_stage = None
+        return generated
+
+    # Summed-area tables and block means are computed once and shared by all workers
+    stage_model.context.prepare()
+    context = process_context([__name__])
+    data, arrays = share(stage_model, context)
+
+    results = queue.Queue()
+    with context.Pool(workers, _init_tile_worker, (data, arrays)) as pool:
+        running = 0
+        while ready or running:
+            while ready:
+                i, j = ready.pop(0)
+                tile = task(i, j)
+                if tile is None:
+                    ready.extend(finish(i, j))
+                    continue
+                pool.apply_async(_generate_tile, (tile,), callback=results.put, error_callback=results.put)
+                running += 1
+
+            if running:
+                result = results.get()
+                if isinstance(result, Exception):
+                    raise result
+                running -= 1
+                ready = finish(*result)
+
+    return generated
+
+# Encodings of parts of model inputs, see encode_segments()
+ENCODERS = {
+    "log": unary_log_encoding_matrix,
+    "log_reversed": unary_log_encoding_matrix_reversed,
+    "linear": unary_linear_encoding_matrix,
+    "raw": lambda values, encoding: values,
+}
+
+def encode_segments(segments, encoding):
+    """Encodes and concatenates parts of model inputs.
+    segments: [(str, matrix)]
+        Pairs of encoding from ENCODERS and matrix of shape (pixels, values) to encode.
+    Returns matrix of shape (pixels, encoded values).
+    """
+    encoded = [ENCODERS[kind](values, encoding) for kind, values in segments]
+    return np.concatenate(encoded, axis=1)
+
+# Order in which generate_map uses the networks, the following one is loaded in the background
+GENERATION_ORDER = [
+    "heights_64-16", "roads_64-16", "rivers_64-16", "buildings_64-16",
+    "heights_64-16-4", "roads_64-16-4", "rivers_64-16-4", "buildings_64-16-4",
+    "heights_16-4-1", "roads_16-4-blurry", "roads_sharp", "rivers_16-4-blurry", "rivers_sharp",
+    "buildings_16-4-blurry", "buildings_sharp",
+]
+
+# Bytes of contexts computed at once by generate_map, unless block_rows is given
+CONTEXT_MEMORY = 1 << 28
+
+def evaluate_inputs(model, context, segments, encoding, backend):
+    """Evaluates the model on inputs made of contexts followed by the segments, see encode_segments().
+    With the prefix backend, contexts are products of the first layer, see NumpyModel.first_layer().
+    """
+    if backend == "prefix":
+        return model.from_first_layer(context + model.first_layer(segments, encoding))
+
+    _input = np.concatenate(( context, encode_segments(segments, encoding) ), axis=1)
+    return np.asarray(model(_input))
+
+def upscaled(positions, padding):
+    # Position in the user input, which is 16 times bigger than layers generated from it
+    return (positions - padding) * 16 + padding
+
+def window(kind, layer, reduction, upscaled=False, relative=None):
+    """Window of a context layer, a part of a Context.
+    kind: str
+        Encoding of the window, see ENCODERS.
+    upscaled: bool
+        Windows are cut out at positions in the user input, which is 16 times bigger than generated layers.
+    relative: str
+        If given, the window is followed by its absolute value, see relativization_matrix.
+        With "inplace", the window is encoded relativized, with "copy" as it is.
+    """
+    return (kind, layer, reduction, upscaled, relative)
+
+class Context:
+    """Non-recurrent part of the inputs of a stage network, made of windows of context layers, see window().
+    Calling it with positions of pixels returns segments of their contexts, see encode_segments().
+    It is described by data instead of a function, so that it can be sent to worker processes, see generate_tiles().
+    scales: {id(layer): (layer, scale)}
+        User inputs, whose values are integers divided by scale, see rescale_quantized.
+    """
+
+    def __init__(self, windows, padding, cut, scales={}):
+        self.padding = padding
+        self.cut = cut
+        # Windows refer to layers by their index
+        self.layers = []
+        self.scales = []
+        self.windows = []
+        for kind, layer, reduction, upscaled, relative in windows:
+            index = next((i for i, known in enumerate(self.layers) if known is layer), len(self.layers))
+            if index == len(self.layers):
+                self.layers.append(layer)
+                known = id(layer) in scales and scales[id(layer)][0] is layer
+                self.scales.append(scales[id(layer)][1] if known else None)
+            self.windows.append((kind, index, reduction, upscaled, relative))
+
+        # Summed-area tables of user inputs and block means of generated layers, {(index, reduction): source}
+        self.sources = {}
+
+    def source(self, index, reduction):
+        # A table serves all reductions of its layer
+        scale = self.scales[index]
+        key = (index, None if scale is not None else reduction)
+        if key not in self.sources:
+            layer = self.layers[index]
+            self.sources[key] = SummedAreaTable(layer, scale) if scale is not None else block_means(layer, reduction)
+        return self.sources[key]
+
+    def prepare(self):
+        """Computes tables and block means of all the windows, otherwise they are computed when first needed."""
+        for _, index, reduction, _, _ in self.windows:
+            if reduction != 1:
+                self.source(index, reduction)
+
+    def release(self):
+        self.sources = {}
+
+    def windows_at(self, index, rs, cs, reduction):
+        """Same as get_windows_at(). Windows of user inputs are cut out from exact summed-area tables,
+        windows of generated layers from block means, which are the same as get_windows_at() computes."""
+        if reduction == 1:
+            return get_windows_at(self.layers[index], rs, cs, reduction, self.cut)
+        if self.scales[index] is not None:
+            return self.source(index, reduction).windows_at(rs, cs, reduction, self.cut)
+        return level_windows_at(self.source(index, reduction), rs, cs, reduction, self.cut)
+
+    def __call__(self, rs, cs):
+        segments = []
+        for kind, index, reduction, upscale, relative in self.windows:
+            if upscale:
+                values = self.windows_at(index, upscaled(rs, self.padding), upscaled(cs, self.padding), reduction)
+            else:
+                values = self.windows_at(index, rs, cs, reduction)
+
+            segments.append((kind, values))
+            if relative:
+                absolute = relativization_matrix(values.copy() if relative == "copy" else values)
+                segments.append(("linear", absolute[:, None]))
+
+        return segments
+
+class StageModel:
+    """Network of a stage together with the context of its inputs and decoding of its outputs.
+    It generates pixels of the stage, see generate_map(). It is sent to worker processes generating tiles.
+    heights: bool
+        Generates altitudes. Otherwise roads, rivers or buildings, whose outputs are decoded
+        only if encode is set and rounded if _round is set.
+    """
+
+    def __init__(self, model, context, heights, encode, _round, encoding, backend):
+        self.model = model
+        self.context = context
+        self.heights = heights
+        self.encode = encode
+        self._round = _round
+        self.encoding = encoding
+        self.backend = backend
+
+    def contexts(self, rs, cs):
+        """Encoded contexts of pixels at given positions. With the prefix backend, products of the contexts
+        with the first layer of the model are returned instead."""
+        segments = self.context(rs, cs)
+        if self.backend == "prefix":
+            return self.model.first_layer(segments, self.encoding, 0)
+
+        # Models compute in float32 anyway, so the contexts are stored in it to save memory
+        return encode_segments(segments, self.encoding).astype(np.float32)
+
+    def evaluate(self, context, segments):
+        return evaluate_inputs(self.model, context, segments, self.encoding, self.backend)
+
+    def step(self, context, generated, rs, cs, evaluate=None):
+        """Generates pixels of a wavefront at given positions with their contexts.
+        evaluate(context, segments) evaluates the model, see evaluate_inputs()."""
+        evaluate = evaluate or self.evaluate
+        recurrent = get_windows_at(generated, rs, cs, 1, self.context.cut)[:, :-3]
+
+        if self.heights:
+            absolute = relativization_matrix(recurrent)
+            output = evaluate(context, [("log_reversed", recurrent), ("linear", absolute[:, None])])
+            output_decoded = unary_log_decoding_matrix_reversed(output)
+            generated[rs, cs] = output_decoded + absolute
+            return
+
+        output = evaluate(context, [("log" if self.encode else "raw", recurrent)])
+        if self.encode:
+            output = unary_log_decoding_matrix(output, self.encoding)
+        output = output[:, 0]
+        if self._round:
+            output = np.round(output)
+        generated[rs, cs] = output
+
+def load_data(models, model_name, data_folder, result_folder, data_name, writer):
     """Loads the model and user input for the generation and saves the input as an image.
+    models: ModelSet
+    writer: ImageWriter
+    Returns (model, image, scale), values of the image are integers divided by scale, see rescale_quantized.
     """
     image_name = f"{data_folder}/{data_name}.pgm"
-    check_path(model_file)
     check_path(image_name)
-    model = load_model(model_file)
-    image = cv2.imread(image_name, cv2.IMREAD_GRAYSCALE)
-    image = rescale(image)
+    model = models[model_name]
+    image, scale = rescale_quantized(np.asarray(read_pgm(image_name, mmap=True)))
 
-    save_image(image, f"{result_folder}/{data_name}.png")
+    writer.save_stage(image, f"{result_folder}/{data_name}.png")
 
-    return (model, image)
+    return (model, image, scale)
 
 def generate_map(
     generation_data,
     results_folder,
     config_file = "nn_generator/examples/generation_config.txt",
     random_modifier = 10,
+    block_rows = None,
+    backend = "tensorflow",
+    tile_size = None,
+    workers = None,
+    seed = None,
+    model_set = None,
+    save_stages = True,
+    timings = None,
+    row_independent = False,
 ):
     """Contains all logic for generation of maps using given RNNs.
     generation_data: str
@@ -42,6 +364,34 @@ def generate_map(
         Folder to store the results.
     config_file: str
         Text file specifying used networks.
+    block_rows: int
+        Contexts of a stage are computed for this many rows at once.
+        By default as many rows as fit into CONTEXT_MEMORY bytes.
+    backend: str
+        How the networks are evaluated, "tensorflow", "numpy" or "prefix". See model_registry.load_network().
+    tile_size: int
+        Generates every stage by tiles of this size on multiple processes, see generate_tiles().
+        Networks are evaluated row independently then, the result is the same as without tiles
+        with row_independent. block_rows is not used then.
+    workers: int
+        Number of processes generating the tiles, all processors by default.
+        Tensorflow models are always used in a single process.
+    seed: int
+        Seed of the noise. Noise is drawn from numpy.random if not given.
+    model_set: ModelSet
+        Networks to use instead of the ones of config_file, see generate_many().
+    save_stages: bool
+        Save images of the input and of every stage, not only the final ones.
+        Images are written on a background thread, see ImageWriter.
+    timings: dict
+        If given, seconds spent generating every stage are stored into it under names of the stage networks,
+        see GENERATION_ORDER.
+        Stages are also recorded by the active tracer, if there is one, see tracing.tracing(). Latencies of
+        model calls made by worker processes generating tiles are not recorded.
+    row_independent: bool
+        Evaluates NumPy networks, so that their outputs do not depend on how the pixels are batched,
+        see NumpyModel.row_independent(). Slower, but the map is exactly the same as generated by tiles
+        or by generate_many(). Otherwise they differ in the last bits of the network outputs.
     """
 
     cut = 5
@@ -49,689 +399,588 @@ def generate_map(
     # Universal padding
     padding = 64 * 5 // 2 + 2
     
-    # Parse config file = locations of the networks
-    models = {}
-    with open(config_file) as f:
-        for line in f:
-            tokens = line.strip().split("=")
-            models[tokens[0]] = tokens[1]
+    # Networks stay loaded in the registry for following calls with the same config file
+    check_path(config_file)
+    models = model_set or registry.model_set(config_file, backend, GENERATION_ORDER)
 
     colors = init_cmaps()
 
     if not os.path.exists(results_folder):
-    	os.makedirs(results_folder)
-
-
-    def generate(model, padding, get_context, rows, cols, generated):
-        """Generation of altitudes.
-        This function takes mainly model, initialized generation matrix and function get_context.
-        get_context() has to return context at each position needed for the model to continue generation.
-        """
-        for r in range(padding, rows + padding):
-            for c in range(padding, cols + padding):
-                context = get_context(r, c)
-                recurrent = get_window(generated, r, c, 1, cut)
-                recurrent = recurrent.flatten()[:-3]
-                absolute = relativization(recurrent)
-                absolute_encoded = unary_linear_encoding(absolute, encoding)
-                recurrent = unary_log_encoding_array_reversed(recurrent, encoding)
-                recurrent = np.concatenate(( recurrent, absolute_encoded ))
-                _input = np.concatenate(( context, recurrent )).reshape(( 1, len(context) + len(recurrent) ))
-                output = np.asarray(model(_input))
-                output_decoded = unary_log_decoding_reversed(np.asarray(output).flatten())
-                o = float(output_decoded) + absolute
-                generated[r, c] = o
+        os.makedirs(results_folder)
+
+    # Images are written until the end, also if the generation fails
+    with ImageWriter(save_stages) as writer:
+        # Stages are generated in the order of their networks
+        stage_names = iter(GENERATION_ORDER)
+
+
+        def blocks(stage_model, rows, cols):
+            """Splits the generated area into blocks of block_rows rows.
+            Yields wavefronts of the block together with encoded contexts of their pixels, see StageModel.contexts().
+            """
+            step = block_rows
+            if not step:
+                # Contexts of a single pixel tell the size of a row
+                pixel = stage_model.contexts(np.array([padding]), np.array([padding]))
+                step = max(1, CONTEXT_MEMORY // (cols * pixel.nbytes))
+
+            for first_row in range(0, rows, step):
+                count = min(step, rows - first_row)
+                rs, cs = np.divmod(np.arange(count * cols), cols)
+                contexts = stage_model.contexts(rs + first_row + padding, cs + padding)
+
+                for front_rows, front_cols in wavefronts(count, cols, 0):
+                    context = contexts[front_rows * cols + front_cols]
+                    yield (front_rows + first_row + padding, front_cols + padding, context)
+
+        def run_stage(stage_model, rows, cols, generated):
+            """Generates a stage, see StageModel."""
+            name = next(stage_names)
+            start = time.perf_counter()
+            with stage(name.replace("_", " "), rows * cols, "pixels"):
+                if tile_size:
+                    stage_workers = 1 if backend == "tensorflow" else (workers or os.cpu_count())
+                    generate_tiles(stage_model, generated, padding, rows, cols, tile_size, stage_workers)
+                else:
+                    model = stage_model.model
+                    evaluate_stage = lambda context, segments: evaluate(model, context, segments)
+                    for rs, cs, context in blocks(stage_model, rows, cols):
+                        stage_model.step(context, generated, rs, cs, evaluate_stage)
+
+            # Context layers of the following stage are different
+            stage_model.context.release()
+
+            if timings is not None:
+                timings[name] = time.perf_counter() - start
+            return generated
+
+        def noisify(layer, stage):
+            if seed is not None:
+                return noisify_exp(layer, random_modifier, np.random.RandomState([seed, stage]))
+            return noisify_exp(layer, random_modifier)
+
+        def evaluate(model, context, segments):
+            """Evaluates the model on inputs made of a context from blocks() followed by the segments.
+            Latency of the call is recorded, if the generation is traced, see tracing.stage()."""
+            start = time.perf_counter()
+            if isinstance(model, BatchedModel):
+                output = model.evaluate(evaluate_inputs, context, segments, encoding, backend)
+            else:
+                output = evaluate_inputs(model, context, segments, encoding, backend)
+
+            record_call(time.perf_counter() - start, len(context))
+            return output
+
+        def stage_network(model):
+            # Tiles are batched differently than the whole stage
+            if row_independent or tile_size:
+                return independent_rows(model)
+            return model
+
+        def generate(model, padding, get_context, rows, cols, generated):
+            """Generation of altitudes.
+            This function takes mainly model, initialized generation matrix and get_context.
+            get_context is a Context returning contexts at given positions needed for the model to continue generation.
+            Independent pixels are generated together in a single call of the model, see wavefronts().
+            """
+            return run_stage(StageModel(stage_network(model), get_context, True, True, False, encoding, backend), rows, cols, generated)
 
-        return generated
+        def generate_other(model, get_context, rows, cols, generated, encode, _round):
+            """Same as function generate(), but added different encoding for roads, rivers and buildings.
+            """
+            return run_stage(StageModel(stage_network(model), get_context, False, encode, _round, encoding, backend), rows, cols, generated)
 
-    def generate_other(model, get_context, rows, cols, generated, encode, _round):
-        """Same as function generate(), but added different encoding for roads, rivers and buildings.
-        """
-        for r in range(padding, rows + padding):
-            for c in range(padding, cols + padding):
-                context = get_context(r, c)
-                recurrent = get_window(generated, r, c, 1, cut).flatten()[:-3]
-                if encode:
-                    recurrent = unary_log_encoding_array(recurrent, encoding)
-                _input = np.concatenate(( context, recurrent))
-                _input = np.reshape(_input, (1, len(_input)))
-                output = model(_input)
-                if encode:
-                    output = unary_log_decoding(np.asarray(output[0]))
-                if _round:
-                    output = round(float(output))
-                generated[r, c] = float(output)
+        # Scales of user inputs, whose values are integers divided by them, {id(layer): (layer, scale)}
+        scales = {}
 
-        return generated
+        def quantized(layer, scale):
+            # Windows of the layer are cut out from an exact summed-area table
+            scales[id(layer)] = (layer, scale)
+            return layer
+
+        def context(*windows):
+            return Context(windows, padding, cut, scales)
+
+
+        #=================================================================
+        # 64 -> 16
+        #==================================================================
+
+        # GENERATION OF HEIGHTS
+        #==========================
+
+        heights_model, heights, heights_scale = load_data(models, "heights_64-16", generation_data, results_folder, "heights", writer)
+        rows = int(np.ceil(heights.shape[0] / 16))
+        cols = int(np.ceil(heights.shape[1] / 16))
+
+        heights = rescale(heights)
+
+        initial = cv2.resize(heights, (rows, cols))
+        heights = quantized(np.pad(heights, padding, 'edge'), heights_scale)
+        initial = np.pad(initial, padding, 'edge')
+
+        # The window itself is encoded as it is, only its absolute value is added
+        height_context_16x = context(window("log_reversed", heights, 64, upscaled=True, relative="copy"))
+
+        generated_heights_16x = generate(heights_model, padding, height_context_16x, rows, cols, initial)
+        generated_heights_16x = cutout(generated_heights_16x, padding, padding, rows, cols)
+
+        # Computation of differences for roads, rivers and buildings
+        height_diff_rows_16x, height_diff_cols_16x = padded_derivatives(generated_heights_16x, padding)
+
+        writer.save_stage(
+            generated_heights_16x,
+            f"{results_folder}/generated_heights_16x.png")
+
+
+        # GENERATION OF ROADS
+        #==========================
+
+        road_model, roads, roads_scale = load_data(models, "roads_64-16", generation_data, results_folder, "roads", writer)
+
+        initial = cv2.resize(roads, (rows, cols))
+        initial = np.pad(initial, padding, 'reflect')
+        roads = quantized(np.pad(roads, padding, 'reflect'), roads_scale)
 
+        road_context = context(
+            window("log", height_diff_rows_16x, 16),
+            window("log", height_diff_cols_16x, 16),
+            window("log", roads, 64, upscaled=True),
+            window("log", height_diff_rows_16x, 4),
+            window("log", height_diff_cols_16x, 4))
 
-    #=================================================================
-    # 64 -> 16
-    #==================================================================
+        generated_roads_16x = generate_other(road_model, road_context, rows, cols, initial, True, False)
+        writer.save_stage(
+            cutout(generated_roads_16x, padding, padding, rows, cols),
+            f"{results_folder}/generated_roads_16x.png")
 
-    # GENERATION OF HEIGHTS
-    #==========================
 
-    heights_model, heights = load_data(models["heights_64-16"], generation_data, results_folder, "heights")
-    rows = int(np.ceil(heights.shape[0] / 16))
-    cols = int(np.ceil(heights.shape[1] / 16))
+        # GENERATION OF RIVERS
+        #==========================
 
-    heights = rescale(heights)
+        river_model, rivers, rivers_scale = load_data(models, "rivers_64-16", generation_data, results_folder, "rivers", writer)
 
-    def height_context_16x(row, col):
-        r = (row - padding) * 16 + padding
-        c = (col - padding) * 16 + padding
-        window = get_window(heights, r, c, 64, cut)
-        height_context_16x.counter += 1
-        
-        absolute = relativization(window.flatten())
-        absolute = unary_linear_encoding(absolute, encoding)
-        window = unary_log_encoding_array_reversed(window.flatten(), encoding)
+        initial = cv2.resize(rivers, (rows, cols))
+        initial = np.pad(initial, padding, 'reflect')
+        rivers = quantized(np.pad(rivers, padding, 'reflect'), rivers_scale)
 
-        return np.concatenate(( window, absolute ))
+        river_context = context(
+            window("log", height_diff_rows_16x, 16),
+            window("log", height_diff_cols_16x, 16),
+            window("log", rivers, 64, upscaled=True),
+            window("log", height_diff_rows_16x, 4),
+            window("log", height_diff_cols_16x, 4))
 
-    height_context_16x.counter = 0
+        generated_rivers_16x = generate_other(river_model, river_context, rows, cols, initial, True, False)
 
+        writer.save_stage(
+            cutout(generated_rivers_16x, padding, padding, rows, cols),
+            f"{results_folder}/generated_rivers_16x.png")
+
+
+
+        # GENERATION OF BUILDINGS
+        #==========================
+
+        building_model, buildings, buildings_scale = load_data(models, "buildings_64-16", generation_data, results_folder, "buildings", writer)
+        generated_heights_16x = np.pad(generated_heights_16x, padding, 'reflect')
+
+        initial = cv2.resize(buildings, (rows, cols))
+        initial = np.pad(initial, padding, 'reflect')
+        buildings = quantized(np.pad(buildings, padding), buildings_scale)
+
+        building_context = context(
+            window("log", generated_heights_16x, 16, relative="inplace"),
+            window("log", generated_rivers_16x, 16),
+            window("log", generated_roads_16x, 16),
+            window("log", buildings, 64, upscaled=True),
+            window("log", generated_heights_16x, 4, relative="inplace"),
+            window("log", generated_rivers_16x, 4),
+            window("log", generated_roads_16x, 4))
+        generated_buildings_16x = generate_other(building_model, building_context, rows, cols, initial, True, False)
+
+        writer.save_stage(
+            cutout(generated_buildings_16x, padding, padding, rows, cols),
+            f"{results_folder}/generated_buildings_16x.png")
+
+        #======================================
+        # (64, 16) -> 4
+        #======================================
+
+        # Preparing previous layers to be used as context for the following layers
+
+        generated_heights_16x = cutout(generated_heights_16x, padding, padding, rows, cols)
+        height_diff_rows_16x = cutout(height_diff_rows_16x, padding, padding, rows, cols)
+        height_diff_cols_16x = cutout(height_diff_cols_16x, padding, padding, rows, cols)
+        generated_roads_16x = cutout(generated_roads_16x, padding, padding, rows, cols)
+        generated_rivers_16x = cutout(generated_rivers_16x, padding, padding, rows, cols)
+        generated_buildings_16x = cutout(generated_buildings_16x, padding, padding, rows, cols)
+
+        rows *= 4
+        cols *= 4
+
+        generated_heights_16x = cv2.resize(generated_heights_16x, (rows, cols))
+        height_diff_rows_16x = cv2.resize(height_diff_rows_16x, (rows, cols))
+        height_diff_cols_16x = cv2.resize(height_diff_cols_16x, (rows, cols))
+        generated_roads_16x = cv2.resize(generated_roads_16x, (rows, cols))
+        generated_rivers_16x = cv2.resize(generated_rivers_16x, (rows, cols))
+        generated_buildings_16x = cv2.resize(generated_buildings_16x, (rows, cols))
+
+        generated_heights_16x = np.pad(generated_heights_16x, padding, 'edge')
+        height_diff_rows_16x = np.pad(height_diff_rows_16x, padding, 'reflect')
+        height_diff_cols_16x = np.pad(height_diff_cols_16x, padding, 'reflect')
+        generated_roads_16x = np.pad(generated_roads_16x, padding, 'reflect')
+        generated_rivers_16x = np.pad(generated_rivers_16x, padding, 'reflect')
+        generated_buildings_16x = np.pad(generated_buildings_16x, padding, 'reflect')
     
-    initial = cv2.resize(heights, (rows, cols))
-    heights = np.pad(heights, padding, 'edge')
-    initial = np.pad(initial, padding, 'edge')
-
-    generated_heights_16x = generate(heights_model, padding, height_context_16x, rows, cols, initial)
-    generated_heights_16x = cutout(generated_heights_16x, padding, padding, rows, cols)
-
-    # Computation of differences for roads, rivers and buildings
-    height_diff_rows_16x, height_diff_cols_16x = derivatives(generated_heights_16x)
-    height_diff_rows_16x = np.pad(height_diff_rows_16x, padding, 'reflect')
-    height_diff_cols_16x = np.pad(height_diff_cols_16x, padding, 'reflect')
-
-    save_image(
-        generated_heights_16x,
-        f"{results_folder}/generated_heights_16x.png")
-
-
-    # GENERATION OF ROADS
-    #==========================
-
-    road_model, roads = load_data(models["roads_64-16"], generation_data, results_folder, "roads")
-
-    def road_context(r, c):
-        heights1_rows = get_window(height_diff_rows_16x, r, c, 16, cut).flatten()
-        heights1_cols = get_window(height_diff_cols_16x, r, c, 16, cut).flatten()
-        roads1 = get_window(
-            roads,
-            (r - padding) * 16 + padding,
-            (c - padding) * 16 + padding,
-            64, cut).flatten()
-        heights0_rows = get_window(height_diff_rows_16x, r, c, 4, cut).flatten()
-        heights0_cols = get_window(height_diff_cols_16x, r, c, 4, cut).flatten()
-
-        heights1_rows = unary_log_encoding_array(heights1_rows, encoding)
-        heights1_cols = unary_log_encoding_array(heights1_cols, encoding)
-        roads1 = unary_log_encoding_array(roads1, encoding)
-        heights0_rows = unary_log_encoding_array(heights0_rows, encoding)
-        heights0_cols = unary_log_encoding_array(heights0_cols, encoding)
-
-        return np.concatenate(( heights1_rows, heights1_cols, roads1, heights0_rows, heights0_cols))
-
-    initial = cv2.resize(roads, (rows, cols))
-    initial = np.pad(initial, padding, 'reflect')
-    roads = np.pad(roads, padding, 'reflect')
-
-    generated_roads_16x = generate_other(road_model, road_context, rows, cols, initial, True, False)
-    save_image(
-        cutout(generated_roads_16x, padding, padding, rows, cols),
-        f"{results_folder}/generated_roads_16x.png")
-
-
-    # GENERATION OF RIVERS
-    #==========================
-
-    river_model, rivers = load_data(models["rivers_64-16"], generation_data, results_folder, "rivers")
-
-    def river_context(r, c):
-        heights1_rows = get_window(height_diff_rows_16x, r, c, 16, cut).flatten()
-        heights1_cols = get_window(height_diff_cols_16x, r, c, 16, cut).flatten()
-        rivers1 = get_window(
-            rivers, 
-            (r - padding) * 16 + padding,
-            (c - padding) * 16 + padding,
-            64, cut).flatten()
-        heights0_rows = get_window(height_diff_rows_16x, r, c, 4, cut).flatten()
-        heights0_cols = get_window(height_diff_cols_16x, r, c, 4, cut).flatten()
-        return unary_log_encoding_array(
-                np.concatenate((
-                    heights1_rows,
-                    heights1_cols,
-                    rivers1,
-                    heights0_rows,
-                    heights0_cols)),
-                encoding)
-
-
-    initial = cv2.resize(rivers, (rows, cols))
-    initial = np.pad(initial, padding, 'reflect')
-    rivers = np.pad(rivers, padding, 'reflect')
-    generated_rivers_16x = generate_other(river_model, river_context, rows, cols, initial, True, False)
-
-    save_image(
-        cutout(generated_rivers_16x, padding, padding, rows, cols),
-        f"{results_folder}/generated_rivers_16x.png")
-
-
-
-    # GENERATION OF BUILDINGS
-    #==========================
-
-    building_model, buildings = load_data(models["buildings_64-16"], generation_data, results_folder, "buildings")
-    generated_heights_16x = np.pad(generated_heights_16x, padding, 'reflect')
-
-    def building_context(r, c):
-        heights1 = get_window(generated_heights_16x, r, c, 16, cut).flatten()
-        rivers1 = get_window(generated_rivers_16x, r, c, 16, cut).flatten()
-        roads1 = get_window(generated_roads_16x, r, c, 16, cut).flatten()
-        buildings1 = get_window(
-            buildings,
-            (r - padding) * 16 + padding,
-            (c - padding) * 16 + padding,
-            64, cut).flatten()
-        heights0 = get_window(generated_heights_16x, r, c, 4, cut).flatten()
-        rivers0 = get_window(generated_rivers_16x, r, c, 4, cut).flatten()
-        roads0 = get_window(generated_roads_16x, r, c, 4, cut).flatten()
-
-        absolute1 = relativization(heights1)
-        absolute1 = unary_linear_encoding(absolute1, encoding)
-        heights1 = unary_log_encoding_array(heights1, encoding)
-        rivers1 = unary_log_encoding_array(rivers1, encoding)
-        roads1 = unary_log_encoding_array(roads1, encoding)
-        buildings1 = unary_log_encoding_array(buildings1, encoding)
-        absolute0 = relativization(heights0)
-        absolute0 = unary_linear_encoding(absolute0, encoding)
-        heights0 = unary_log_encoding_array(heights0, encoding)
-        rivers0 = unary_log_encoding_array(rivers0, encoding)
-        roads0 = unary_log_encoding_array(roads0, encoding)
-
-        return np.concatenate((
-            heights1,
-            absolute1,
-            rivers1,
-            roads1,
-            buildings1,
-            heights0,
-            absolute0,
-            rivers0,
-            roads0,
-        ))
-
-
-    initial = cv2.resize(buildings, (rows, cols))
-    initial = np.pad(initial, padding, 'reflect')
-    buildings = np.pad(buildings, padding)
-    generated_buildings_16x = generate_other(building_model, building_context, rows, cols, initial, True, False)
-
-    save_image(
-        cutout(generated_buildings_16x, padding, padding, rows, cols),
-        f"{results_folder}/generated_buildings_16x.png")
-
-    #======================================
-    # (64, 16) -> 4
-    #======================================
-
-    # Preparing previous layers to be used as context for the following layers
-
-    generated_heights_16x = cutout(generated_heights_16x, padding, padding, rows, cols)
-    height_diff_rows_16x = cutout(height_diff_rows_16x, padding, padding, rows, cols)
-    height_diff_cols_16x = cutout(height_diff_cols_16x, padding, padding, rows, cols)
-    generated_roads_16x = cutout(generated_roads_16x, padding, padding, rows, cols)
-    generated_rivers_16x = cutout(generated_rivers_16x, padding, padding, rows, cols)
-    generated_buildings_16x = cutout(generated_buildings_16x, padding, padding, rows, cols)
-
-    rows *= 4
-    cols *= 4
-
-    generated_heights_16x = cv2.resize(generated_heights_16x, (rows, cols))
-    height_diff_rows_16x = cv2.resize(height_diff_rows_16x, (rows, cols))
-    height_diff_cols_16x = cv2.resize(height_diff_cols_16x, (rows, cols))
-    generated_roads_16x = cv2.resize(generated_roads_16x, (rows, cols))
-    generated_rivers_16x = cv2.resize(generated_rivers_16x, (rows, cols))
-    generated_buildings_16x = cv2.resize(generated_buildings_16x, (rows, cols))
-
-    generated_heights_16x = np.pad(generated_heights_16x, padding, 'edge')
-    height_diff_rows_16x = np.pad(height_diff_rows_16x, padding, 'reflect')
-    height_diff_cols_16x = np.pad(height_diff_cols_16x, padding, 'reflect')
-    generated_roads_16x = np.pad(generated_roads_16x, padding, 'reflect')
-    generated_rivers_16x = np.pad(generated_rivers_16x, padding, 'reflect')
-    generated_buildings_16x = np.pad(generated_buildings_16x, padding, 'reflect')
-    
-    if random_modifier != 0:
-        generated_heights_16x = noisify_exp(generated_heights_16x, random_modifier)
-
-    # GENERATION OF HEIGHTS
-    #==========================
-
-    heights_model = load_model(models["heights_64-16-4"])
-
-    def height_context_4x(r, c):
-        heights2 = get_window(generated_heights_16x, r, c, 16, cut).flatten()
-        heights1 = get_window(generated_heights_16x, r, c, 4, cut).flatten()
-        absolute2 = relativization(heights2)
-        absolute1 = relativization(heights1)
-        heights2 = unary_log_encoding_array_reversed(heights2, encoding)
-        heights1 = unary_log_encoding_array_reversed(heights1, encoding)
-        absolute2 = unary_linear_encoding(absolute2, encoding)
-        absolute1 = unary_linear_encoding(absolute1, encoding)
-        return np.concatenate(( heights2, absolute2, heights1, absolute1 ))
-
-    generated_heights_4x = generate(heights_model, padding, height_context_4x, rows, cols, deepcopy(generated_heights_16x))
-    generated_heights_4x = cutout(generated_heights_4x, padding, padding, rows, cols)
-    height_diff_rows_4x, height_diff_cols_4x = derivatives(generated_heights_16x)
-    height_diff_rows_4x = np.pad(height_diff_rows_4x, padding, 'reflect')
-    height_diff_cols_4x = np.pad(height_diff_cols_4x, padding, 'reflect')
-
-    save_image(
-        generated_heights_4x,
-        f"{results_folder}/generated_heights_4x.png")
-
-
-    # GENERATION OF ROADS
-    #==========================
-
-    road_model = load_model(models["roads_64-16-4"])
-
-    def road_context_4x(r, c):
-        heights2_rows = get_window(height_diff_rows_4x, r, c, 16, cut).flatten()
-        heights2_cols = get_window(height_diff_cols_4x, r, c, 16, cut).flatten()
-        roads2 = get_window(generated_roads_16x, r, c, 16, cut).flatten()
-
-        heights1_rows = get_window(height_diff_rows_4x, r, c, 4, cut).flatten()
-        heights1_cols = get_window(height_diff_cols_4x, r, c, 4, cut).flatten()
-        roads1 = get_window(generated_roads_16x, r, c, 4, cut).flatten()
-
-        heights0_rows = get_window(height_diff_rows_4x, r, c, 1, cut).flatten()
-        heights0_cols = get_window(height_diff_cols_4x, r, c, 1, cut).flatten()
-
-        return unary_log_encoding_array(
-            np.concatenate((
-                heights2_rows,
-                heights2_cols,
-                roads2,
-                heights1_rows,
-                heights1_cols,
-                roads1,
-                heights0_rows,
-                heights0_cols
-            )),
-            encoding)
-
-    generated_roads_4x = generate_other(road_model, road_context_4x, rows, cols, deepcopy(generated_roads_16x), True, False)
-    save_image(
-        cutout(generated_roads_4x, padding, padding, rows, cols),
-        f"{results_folder}/generated_roads_4x.png")
-
-
-    # GENERATION OF RIVERS
-    #==========================
-
-    river_model = load_model(models["rivers_64-16-4"])
-
-    def river_context_4x(r, c):
-        heights2_rows = get_window(height_diff_rows_4x, r, c, 16, cut).flatten()
-        heights2_cols = get_window(height_diff_cols_4x, r, c, 16, cut).flatten()
-        rivers2 = get_window(generated_rivers_16x, r, c, 16, cut).flatten()
-
-        heights1_rows = get_window(height_diff_rows_4x, r, c, 4, cut).flatten()
-        heights1_cols = get_window(height_diff_cols_4x, r, c, 4, cut).flatten()
-        rivers1 = get_window(generated_rivers_16x, r, c, 4, cut).flatten()
-
-        heights0_rows = get_window(height_diff_rows_4x, r, c, 1, cut).flatten()
-        heights0_cols = get_window(height_diff_cols_4x, r, c, 1, cut).flatten()
-
-        return unary_log_encoding_array(
-            np.concatenate((
-                heights2_rows,
-                heights2_cols,
-                rivers2,
-                heights1_rows,
-                heights1_cols,
-                rivers1,
-                heights0_rows,
-                heights0_cols
-            )),
-            encoding)
-
-    generated_rivers_4x = generate_other(river_model, river_context_4x, rows, cols, deepcopy(generated_rivers_16x), True, False)
-    save_image(
-        cutout(generated_rivers_4x, padding, padding, rows, cols),
-        f"{results_folder}/generated_rivers_4x.png")
-
-
-    # GENERATION OF BUILDINGS
-    #==========================
-
-    building_model = load_model(models["buildings_64-16-4"])
-    generated_heights_4x = np.pad(generated_heights_4x, padding, 'reflect')
-
-    def building_context_4x(r, c):
-        heights2 = get_window(generated_heights_4x, r, c, 16, cut).flatten()
-        rivers2 = get_window(generated_rivers_4x, r, c, 16, cut).flatten()
-        roads2 = get_window(generated_roads_4x, r, c, 16, cut).flatten()
-        buildings2 = get_window(generated_buildings_16x, r, c, 16, cut).flatten()
-        heights1 = get_window(generated_heights_4x, r, c, 4, cut).flatten()
-        rivers1 = get_window(generated_rivers_4x, r, c, 4, cut).flatten()
-        roads1 = get_window(generated_roads_4x, r, c, 4, cut).flatten()
-        buildings1 = get_window(generated_buildings_16x, r, c, 4, cut).flatten()
-        heights0 = get_window(generated_heights_4x, r, c, 1, cut).flatten()
-        rivers0 = get_window(generated_rivers_4x, r, c, 1, cut).flatten()
-        roads0 = get_window(generated_roads_4x, r, c, 1, cut).flatten()
-
-        absolute2 = relativization(heights2)
-        absolute2 = unary_linear_encoding(absolute2, encoding)
-        heights2 = unary_log_encoding_array(heights2, encoding)
-        rivers2 = unary_log_encoding_array(rivers2, encoding)
-        roads2 = unary_log_encoding_array(roads2, encoding)
-        buildings2 = unary_log_encoding_array(buildings2, encoding)
-
-        absolute1 = relativization(heights1)
-        absolute1 = unary_linear_encoding(absolute1, encoding)
-        heights1 = unary_log_encoding_array(heights1, encoding)
-        rivers1 = unary_log_encoding_array(rivers1, encoding)
-        roads1 = unary_log_encoding_array(roads1, encoding)
-        buildings1 = unary_log_encoding_array(buildings1, encoding)
-
-        absolute0 = relativization(heights0)
-        absolute0 = unary_linear_encoding(absolute0, encoding)
-        heights0 = unary_log_encoding_array(heights0, encoding)
-        rivers0 = unary_log_encoding_array(rivers0, encoding)
-        roads0 = unary_log_encoding_array(roads0, encoding)
-
-        return np.concatenate((
-            heights2,
-            absolute2,
-            rivers2,
-            roads2,
-            buildings2,
-            heights1,
-            absolute1,
-            rivers1,
-            roads1,
-            buildings1,
-            heights0,
-            absolute0,
-            rivers0,
-            roads0,
-        ))
-
-    generated_buildings_4x = generate_other(building_model, building_context_4x, rows, cols, deepcopy(generated_buildings_16x),  True, False)
-    save_image(
-        cutout(generated_buildings_4x, padding, padding, rows, cols),
-        f"{results_folder}/generated_buildings_4x.png")
-
-
-    #======================================
-    # (16, 4) -> 1
-    #======================================
-
-
-    # Preparing previous layers to be used as context for the following layers
-
-    generated_heights_4x = cutout(generated_heights_4x, padding, padding, rows, cols)
-    height_diff_rows_4x = cutout(height_diff_rows_4x, padding, padding, rows, cols)
-    height_diff_cols_4x = cutout(height_diff_cols_4x, padding, padding, rows, cols)
-    generated_roads_4x = cutout(generated_roads_4x, padding, padding, rows, cols)
-    generated_rivers_4x = cutout(generated_rivers_4x, padding, padding, rows, cols)
-    generated_buildings_4x = cutout(generated_buildings_4x, padding, padding, rows, cols)
-
-    rows *= 4
-    cols *= 4
-
-    generated_heights_4x = cv2.resize(generated_heights_4x, (rows, cols))
-    height_diff_rows_4x = cv2.resize(height_diff_rows_4x, (rows, cols))
-    height_diff_cols_4x = cv2.resize(height_diff_cols_4x, (rows, cols))
-    generated_roads_4x = cv2.resize(generated_roads_4x, (rows, cols))
-    generated_rivers_4x = cv2.resize(generated_rivers_4x, (rows, cols))
-    generated_buildings_4x = cv2.resize(generated_buildings_4x, (rows, cols))
-
-    generated_heights_4x = np.pad(generated_heights_4x, padding, 'edge')
-    height_diff_rows_4x = np.pad(height_diff_rows_4x, padding, 'reflect')
-    height_diff_cols_4x = np.pad(height_diff_cols_4x, padding, 'reflect')
-    generated_roads_4x = np.pad(generated_roads_4x, padding, 'reflect')
-    generated_rivers_4x = np.pad(generated_rivers_4x, padding, 'reflect')
-    generated_buildings_4x = np.pad(generated_buildings_4x, padding, 'reflect')
+        if random_modifier != 0:
+            generated_heights_16x = noisify(generated_heights_16x, 16)
+
+        # GENERATION OF HEIGHTS
+        #==========================
+
+        heights_model = models["heights_64-16-4"]
+
+        height_context_4x = context(
+            window("log_reversed", generated_heights_16x, 16, relative="inplace"),
+            window("log_reversed", generated_heights_16x, 4, relative="inplace"))
+
+        generated_heights_4x = generate(heights_model, padding, height_context_4x, rows, cols, deepcopy(generated_heights_16x))
+        generated_heights_4x = cutout(generated_heights_4x, padding, padding, rows, cols)
+        height_diff_rows_4x, height_diff_cols_4x = padded_derivatives(generated_heights_16x, padding)
+
+        writer.save_stage(
+            generated_heights_4x,
+            f"{results_folder}/generated_heights_4x.png")
+
+
+        # GENERATION OF ROADS
+        #==========================
+
+        road_model = models["roads_64-16-4"]
+
+        road_context_4x = context(
+            window("log", height_diff_rows_4x, 16),
+            window("log", height_diff_cols_4x, 16),
+            window("log", generated_roads_16x, 16),
+            window("log", height_diff_rows_4x, 4),
+            window("log", height_diff_cols_4x, 4),
+            window("log", generated_roads_16x, 4),
+            window("log", height_diff_rows_4x, 1),
+            window("log", height_diff_cols_4x, 1))
+
+        generated_roads_4x = generate_other(road_model, road_context_4x, rows, cols, deepcopy(generated_roads_16x), True, False)
+        writer.save_stage(
+            cutout(generated_roads_4x, padding, padding, rows, cols),
+            f"{results_folder}/generated_roads_4x.png")
+
+
+        # GENERATION OF RIVERS
+        #==========================
+
+        river_model = models["rivers_64-16-4"]
+
+        river_context_4x = context(
+            window("log", height_diff_rows_4x, 16),
+            window("log", height_diff_cols_4x, 16),
+            window("log", generated_rivers_16x, 16),
+            window("log", height_diff_rows_4x, 4),
+            window("log", height_diff_cols_4x, 4),
+            window("log", generated_rivers_16x, 4),
+            window("log", height_diff_rows_4x, 1),
+            window("log", height_diff_cols_4x, 1))
+
+        generated_rivers_4x = generate_other(river_model, river_context_4x, rows, cols, deepcopy(generated_rivers_16x), True, False)
+        writer.save_stage(
+            cutout(generated_rivers_4x, padding, padding, rows, cols),
+            f"{results_folder}/generated_rivers_4x.png")
+
+
+        # GENERATION OF BUILDINGS
+        #==========================
+
+        building_model = models["buildings_64-16-4"]
+        generated_heights_4x = np.pad(generated_heights_4x, padding, 'reflect')
+
+        building_context_4x = context(
+            window("log", generated_heights_4x, 16, relative="inplace"),
+            window("log", generated_rivers_4x, 16),
+            window("log", generated_roads_4x, 16),
+            window("log", generated_buildings_16x, 16),
+            window("log", generated_heights_4x, 4, relative="inplace"),
+            window("log", generated_rivers_4x, 4),
+            window("log", generated_roads_4x, 4),
+            window("log", generated_buildings_16x, 4),
+            window("log", generated_heights_4x, 1, relative="inplace"),
+            window("log", generated_rivers_4x, 1),
+            window("log", generated_roads_4x, 1))
+
+        generated_buildings_4x = generate_other(building_model, building_context_4x, rows, cols, deepcopy(generated_buildings_16x),  True, False)
+        writer.save_stage(
+            cutout(generated_buildings_4x, padding, padding, rows, cols),
+            f"{results_folder}/generated_buildings_4x.png")
+
+
+        #======================================
+        # (16, 4) -> 1
+        #======================================
+
+
+        # Preparing previous layers to be used as context for the following layers
+
+        generated_heights_4x = cutout(generated_heights_4x, padding, padding, rows, cols)
+        height_diff_rows_4x = cutout(height_diff_rows_4x, padding, padding, rows, cols)
+        height_diff_cols_4x = cutout(height_diff_cols_4x, padding, padding, rows, cols)
+        generated_roads_4x = cutout(generated_roads_4x, padding, padding, rows, cols)
+        generated_rivers_4x = cutout(generated_rivers_4x, padding, padding, rows, cols)
+        generated_buildings_4x = cutout(generated_buildings_4x, padding, padding, rows, cols)
+
+        rows *= 4
+        cols *= 4
+
+        generated_heights_4x = cv2.resize(generated_heights_4x, (rows, cols))
+        height_diff_rows_4x = cv2.resize(height_diff_rows_4x, (rows, cols))
+        height_diff_cols_4x = cv2.resize(height_diff_cols_4x, (rows, cols))
+        generated_roads_4x = cv2.resize(generated_roads_4x, (rows, cols))
+        generated_rivers_4x = cv2.resize(generated_rivers_4x, (rows, cols))
+        generated_buildings_4x = cv2.resize(generated_buildings_4x, (rows, cols))
+
+        generated_heights_4x = np.pad(generated_heights_4x, padding, 'edge')
+        height_diff_rows_4x = np.pad(height_diff_rows_4x, padding, 'reflect')
+        height_diff_cols_4x = np.pad(height_diff_cols_4x, padding, 'reflect')
+        generated_roads_4x = np.pad(generated_roads_4x, padding, 'reflect')
+        generated_rivers_4x = np.pad(generated_rivers_4x, padding, 'reflect')
+        generated_buildings_4x = np.pad(generated_buildings_4x, padding, 'reflect')
     
-    if random_modifier != 0:
-        generated_heights_4x = noisify_exp(generated_heights_4x, random_modifier)
-
-    # GENERATION OF HEIGHTS
-    #==========================
-
-    heights_model = load_model(models["heights_16-4-1"])
-
-
-    def height_context_1x(r, c):
-        heights2 = get_window(generated_heights_4x, r, c, 16, cut).flatten()
-        heights1 = get_window(generated_heights_4x, r, c, 4, cut).flatten()
-        absolute2 = relativization(heights2)
-        absolute1 = relativization(heights1)
-        heights2 = unary_log_encoding_array_reversed(heights2, encoding)
-        heights1 = unary_log_encoding_array_reversed(heights1, encoding)
-        absolute2 = unary_linear_encoding(absolute2, encoding)
-        absolute1 = unary_linear_encoding(absolute1, encoding)
-        return np.concatenate(( heights2, absolute2, heights1, absolute1 ))
-
-    generated_heights_1x = generate(heights_model, padding, height_context_1x, rows, cols, deepcopy(generated_heights_4x))
-    generated_heights_1x = cutout(generated_heights_1x, padding, padding, rows, cols)
-    height_diff_rows_1x, height_diff_cols_1x = derivatives(generated_heights_1x)
-    height_diff_rows_1x = np.pad(height_diff_rows_1x, padding, 'reflect')
-    height_diff_cols_1x = np.pad(height_diff_cols_1x, padding, 'reflect')
-
-    save_image(
-        generated_heights_1x,
-        f"{results_folder}/generated_heights_1x.png")
-
-
-    # GENERATION OF ROADS
-    #==========================
-
-    road_model = load_model(models["roads_16-4-blurry"])
-
-    def road_context_1x(r, c):
-        heights2_rows = get_window(height_diff_rows_1x, r, c, 16, cut).flatten()
-        heights2_cols = get_window(height_diff_cols_1x, r, c, 16, cut).flatten()
-        roads2 = get_window(generated_roads_4x, r, c, 16, cut).flatten()
-
-        heights1_rows = get_window(height_diff_rows_1x, r, c, 4, cut).flatten()
-        heights1_cols = get_window(height_diff_cols_1x, r, c, 4, cut).flatten()
-        roads1 = get_window(generated_roads_4x, r, c, 4, cut).flatten()
-
-        heights0_rows = get_window(height_diff_rows_1x, r, c, 1, cut).flatten()
-        heights0_cols = get_window(height_diff_cols_1x, r, c, 1, cut).flatten()
-
-        return unary_log_encoding_array(
-            np.concatenate((
-                heights2_rows,
-                heights2_cols,
-                roads2,
-                heights1_rows,
-                heights1_cols,
-                roads1,
-                heights0_rows,
-                heights0_cols
-                )),
-            encoding)
-
-    generated_roads_1x = generate_other(road_model, road_context_1x, rows, cols, deepcopy(generated_roads_4x), True, False)
-    generated_roads_1x = cutout(generated_roads_1x, padding, padding, rows, cols)
-
-    save_image(
-        generated_roads_1x,
-        f"{results_folder}/generated_roads_blurry_1x.png")
-
-    # Sharpen
-    generated_roads_1x = np.pad(generated_roads_1x, padding, 'reflect')
-    road_sharp_model = load_model(models["roads_sharp"])
-    def road_sharp_context(row, col):
-        window = get_window(generated_roads_1x, row, col, 1, cut)
-        return unary_log_encoding_array(window.flatten(), encoding)
-
-    generated_roads_1x = generate_other(road_sharp_model, road_sharp_context, rows, cols, deepcopy(generated_roads_1x), False,False)
-    save_image(
-        cutout(generated_roads_1x, padding, padding, rows, cols),
-        f"{results_folder}/generated_roads_1x.png")
-
-
-    # GENERATION OF RIVERS
-    #==========================
-
-    river_model = load_model(models["rivers_16-4-blurry"])
-
-    def river_context_1x(r, c):
-        heights2_rows = get_window(height_diff_rows_1x, r, c, 16, cut).flatten()
-        heights2_cols = get_window(height_diff_cols_1x, r, c, 16, cut).flatten()
-        rivers2 = get_window(generated_rivers_4x, r, c, 16, cut).flatten()
-
-        heights1_rows = get_window(height_diff_rows_1x, r, c, 4, cut).flatten()
-        heights1_cols = get_window(height_diff_cols_1x, r, c, 4, cut).flatten()
-        rivers1 = get_window(generated_rivers_4x, r, c, 4, cut).flatten()
-
-        heights0_rows = get_window(height_diff_rows_1x, r, c, 1, cut).flatten()
-        heights0_cols = get_window(height_diff_cols_1x, r, c, 1, cut).flatten()
-
-        return unary_log_encoding_array(
-            np.concatenate((
-                heights2_rows,
-                heights2_cols,
-                rivers2,
-                heights1_rows,
-                heights1_cols,
-                rivers1,
-                heights0_rows,
-                heights0_cols
-            )),
-            encoding)
-
-    generated_rivers_1x = generate_other(river_model, river_context_1x, rows, cols, deepcopy(generated_rivers_4x), True, False)
-    generated_rivers_1x = cutout(generated_rivers_1x, padding, padding, rows, cols)
-    save_image(
-        generated_rivers_1x,
-        f"{results_folder}/generated_rivers_blurry_1x.png")
-
-    # Sharpen
-    generated_rivers_1x = np.pad(generated_rivers_1x, padding, 'reflect')
-    river_sharp_model = load_model(models["rivers_sharp"])
-    def river_sharp_context(row, col):
-        window = get_window(generated_rivers_1x, row, col, 1, cut)
-        return unary_log_encoding_array(window.flatten(), encoding)
-
-    generated_rivers_1x = generate_other(river_sharp_model, river_sharp_context, rows, cols, deepcopy(generated_rivers_1x), False, False)
-
-    save_image(
-        cutout(generated_rivers_1x, padding, padding, rows, cols),
-        f"{results_folder}/generated_rivers_1x.png")
-
-
-    # GENERATION OF BUILDINGS
-    #==========================
-
-    building_model = load_model(models["buildings_16-4-blurry"])
-    generated_heights_1x = np.pad(generated_heights_1x, padding, 'reflect')
-
-    def building_context_1x(r, c):
-        heights2 = get_window(generated_heights_1x, r, c, 16, cut).flatten()
-        rivers2 = get_window(generated_rivers_1x, r, c, 16, cut).flatten()
-        roads2 = get_window(generated_roads_1x, r, c, 16, cut).flatten()
-        buildings2 = get_window(generated_buildings_4x, r, c, 16, cut).flatten()
-
-        heights1 = get_window(generated_heights_1x, r, c, 4, cut).flatten()
-        rivers1 = get_window(generated_rivers_1x, r, c, 4, cut).flatten()
-        roads1 = get_window(generated_roads_1x, r, c, 4, cut).flatten()
-        buildings1 = get_window(generated_buildings_4x, r, c, 4, cut).flatten()
-
-        heights0 = get_window(generated_heights_1x, r, c, 1, cut).flatten()
-        rivers0 = get_window(generated_rivers_1x, r, c, 1, cut).flatten()
-        roads0 = get_window(generated_roads_1x, r, c, 1, cut).flatten()
-
-        absolute2 = relativization(heights2)
-        absolute2 = unary_linear_encoding(absolute2, encoding)
-        heights2 = unary_log_encoding_array(heights2, encoding)
-        rivers2 = unary_log_encoding_array(rivers2, encoding)
-        roads2 = unary_log_encoding_array(roads2, encoding)
-        buildings2 = unary_log_encoding_array(buildings2, encoding)
-
-        absolute1 = relativization(heights1)
-        absolute1 = unary_linear_encoding(absolute1, encoding)
-        heights1 = unary_log_encoding_array(heights1, encoding)
-        rivers1 = unary_log_encoding_array(rivers1, encoding)
-        roads1 = unary_log_encoding_array(roads1, encoding)
-        buildings1 = unary_log_encoding_array(buildings1, encoding)
-
-        absolute0 = relativization(heights0)
-        absolute0 = unary_linear_encoding(absolute0, encoding)
-        heights0 = unary_log_encoding_array(heights0, encoding)
-        rivers0 = unary_log_encoding_array(rivers0, encoding)
-        roads0 = unary_log_encoding_array(roads0, encoding)
-
-        return np.concatenate((
-            heights2,
-            absolute2,
-            rivers2,
-            roads2,
-            buildings2,
-            heights1,
-            absolute1,
-            rivers1,
-            roads1,
-            buildings1,
-            heights0,
-            absolute0,
-            rivers0,
-            roads0,
-        ))
-
-    generated_buildings_1x = generate_other(building_model, building_context_1x, rows, cols, deepcopy(generated_buildings_4x), True, False)
-
-    # Sharpen
-
-    generated_buildings_1x = cutout(generated_buildings_1x, padding, padding, rows, cols)
-    save_image(
-        generated_buildings_1x,
-        f"{results_folder}/generated_buildings_blurry_1x.png")
-
-
-    generated_buildings_1x = np.pad(generated_buildings_1x, padding, 'reflect')
-    building_sharp_model = load_model(models["buildings_sharp"])
-    def building_sharp_context(row, col):
-        window = get_window(generated_buildings_1x, row, col, 1, cut)
-        return unary_log_encoding_array(window.flatten(), encoding)
-
-    generated_buildings_1x = generate_other(building_sharp_model, building_sharp_context, rows, cols, deepcopy(generated_buildings_1x), False, False)
-
-    save_image(
-        cutout(generated_buildings_1x, padding, padding, rows, cols),
-        f"{results_folder}/generated_buildings_1x.png")
-
-
-    #====================================
-    # THE FINAL PICTURE AND RETURN VALUE
-    #====================================
-
-    final_heights = cutout(generated_heights_1x, padding, padding, rows, cols)
-    final_rivers = cutout(generated_rivers_1x, padding, padding, rows, cols)
-    final_roads = cutout(generated_roads_1x, padding, padding, rows, cols)
-    final_buildings = cutout(generated_buildings_1x, padding, padding, rows, cols)
-
-    save_all([
-            final_heights,
-            final_rivers,
-            final_roads,
-            final_buildings
-        ],
-        colors,
-        f"{results_folder}/generated_all.png"
-    )
+        if random_modifier != 0:
+            generated_heights_4x = noisify(generated_heights_4x, 4)
+
+        # GENERATION OF HEIGHTS
+        #==========================
+
+        heights_model = models["heights_16-4-1"]
+
+
+        height_context_1x = context(
+            window("log_reversed", generated_heights_4x, 16, relative="inplace"),
+            window("log_reversed", generated_heights_4x, 4, relative="inplace"))
+
+        generated_heights_1x = generate(heights_model, padding, height_context_1x, rows, cols, deepcopy(generated_heights_4x))
+        generated_heights_1x = cutout(generated_heights_1x, padding, padding, rows, cols)
+        height_diff_rows_1x, height_diff_cols_1x = padded_derivatives(generated_heights_1x, padding)
+
+        writer.save_stage(
+            generated_heights_1x,
+            f"{results_folder}/generated_heights_1x.png")
+
+
+        # GENERATION OF ROADS
+        #==========================
+
+        road_model = models["roads_16-4-blurry"]
+
+        road_context_1x = context(
+            window("log", height_diff_rows_1x, 16),
+            window("log", height_diff_cols_1x, 16),
+            window("log", generated_roads_4x, 16),
+            window("log", height_diff_rows_1x, 4),
+            window("log", height_diff_cols_1x, 4),
+            window("log", generated_roads_4x, 4),
+            window("log", height_diff_rows_1x, 1),
+            window("log", height_diff_cols_1x, 1))
+
+        generated_roads_1x = generate_other(road_model, road_context_1x, rows, cols, deepcopy(generated_roads_4x), True, False)
+        generated_roads_1x = cutout(generated_roads_1x, padding, padding, rows, cols)
+
+        writer.save_stage(
+            generated_roads_1x,
+            f"{results_folder}/generated_roads_blurry_1x.png")
+
+        # Sharpen
+        generated_roads_1x = np.pad(generated_roads_1x, padding, 'reflect')
+        road_sharp_model = models["roads_sharp"]
+        road_sharp_context = context(window("log", generated_roads_1x, 1))
+
+        generated_roads_1x = generate_other(road_sharp_model, road_sharp_context, rows, cols, deepcopy(generated_roads_1x), False,False)
+        writer.save_stage(
+            cutout(generated_roads_1x, padding, padding, rows, cols),
+            f"{results_folder}/generated_roads_1x.png")
+
+
+        # GENERATION OF RIVERS
+        #==========================
+
+        river_model = models["rivers_16-4-blurry"]
+
+        river_context_1x = context(
+            window("log", height_diff_rows_1x, 16),
+            window("log", height_diff_cols_1x, 16),
+            window("log", generated_rivers_4x, 16),
+            window("log", height_diff_rows_1x, 4),
+            window("log", height_diff_cols_1x, 4),
+            window("log", generated_rivers_4x, 4),
+            window("log", height_diff_rows_1x, 1),
+            window("log", height_diff_cols_1x, 1))
+
+        generated_rivers_1x = generate_other(river_model, river_context_1x, rows, cols, deepcopy(generated_rivers_4x), True, False)
+        generated_rivers_1x = cutout(generated_rivers_1x, padding, padding, rows, cols)
+        writer.save_stage(
+            generated_rivers_1x,
+            f"{results_folder}/generated_rivers_blurry_1x.png")
+
+        # Sharpen
+        generated_rivers_1x = np.pad(generated_rivers_1x, padding, 'reflect')
+        river_sharp_model = models["rivers_sharp"]
+        river_sharp_context = context(window("log", generated_rivers_1x, 1))
+
+        generated_rivers_1x = generate_other(river_sharp_model, river_sharp_context, rows, cols, deepcopy(generated_rivers_1x), False, False)
+
+        writer.save_stage(
+            cutout(generated_rivers_1x, padding, padding, rows, cols),
+            f"{results_folder}/generated_rivers_1x.png")
+
+
+        # GENERATION OF BUILDINGS
+        #==========================
+
+        building_model = models["buildings_16-4-blurry"]
+        generated_heights_1x = np.pad(generated_heights_1x, padding, 'reflect')
+
+        building_context_1x = context(
+            window("log", generated_heights_1x, 16, relative="inplace"),
+            window("log", generated_rivers_1x, 16),
+            window("log", generated_roads_1x, 16),
+            window("log", generated_buildings_4x, 16),
+            window("log", generated_heights_1x, 4, relative="inplace"),
+            window("log", generated_rivers_1x, 4),
+            window("log", generated_roads_1x, 4),
+            window("log", generated_buildings_4x, 4),
+            window("log", generated_heights_1x, 1, relative="inplace"),
+            window("log", generated_rivers_1x, 1),
+            window("log", generated_roads_1x, 1))
+
+        generated_buildings_1x = generate_other(building_model, building_context_1x, rows, cols, deepcopy(generated_buildings_4x), True, False)
+
+        # Sharpen
+
+        generated_buildings_1x = cutout(generated_buildings_1x, padding, padding, rows, cols)
+        writer.save_stage(
+            generated_buildings_1x,
+            f"{results_folder}/generated_buildings_blurry_1x.png")
+
+
+        generated_buildings_1x = np.pad(generated_buildings_1x, padding, 'reflect')
+        building_sharp_model = models["buildings_sharp"]
+        building_sharp_context = context(window("log", generated_buildings_1x, 1))
+
+        generated_buildings_1x = generate_other(building_sharp_model, building_sharp_context, rows, cols, deepcopy(generated_buildings_1x), False, False)
+
+        writer.save_stage(
+            cutout(generated_buildings_1x, padding, padding, rows, cols),
+            f"{results_folder}/generated_buildings_1x.png")
+
+
+        #====================================
+        # THE FINAL PICTURE AND RETURN VALUE
+        #====================================
+
+        final_heights = cutout(generated_heights_1x, padding, padding, rows, cols)
+        final_rivers = cutout(generated_rivers_1x, padding, padding, rows, cols)
+        final_roads = cutout(generated_roads_1x, padding, padding, rows, cols)
+        final_buildings = cutout(generated_buildings_1x, padding, padding, rows, cols)
+
+        writer.save_all([
+                final_heights,
+                final_rivers,
+                final_roads,
+                final_buildings
+            ],
+            colors,
+            f"{results_folder}/generated_all.png"
+        )
+
+        # Final layers in full precision, as 16-bit binary PGM images
+        write_pgm_rescaled(final_heights, f"{results_folder}/generated_heights.pgm")
+        write_pgm_rescaled(final_roads, f"{results_folder}/generated_roads.pgm")
+        write_pgm_rescaled(final_rivers, f"{results_folder}/generated_rivers.pgm")
+        write_pgm_rescaled(final_buildings, f"{results_folder}/generated_buildings.pgm")
 
     return {
         "heights": final_heights,
         "roads": final_roads,
         "rivers": final_rivers,
         "buildings": final_buildings
-    }
\ No newline at end of file
+    }
+
+
+def generate_many(
+    input_folders,
+    output_root,
+    config_file = "nn_generator/examples/generation_config.txt",
+    random_modifier = 10,
+    backend = "numpy",
+    seeds = None,
+    save_stages = True,
+    max_batch = 8,
+):
+    """Generates maps for several inputs at once.
+    Maps are generated in groups of max_batch maps. Every map of a group is generated by generate_map()
+    in its own thread, while calls of the same network from all maps of the group are stacked
+    into a single call, see batching.py. A group waits for its slowest map.
+    input_folders: [str]
+        Folders containing user input.
+    output_root: str
+        Results of each input are stored into a folder of the same name in it.
+    backend: str
+        With "numpy" or "prefix", every map is the same as generated by generate_map() with its seed
+        and row_independent. Tensorflow networks round stacked calls differently, the maps differ slightly.
+    seeds: [int]
+        Seeds of the noise of each map. Drawn from numpy.random if not given.
+    save_stages: bool
+        Save images of every stage of the maps, see generate_map().
+    max_batch: int
+        Number of maps generated together.
+    Returns {input folder: dictionary returned by generate_map()}.
+    """
+    if seeds is None:
+        seeds = [np.random.randint(2 ** 31) for _ in input_folders]
+
+    check_path(config_file)
+    models = registry.model_set(config_file, backend, GENERATION_ORDER)
+    results = {}
+    # Maps are traced by the tracer of this thread, each in its own thread
+    tracer = active()
+
+    for first in range(0, len(input_folders), max_batch):
+        group = list(enumerate(input_folders))[first : first + max_batch]
+        batcher = ModelBatcher(len(group))
+        errors = []
+
+        def run(index, folder):
+            try:
+                with tracing(tracer):
+                    results[folder] = generate_map(
+                        folder,
+                        os.path.join(output_root, os.path.basename(os.path.normpath(folder))),
+                        config_file,
+                        random_modifier,
+                        backend = backend,
+                        seed = seeds[index],
+                        model_set = BatchedModelSet(batcher, index, models),
+                        save_stages = save_stages,
+                        row_independent = True)
+            except BaseException as error:
+                errors.append(error)
+            finally:
+                batcher.finish()
+
+        threads = [threading.Thread(target=run, args=(index, folder)) for index, folder in group]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    return {folder: results[folder] for folder in input_folders}
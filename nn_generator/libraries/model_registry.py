@@ -0,0 +1,122 @@
+from .numpy_model import load_numpy_model
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import sys
+import os
+
+
+def load_network(model_file, backend="tensorflow"):
+    """Loads a network for the generation.
+    backend: str
+        "numpy" evaluates the network with plain NumPy, see numpy_model.py.
+        "prefix" does the same, but its first layer is evaluated without encoding the inputs, see NumpyModel.first_layer().
+        "tensorflow" loads it as a Keras model.
+    """
+    if backend in ("numpy", "prefix"):
+        return load_numpy_model(model_file)
+
+    if backend == "tensorflow":
+        # Imported only when needed, it takes long
+        from tensorflow.keras.models import load_model
+        return load_model(model_file)
+
+    print(f"Unknown backend '{backend}', use 'numpy', 'prefix' or 'tensorflow'.")
+    sys.exit()
+
+
+def read_config(config_file):
+    """Parses a config file = locations of the networks. Returns {name: model file}."""
+    models = {}
+    with open(config_file) as f:
+        for line in f:
+            tokens = line.strip().split("=")
+            models[tokens[0]] = tokens[1]
+
+    return models
+
+
+class ModelSet:
+    """Networks of one config file. Indexing it by a name from the config file returns the loaded network.
+    If an order of the names is given, the network following the requested one is loaded in the background.
+    """
+
+    def __init__(self, registry, files, backend, order=None):
+        self.registry = registry
+        self.files = files
+        self.backend = backend
+        self.order = order or []
+
+    def __getitem__(self, name):
+        if name in self.order:
+            following = self.order.index(name) + 1
+            if following < len(self.order) and self.order[following] in self.files:
+                self.registry.prefetch(self.files[self.order[following]], self.backend)
+
+        return self.registry.load(self.files[name], self.backend)
+
+    def preload(self):
+        """Starts loading all networks of the set in the background."""
+        for model_file in self.files.values():
+            self.registry.prefetch(model_file, self.backend)
+
+
+class ModelRegistry:
+    """Keeps loaded networks for repeated generations.
+    Networks are identified by absolute path of their file and the backend, and loaded again only
+    if the file was modified. So several config files (model sets) can be used one after another
+    without loading any network twice.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {(path, backend): (modification time, future of the network)}
+        self.models = {}
+        # {path: (modification time, files of the config)}
+        self.configs = {}
+        self.loader = ThreadPoolExecutor(max_workers=1)
+
+    def request(self, model_file, backend):
+        path = os.path.abspath(model_file)
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            loaded = self.models.get((path, backend))
+            failed = loaded is not None and loaded[1].done() and loaded[1].exception() is not None
+            if loaded is None or loaded[0] != mtime or failed:
+                loaded = (mtime, self.loader.submit(load_network, path, backend))
+                self.models[(path, backend)] = loaded
+
+        return loaded[1]
+
+    def load(self, model_file, backend="tensorflow"):
+        """Returns the network, loads it if it is not loaded yet."""
+        if not os.path.exists(model_file):
+            print(f"'{model_file}' does not exist.")
+            sys.exit()
+
+        return self.request(model_file, backend).result()
+
+    def prefetch(self, model_file, backend="tensorflow"):
+        """Starts loading the network in the background, if it is not loaded yet."""
+        if os.path.exists(model_file):
+            self.request(model_file, backend)
+
+    def model_set(self, config_file, backend="tensorflow", order=None):
+        """Returns ModelSet of the networks specified by a config file. Nothing is loaded yet."""
+        path = os.path.abspath(config_file)
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            if path not in self.configs or self.configs[path][0] != mtime:
+                self.configs[path] = (mtime, read_config(path))
+            files = self.configs[path][1]
+
+        return ModelSet(self, files, backend, order)
+
+    def clear(self):
+        """Forgets all loaded networks."""
+        with self.lock:
+            self.models.clear()
+            self.configs.clear()
+
+
+# Registry used by generate_map
+registry = ModelRegistry()
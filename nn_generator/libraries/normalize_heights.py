@@ -1,13 +1,38 @@
+from .basic.parsing import load_layer, chunk_ranges, RunningStatistics
 import numpy as np
+import os
+
+
+def layer_statistics(layer):
+    """Returns mean and standard deviation of all values in a layer.
+    The layer is read once by chunks, so it never has to fit into memory.
+    """
+    statistics = RunningStatistics()
+    for start, end in chunk_ranges(layer.shape[0]):
+        statistics.update(layer[start : end])
+
+    return (statistics.mean, statistics.std)
+
+
+def save_normalization(heights_folder, reduction, mean, std):
+    """Saves statistics of heights layer_{reduction}x, so that normalized_layer_{reduction}x is
+    normalized from it when it is loaded, see load_layer. A normalized copy saved before is removed."""
+    np.save(f"{heights_folder}/normalization_{reduction}x.npy", [mean, std])
+
+    if os.path.exists(f"{heights_folder}/normalized_layer_{reduction}x.npy"):
+        os.remove(f"{heights_folder}/normalized_layer_{reduction}x.npy")
 
 
 def normalize_heights(folder, reductions=[1, 4, 16, 64]):
     """Performs standard score normalization on heights data.
     https://en.wikipedia.org/wiki/Standard_score
+    Only the mean and standard deviation of every layer are saved, normalized layers are
+    computed from them when they are read, see load_layer.
+    Heights parsed by parse_heights are normalized already.
     """
     heights_folder = f"{folder}/heights_layers"
 
     for reduction in reductions:
-        layer = np.load(f"{heights_folder}/layer_{reduction}x.npy")
-        layer = (layer - np.mean(layer)) / np.std(layer)
-        np.save(f"{heights_folder}/normalized_layer_{reduction}x.npy", layer, allow_pickle=True)
\ No newline at end of file
+        layer = load_layer(f"{heights_folder}/layer_{reduction}x.npy")
+        mean, std = layer_statistics(layer)
+        save_normalization(heights_folder, reduction, mean, std)
@@ -0,0 +1,203 @@
+from .basic.utilities import unary_log_runs, unary_log_runs_reversed, unary_linear_runs
+import numpy as np
+import json
+import sys
+import h5py
+
+
+def linear(x):
+    return x
+
+def relu(x):
+    return np.maximum(x, 0)
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+# Activations of Dense layers, that can be created by train.py
+ACTIVATIONS = {
+    None: linear,
+    "linear": linear,
+    "relu": relu,
+    "tanh": np.tanh,
+    "sigmoid": sigmoid,
+    "softmax": softmax,
+}
+
+# Descriptions of unary encodings of input segments and whether their runs are reversed, see first_layer()
+RUNS = {
+    "log": (unary_log_runs, False),
+    "log_reversed": (unary_log_runs_reversed, True),
+    "linear": (unary_linear_runs, False),
+}
+
+# Number of (pixel, value) pairs gathered at once in first_layer()
+GATHER_SIZE = 1 << 16
+
+
+def dense(x, kernel):
+    return np.matmul(x, kernel)
+
+def dense_rows(x, kernel):
+    # BLAS matmul rounds a row differently depending on the other rows of the batch,
+    # einsum does not, so outputs do not depend on how the inputs are batched. It is 2-3 times slower.
+    return np.einsum("nk,kh->nh", x, kernel)
+
+
+class NumpyModel:
+    """Sequential network of Dense layers evaluated with plain NumPy.
+    It can be called the same way as a Keras model: model(inputs) returns outputs for a batch of inputs.
+    Computes in float32 like Tensorflow, results may differ from it in the last bits.
+    Products are computed by BLAS, which rounds an output row differently depending on the rest of the batch.
+    Outputs of a row_independent model depend only on their input rows, see row_independent().
+    """
+
+    def __init__(self, layers, row_independent=False):
+        # [(kernel, bias, activation)]
+        self.layers = layers
+        self.input_size = layers[0][0].shape[0]
+        self.output_size = layers[-1][0].shape[1]
+        # Prefix sums of the first kernel for input segments, see first_layer()
+        self.tables = {}
+        self.dense = dense_rows if row_independent else dense
+        self.independent = self if row_independent else None
+
+    def row_independent(self):
+        """Returns the same network, whose every output row depends only on its input row.
+        Its outputs do not change, when inputs are evaluated in different batches, such as by tiles
+        or together with other maps, but it is slower. The copy shares weights and tables with this model."""
+        if self.independent is None:
+            self.independent = NumpyModel(self.layers, True)
+            self.independent.tables = self.tables
+        return self.independent
+
+    def __call__(self, inputs):
+        x = np.asarray(inputs, dtype=np.float32)
+        return self.from_first_layer(self.dense(x, self.layers[0][0]))
+
+    def from_first_layer(self, product):
+        """Finishes the evaluation from the product of inputs with the kernel of the first layer."""
+        kernel, bias, activation = self.layers[0]
+        x = activation(product + bias)
+        for kernel, bias, activation in self.layers[1:]:
+            x = activation(self.dense(x, kernel) + bias)
+
+        return x
+
+    def first_layer(self, segments, encoding, offset=None):
+        """Product of encoded segments with the kernel of the first layer, computed without encoding them.
+        segments: [(str, matrix)]
+            Parts of the inputs in the same form as for generate.encode_segments().
+        offset: int
+            Input of the model, where the segments start. None if they are the last inputs.
+
+        Encoding of a value is a run of ones and one partial entry, so its product with the kernel is
+        a sum of consecutive kernel rows, taken from a table of prefix sums, and one more row.
+        This replaces encoding rows of the kernel by one for each value.
+        """
+        kernel = self.layers[0][0]
+        widths = [np.shape(values)[1] * (1 if kind == "raw" else encoding) for kind, values in segments]
+        if offset is None:
+            offset = self.input_size - sum(widths)
+
+        product = np.zeros((len(segments[0][1]), kernel.shape[1]), dtype=np.float32)
+        for (kind, values), width in zip(segments, widths):
+            if kind == "raw":
+                product += self.dense(np.asarray(values, dtype=np.float32), kernel[offset : offset + width])
+            else:
+                product += self.unary_product(kind, values, encoding, offset)
+            offset += width
+
+        return product
+
+    def unary_product(self, kind, values, encoding, offset):
+        runs, reversed = RUNS[kind]
+        count = np.shape(values)[1]
+        key = (kind, count, encoding, offset)
+        if key not in self.tables:
+            rows = self.layers[0][0][offset : offset + count * encoding].astype(np.float64)
+            rows = np.reshape(rows, (count, encoding, -1))
+            # sums[j, n] = sum of the first n rows of value j
+            sums = np.zeros((count, encoding + 1, rows.shape[2]))
+            sums[:, 1:] = np.cumsum(rows, axis=1)
+            if reversed:
+                # Sum of the rows from n on
+                sums = sums[:, -1:] - sums
+            self.tables[key] = (
+                np.reshape(sums, (-1, rows.shape[2])).astype(np.float32),
+                np.reshape(rows, (-1, rows.shape[2])).astype(np.float32))
+        sums, rows = self.tables[key]
+
+        signs, counts, positions, deltas = runs(values, encoding)
+        run_rows = np.arange(count) * (encoding + 1) + counts
+        partial_rows = np.arange(count) * encoding + positions
+        signs = signs.astype(np.float32)
+        deltas = (signs * deltas).astype(np.float32)
+
+        product = np.empty((len(signs), sums.shape[1]), dtype=np.float32)
+        step = max(1, GATHER_SIZE // count)
+        for start in range(0, len(signs), step):
+            end = start + step
+            product[start : end] = (
+                np.einsum("nk,nkh->nh", signs[start : end], sums[run_rows[start : end]])
+                + np.einsum("nk,nkh->nh", deltas[start : end], rows[partial_rows[start : end]]))
+
+        return product
+
+    def predict(self, inputs):
+        return self(inputs)
+
+
+def row_independent(model):
+    """Returns model.row_independent() for a NumpyModel. Other networks, such as Keras models, are returned unchanged."""
+    if isinstance(model, NumpyModel):
+        return model.row_independent()
+    return model
+
+
+def load_numpy_model(model_file):
+    """Loads a network saved by train.py (.h5 file of a Keras Sequential model) as NumpyModel.
+    Dropout layers are left out, they do nothing during inference.
+    """
+    with h5py.File(model_file, "r") as f:
+        config = json.loads(f.attrs["model_config"])
+        if config["class_name"] != "Sequential":
+            print(f"'{model_file}': only Sequential models are supported, found {config['class_name']}.")
+            sys.exit()
+
+        layer_configs = config["config"]
+        # Newer Keras versions store the layers in a dictionary with the name of the model
+        if isinstance(layer_configs, dict):
+            layer_configs = layer_configs["layers"]
+
+        weights = f["model_weights"]
+        layers = []
+        for layer in layer_configs:
+            layer_type = layer["class_name"]
+            if layer_type in ("Dropout", "InputLayer"):
+                continue
+
+            if layer_type != "Dense":
+                print(f"'{model_file}': layer {layer_type} is not supported.")
+                sys.exit()
+
+            activation = layer["config"].get("activation")
+            if activation not in ACTIVATIONS:
+                print(f"'{model_file}': activation {activation} is not supported.")
+                sys.exit()
+
+            group = weights[layer["config"]["name"]]
+            names = [name.decode() if isinstance(name, bytes) else name for name in group.attrs["weight_names"]]
+            kernel = np.array(group[names[0]], dtype=np.float32)
+            if layer["config"].get("use_bias", True):
+                bias = np.array(group[names[1]], dtype=np.float32)
+            else:
+                bias = np.zeros(kernel.shape[1], dtype=np.float32)
+
+            layers.append((kernel, bias, ACTIVATIONS[activation]))
+
+    return NumpyModel(layers)
@@ -1,9 +1,37 @@
-from .basic.parsing import parse
-from .basic.matrix_manipulation import derivatives, rescale
+from .basic.parsing import parse, parse_source, pyramid, RunningStatistics
+from .normalize_heights import save_normalization
+from .basic.matrix_manipulation import derivatives, rescale_quantized
+from .basic.pgm import read_pgm
+import numpy as np
 import cv2
 import os
 
-def parse_image(image_name, output_folder_name, reductions=[1, 4, 16, 64], blur=False, compute_differences=False):
+def read_image(image_name, output_folder_name):
+    """Reads and rescales an image to be parsed into output_folder_name, which is created if it doesn't exist.
+    Returns (image, scale), values of the image are integers divided by scale, see rescale_quantized."""
+    if not os.path.exists(output_folder_name):
+	    os.makedirs(output_folder_name)
+
+    # Binary images are memory-mapped, only the rescaled copy is kept in memory
+    return rescale_quantized(np.asarray(read_pgm(image_name, mmap=True)))
+
+def layer_parser(output_folder_name, sample_first, cut=5):
+    """Returns function parse_layers(image, reductions, name, statistics=None, scale=None) saving layers of an image into output_folder_name.
+    name(reduction) is the name of each layer, statistics(reduction) returns RunningStatistics of each layer or None.
+    Layers are written either whole, or as block means to sample windows from. Block means of all
+    the reductions are computed once, see pyramid. If values of the image are integers divided by scale,
+    every level is summed exactly from the previous one."""
+    def parse_layers(image, reductions, name, statistics=lambda reduction: None, scale=None):
+        for reduction, means in pyramid(image, reductions, scale):
+            if (sample_first):
+                parse_source(image, reduction, f"{output_folder_name}/{name(reduction).replace('layer', 'source')}",
+                    statistics(reduction), cut, means)
+            else:
+                parse(image, cut, reduction, f"{output_folder_name}/{name(reduction)}", statistics(reduction), means)
+
+    return parse_layers
+
+def parse_image(image_name, output_folder_name, reductions=[1, 4, 16, 64], blur=False, compute_differences=False, sample_first=False):
     """Parses a single image into layers specifyied by reductions.
     image_name: str
         Name of the image to parse.
@@ -16,27 +44,43 @@ def parse_image(image_name, output_folder_name, reductions=[1, 4, 16, 64], blur=
     compute_differences: bool
         Rather then with the original image, computes 2 images containing differences in x and y direction respectively.
         Useful for heights.
+    sample_first: bool
+        Rather than every layer, stores only block means of the image for each reduction.
+        Windows are then sampled from them only for the training examples, see load_layer.
     """
-    cut = 5
-
-    if not os.path.exists(output_folder_name):
-	    os.makedirs(output_folder_name)
-
-    image = cv2.imread(image_name, cv2.IMREAD_GRAYSCALE)
-    image = rescale(image)
+    image, scale = read_image(image_name, output_folder_name)
+    parse_layers = layer_parser(output_folder_name, sample_first)
 
     if (blur):
+        # Blurred values are not integers anymore
         image = cv2.GaussianBlur(image, (5,5), cv2.BORDER_DEFAULT)
-
-        for reduction in reductions:
-            parse(image, cut, reduction, f"{output_folder_name}/layer_blurry_{reduction}x")
+        parse_layers(image, reductions, lambda reduction: f"layer_blurry_{reduction}x")
         
     elif (compute_differences):
+        # Differences of integers divided by scale are such integers too
         ders_r, ders_c = derivatives(image)
-
-        for reduction in reductions:
-            parse(ders_r, cut, reduction, f"{output_folder_name}/differences_rows_layer_{reduction}x")
-            parse(ders_c, cut, reduction, f"{output_folder_name}/differences_columns_layer_{reduction}x")
+        parse_layers(ders_r, reductions, lambda reduction: f"differences_rows_layer_{reduction}x", scale=scale)
+        parse_layers(ders_c, reductions, lambda reduction: f"differences_columns_layer_{reduction}x", scale=scale)
     else:
-        for reduction in reductions:
-            parse(image, cut, reduction, f"{output_folder_name}/layer_{reduction}x")
\ No newline at end of file
+        parse_layers(image, reductions, lambda reduction: f"layer_{reduction}x", scale=scale)
+
+def parse_heights(image_name, output_folder_name, reductions=[1, 4, 16, 64], sample_first=False):
+    """Parses heights in a single pass. The image is read once and parsed into layers, normalized layers
+    and layers of differences in x and y direction, the same as parse_image, normalize_heights and
+    parse_image with compute_differences would.
+    Mean and standard deviation of every layer are computed while it is written, normalized layers
+    are not stored, but normalized from them when they are loaded, see load_layer.
+    """
+    image, scale = read_image(image_name, output_folder_name)
+    parse_layers = layer_parser(output_folder_name, sample_first)
+
+    statistics = {reduction: RunningStatistics() for reduction in reductions}
+    parse_layers(image, reductions, lambda reduction: f"layer_{reduction}x", statistics.get, scale)
+    for reduction in reductions:
+        save_normalization(output_folder_name, reduction, statistics[reduction].mean, statistics[reduction].std)
+
+    ders_r, ders_c = derivatives(image)
+    del image
+
+    parse_layers(ders_r, reductions, lambda reduction: f"differences_rows_layer_{reduction}x", scale=scale)
+    parse_layers(ders_c, reductions, lambda reduction: f"differences_columns_layer_{reduction}x", scale=scale)
@@ -1,158 +1,156 @@
-from .basic.matrix_manipulation import rescale, rescale2
-from .basic.utilities import unary_log_encoding_array, noisify_exp, relativization, unary_linear_encoding, unary_log_encoding_array_reversed
+from .basic.matrix_manipulation import rescale, rescale2_rows
+from .basic.parsing import LayerCache, nonzero_rows
+from .basic.utilities import noisify_exp, noisify_exp_rows, relativization_matrix, unary_log_encoding_matrix, unary_log_encoding_matrix_reversed, unary_linear_encoding_matrix
+from .basic.compact import save_dataset
+from .tracing import stage
+from .processes import process_context, share, unshare
 import os
 import sys
 import numpy as np
 
-def process_training_data(
-    mode,
-    reduction0,
-    reduction1,
-    reduction2 = None,
-    training_folder = "training_data",
-    size = 150000
-    ):
-    """Takes parsed layers from training folder and constructs training datasets for networks to train them.
-    mode: str
-        heights, roads, rivers or buildings
-    reduction[0-2]: int
-        Constructs a network that layer_reduction2 and layer_reduction1 as context and generates layer_reduction0.
-    training_folder: str
-        Folder containing parsed layers and where to store the results.
-    size: int
-        Number of training examples in the training dataset.
-    """
-    encoding = 8
+def heights_file(training_folder, reduction):
+    return f"{training_folder}/heights_layers/normalized_layer_{reduction}x.npy"
 
-    if reduction2 == None:
-        output_folder_name = f"{training_folder}/{mode}_{reduction1}-{reduction0}_{size}"
-    else:
-        output_folder_name = f"{training_folder}/{mode}_{reduction2}-{reduction1}-{reduction0}_{size}"
+def heights_diff_file(training_folder, reduction):
+    rows = f"{training_folder}/heights_layers/differences_rows_layer_{reduction}x.npy"
+    columns = f"{training_folder}/heights_layers/differences_columns_layer_{reduction}x.npy"
 
+    return (rows, columns)
 
-    def make_dir_checked(dir):
-        if not os.path.exists(dir):
-    	    os.makedirs(dir)
+def mode_file(training_folder, mode, reduction):
+    return f"{training_folder}/{mode}_layers/layer_{reduction}x.npy"
 
-    def heights_file(reduction):
-        return f"{training_folder}/heights_layers/normalized_layer_{reduction}x.npy"
+def mode_blurred_file(training_folder, mode, reduction):
+    return f"{training_folder}/{mode}_layers/layer_blurry_{reduction}x.npy"
 
-    def heights_diff_file(reduction):
-        rows = f"{training_folder}/heights_layers/differences_rows_layer_{reduction}x.npy"
-        columns = f"{training_folder}/heights_layers/differences_columns_layer_{reduction}x.npy"
+def dataset_folder(training_folder, mode, reduction0, reduction1, reduction2, size):
+    """Folder of the dataset constructed by process_training_data with given parameters."""
+    if reduction2 == None:
+        return f"{training_folder}/{mode}_{reduction1}-{reduction0}_{size}"
+    return f"{training_folder}/{mode}_{reduction2}-{reduction1}-{reduction0}_{size}"
 
-        return (rows, columns)
+def dataset_parts(mode, reduction0):
+    """Names of datasets constructed for the networks generating layer_reduction0.
+    Roads, rivers and buildings have a blurry and a sharp network for the 1x layer."""
+    if mode != "heights" and reduction0 == 1:
+        return ("blurry", "sharp")
+    return ("",)
 
-    def mode_file(mode, reduction):
-        return f"{training_folder}/{mode}_layers/layer_{reduction}x.npy"
+def candidates(mode, reduction1, training_folder="training_data", layers=None):
+    """Returns indices of windows, from which training examples are sampled.
+    For heights all windows, otherwise windows of layer_reduction1 that are not empty."""
+    layers = layers or LayerCache()
 
-    def mode_blurred_file(mode, reduction):
-        return f"{training_folder}/{mode}_layers/layer_blurry_{reduction}x.npy"
-    
-    def check_count(count, size):
-        if (count < size):
-            print("ERROR: Not enough training data.")
-            print(f"{count} viable data, but {size} training size.")
-            sys.exit()
+    if mode == "heights":
+        return np.arange(layers[heights_file(training_folder, reduction1)].shape[0])
 
-    make_dir_checked(output_folder_name)
+    # Thin out empty entries
+    return nonzero_rows(layers[mode_file(training_folder, mode, reduction1)])
+
+def examples(
+    mode,
+    reduction0,
+    reduction1,
+    reduction2,
+    randomizer,
+    training_folder = "training_data",
+    layers = None,
+    parts = None,
+    generator = np.random
+    ):
+    """Constructs training examples from windows at indices given by randomizer.
+    Yields (part, inputs, outputs) for every dataset part, see dataset_parts().
+    Noise and rescaling are applied to all the examples together, the same way as in process_training_data.
+    parts: [str]
+        Constructs only these parts, all by default.
+    generator: numpy.random or numpy.random.RandomState
+        Draws the noise.
+    """
+    encoding = 8
+    layers = layers or LayerCache()
+    parts = parts or dataset_parts(mode, reduction0)
+    main_part = dataset_parts(mode, reduction0)[0]
+
+    # Sampled rows of every layer file, the same file is gathered only once
+    gathered = {}
+    def rows(file_name):
+        if file_name not in gathered:
+            gathered[file_name] = layers.gather(file_name, randomizer)
+        return gathered[file_name]
 
     if mode == "heights":
-        layer0 = np.load(heights_file(reduction0))
-        count = layer0.shape[0]
-        check_count(count, size)
-        randomizer = np.random.choice(count, size=size, replace=False)
-        func = lambda t : unary_log_encoding_array_reversed(t, encoding)
-        noisify = lambda t : noisify_exp(t, 20)
-
-        def context_func(arr):
-            absolute = relativization(arr)
-            a = unary_log_encoding_array_reversed(arr, encoding)
-            b = unary_linear_encoding(absolute, encoding)
-            return np.concatenate(( a, b ))
-
-        absolutes = []
-
-        def recurrent_func(arr):
-            absolute = relativization(arr)
-            absolutes.append(absolute)
-            a = unary_log_encoding_array_reversed(arr, encoding)
-            b = unary_linear_encoding(absolute, encoding)
-            return np.concatenate(( a, b ))
-
-        layer0 = layer0[randomizer]
-        layer0 = np.apply_along_axis(noisify, 1, layer0)
+        def context_func(matrix):
+            absolutes = relativization_matrix(matrix)
+            a = unary_log_encoding_matrix_reversed(matrix, encoding)
+            b = unary_linear_encoding_matrix(absolutes[:, None], encoding)
+            return np.concatenate(( a, b ), axis=1)
+
+        layer0 = rows(heights_file(training_folder, reduction0))
+        layer0 = noisify_exp_rows(layer0, 20, generator)
         layer0 = rescale(layer0)
         outputs = layer0[:, -3]
         recurrents = layer0[:, :-3]
-        recurrents = np.apply_along_axis(recurrent_func, 1, recurrents)
-        outputs -= np.asarray(absolutes)
-        outputs = np.reshape(outputs, (size, 1))
-        outputs = np.apply_along_axis(func, 1, outputs)
-
-        layer1 = np.load(heights_file(reduction1))
-        layer1 = layer1[randomizer]
-        layer1 = np.apply_along_axis(noisify, 1, layer1)
+        absolutes = relativization_matrix(recurrents)
+        recurrents = np.concatenate((
+            unary_log_encoding_matrix_reversed(recurrents, encoding),
+            unary_linear_encoding_matrix(absolutes[:, None], encoding)),
+            axis=1)
+        outputs -= absolutes
+        outputs = np.reshape(outputs, (len(outputs), 1))
+        outputs = unary_log_encoding_matrix_reversed(outputs, encoding)
+
+        layer1 = rows(heights_file(training_folder, reduction1))
+        layer1 = noisify_exp_rows(layer1, 20, generator)
         layer1 = rescale(layer1)
-        layer1 = np.apply_along_axis(context_func, 1, layer1)
+        layer1 = context_func(layer1)
 
         inputs = np.concatenate((layer1, recurrents), axis=1)
 
         if (reduction2 != None):
-            layer2 = np.load(heights_file(reduction2))
-            layer2 = layer2[randomizer]
-            layer2 = np.apply_along_axis(noisify, 1, layer2)
+            layer2 = rows(heights_file(training_folder, reduction2))
+            layer2 = noisify_exp_rows(layer2, 20, generator)
             layer2 = rescale(layer2)
-            layer2 = np.apply_along_axis(context_func, 1, layer2)
+            layer2 = context_func(layer2)
 
             inputs = np.concatenate((layer2, inputs), axis=1)
 
-        np.save(f"{output_folder_name}/inputs", inputs)
-        np.save(f"{output_folder_name}/outputs", outputs)
+        yield ("", inputs, outputs)
 
-    if mode == "roads" or mode == "rivers":
+    if (mode == "roads" or mode == "rivers") and main_part in parts:
         # Reduction1
         #======================
 
         # Paths1
-        paths1 = np.load(mode_file(mode, reduction1))
-        # Thin out empty entries
-        nonzero_indices = np.argwhere(np.any(paths1 != 0, axis=1)).flatten()
-        check_count(len(nonzero_indices), size)
-        randomizer = np.random.choice(nonzero_indices, size=size, replace=False)
-
-        paths1 = paths1[randomizer]
-        func = lambda t: unary_log_encoding_array(t, encoding)
-        paths1 = np.apply_along_axis(func, 1, paths1)
+        paths1 = rows(mode_file(training_folder, mode, reduction1))
+        func = lambda t: unary_log_encoding_matrix(t, encoding)
+        paths1 = func(paths1)
 
         # Paths0
-        file0 = mode_file(mode, reduction0) if reduction0 != 1 else mode_blurred_file(mode, reduction0)
-        paths0 = np.load(file0)[randomizer]
+        file0 = mode_file(training_folder, mode, reduction0) if reduction0 != 1 else mode_blurred_file(training_folder, mode, reduction0)
+        paths0 = rows(file0)
         outputs = paths0[:, -3]
         recurrents = paths0[:, :-3]
 
         outputs = np.reshape(outputs, (len(outputs), 1))
-        outputs = np.apply_along_axis(func, 1, outputs)
-        recurrents = np.apply_along_axis(func, 1, recurrents)
+        outputs = func(outputs)
+        recurrents = func(recurrents)
 
         # Height differences
-        def diff_func(arr):
-            arr = rescale2(arr)
-            arr = unary_log_encoding_array(arr, 8)
-            return arr
+        def diff_func(matrix):
+            matrix = rescale2_rows(matrix)
+            return unary_log_encoding_matrix(matrix, 8)
     
-        row_file, col_file = heights_diff_file(reduction0)
-        height0_diff_rows = np.load(row_file)
-        height0_diff_rows = height0_diff_rows[randomizer]
-        height0_diff_cols = np.load(col_file)[randomizer]
-        height0_diff_rows = np.apply_along_axis(diff_func, 1, height0_diff_rows)
-        height0_diff_cols = np.apply_along_axis(diff_func, 1, height0_diff_cols)
+        row_file, col_file = heights_diff_file(training_folder, reduction0)
+        height0_diff_rows = rows(row_file)
+        height0_diff_cols = rows(col_file)
+        height0_diff_rows = diff_func(height0_diff_rows)
+        height0_diff_cols = diff_func(height0_diff_cols)
     
-        row_file, col_file = heights_diff_file(reduction1)
-        height1_diff_rows = np.load(row_file)[randomizer]
-        height1_diff_cols = np.load(col_file)[randomizer]
-        height1_diff_rows = np.apply_along_axis(diff_func, 1, height1_diff_rows)
-        height1_diff_cols = np.apply_along_axis(diff_func, 1, height1_diff_cols)
+        row_file, col_file = heights_diff_file(training_folder, reduction1)
+        height1_diff_rows = rows(row_file)
+        height1_diff_cols = rows(col_file)
+        height1_diff_rows = diff_func(height1_diff_rows)
+        height1_diff_cols = diff_func(height1_diff_cols)
     
         # Put it together
         inputs = np.concatenate((
@@ -168,99 +166,68 @@ def process_training_data(
         # Reduction 2
         #==================
         if (reduction2 != None):
-            paths2 = np.load(mode_file(mode, reduction2))[randomizer]
-            paths2 = np.apply_along_axis(func, 1, paths2)
-            row_file, col_file = heights_diff_file(reduction2)
-            height2_diff_rows = np.load(row_file)[randomizer]
-            height2_diff_cols = np.load(col_file)[randomizer]
-            height2_diff_rows = np.apply_along_axis(diff_func, 1, height2_diff_rows)
-            height2_diff_cols = np.apply_along_axis(diff_func, 1, height2_diff_cols)
+            paths2 = rows(mode_file(training_folder, mode, reduction2))
+            paths2 = func(paths2)
+            row_file, col_file = heights_diff_file(training_folder, reduction2)
+            height2_diff_rows = rows(row_file)
+            height2_diff_cols = rows(col_file)
+            height2_diff_rows = diff_func(height2_diff_rows)
+            height2_diff_cols = diff_func(height2_diff_cols)
 
             inputs = np.concatenate((height2_diff_rows, height2_diff_cols, paths2, inputs), axis=1)
 
-        if (reduction0 == 1):
-            make_dir_checked(f"{output_folder_name}/blurry")
-            np.save(f"{output_folder_name}/blurry/inputs", inputs)
-            np.save(f"{output_folder_name}/blurry/outputs", outputs)
-        else:
-            np.save(f"{output_folder_name}/inputs", inputs)
-            np.save(f"{output_folder_name}/outputs", outputs)
+        yield (main_part, inputs, outputs)
 
 
-        # Sharp
-        #========================
-    
-        if (reduction0 == 1):
-            blurry = np.load(mode_blurred_file(mode, reduction0))[randomizer]
-            blurry = noisify_exp(blurry, 20)
-            blurry = np.apply_along_axis(func, 1, blurry)
-
-            sharp = np.load(mode_file(mode, reduction0))[randomizer]
-            outputs = sharp[:, -3]
-            recurrents = sharp[:, :-3]
-
-            inputs = np.concatenate((blurry, recurrents), axis=1)
-
-            make_dir_checked(f"{output_folder_name}/sharp")
-            np.save(f"{output_folder_name}/sharp/inputs", inputs)
-            np.save(f"{output_folder_name}/sharp/outputs", outputs)
-
-    if mode == "buildings":
+    if mode == "buildings" and main_part in parts:
         # Reduction1
         #=======================
 
-        buildings1 = np.load(mode_file("buildings", reduction1))
-        # Thin out empty entries
-        nonzero_indices = np.argwhere(np.any(buildings1 != 0, axis=1)).flatten()
-        check_count(len(nonzero_indices), size)
-        randomizer = np.random.choice(nonzero_indices, size=size, replace=False)
-
-        buildings1 = buildings1[randomizer]
-        func = lambda t: unary_log_encoding_array(t, encoding)
-        noisify = lambda t: noisify_exp(t, 20)
-        buildings1 = np.apply_along_axis(func, 1, buildings1)
+        buildings1 = rows(mode_file(training_folder, "buildings", reduction1))
+        func = lambda t: unary_log_encoding_matrix(t, encoding)
+        buildings1 = func(buildings1)
 
-        file0 =  mode_file(mode, reduction0) if reduction0 != 1 else mode_blurred_file(mode, reduction0)
-        buildings0 = np.load(mode_file("buildings", reduction0))[randomizer]
+        file0 =  mode_file(training_folder, mode, reduction0) if reduction0 != 1 else mode_blurred_file(training_folder, mode, reduction0)
+        buildings0 = rows(mode_file(training_folder, "buildings", reduction0))
         outputs = buildings0[:, -3]
         recurrents = buildings0[:, :-3]
 
         # Roads
-        roads0 = np.load(mode_file("roads", reduction0))[randomizer]
-        roads1 = np.load(mode_file("roads", reduction1))[randomizer]
-        roads1 = np.apply_along_axis(func, 1, roads1)
+        roads0 = rows(mode_file(training_folder, "roads", reduction0))
+        roads1 = rows(mode_file(training_folder, "roads", reduction1))
+        roads1 = func(roads1)
 
         # Rivers
-        rivers0 = np.load(mode_file("rivers", reduction0))[randomizer]
-        rivers1 = np.load(mode_file("rivers", reduction1))[randomizer]
-        rivers1 = np.apply_along_axis(func, 1, rivers1)
+        rivers0 = rows(mode_file(training_folder, "rivers", reduction0))
+        rivers1 = rows(mode_file(training_folder, "rivers", reduction1))
+        rivers1 = func(rivers1)
 
         # Heights
-        heights0 = np.load(heights_file(reduction0))[randomizer]
-        heights1 = np.load(heights_file(reduction1))[randomizer]
+        heights0 = rows(heights_file(training_folder, reduction0))
+        heights1 = rows(heights_file(training_folder, reduction1))
 
-        def context_func_b(arr):
-            absolute = relativization(arr)
-            a = unary_log_encoding_array(arr, encoding)
-            b = unary_linear_encoding(absolute, encoding)
-            return np.concatenate(( a, b ))
+        def context_func_b(matrix):
+            absolutes = relativization_matrix(matrix)
+            a = unary_log_encoding_matrix(matrix, encoding)
+            b = unary_linear_encoding_matrix(absolutes[:, None], encoding)
+            return np.concatenate(( a, b ), axis=1)
 
 
-        heights0 = np.apply_along_axis(noisify, 1, heights0)
+        heights0 = noisify_exp_rows(heights0, 20, generator)
         heights0 = rescale(heights0)
-        heights0 = np.apply_along_axis(context_func_b, 1, heights0)
+        heights0 = context_func_b(heights0)
 
-        heights1 = np.apply_along_axis(noisify, 1, heights1)
+        heights1 = noisify_exp_rows(heights1, 20, generator)
         heights1 = rescale(heights1)
-        heights1 = np.apply_along_axis(context_func_b, 1, heights1)
+        heights1 = context_func_b(heights1)
 
-        roads0 = np.apply_along_axis(func, 1, roads0)
-        rivers0 = np.apply_along_axis(func, 1, rivers0)
-        buildings0 = np.apply_along_axis(func, 1, buildings0)
-        recurrents = np.apply_along_axis(func, 1, recurrents)
+        roads0 = func(roads0)
+        rivers0 = func(rivers0)
+        buildings0 = func(buildings0)
+        recurrents = func(recurrents)
 
         outputs = np.reshape(outputs, (len(outputs), 1))
-        outputs = np.apply_along_axis(func, 1, outputs)
+        outputs = func(outputs)
 
         # Put it together
         inputs = np.concatenate((
@@ -278,18 +245,18 @@ def process_training_data(
         # Reduction2
         #==================
         if reduction2 != None:
-            heights2 = np.load(heights_file(reduction2))[randomizer]
+            heights2 = rows(heights_file(training_folder, reduction2))
             heights2 = rescale(heights2)
-            rivers2 = np.load(mode_file("rivers", reduction2))[randomizer]
-            rivers2 = np.apply_along_axis(func, 1, rivers2)
-            roads2 = np.load(mode_file("roads", reduction2))[randomizer]
-            roads2 = np.apply_along_axis(func, 1, roads2)
-            buildings2 = np.load(mode_file("buildings", reduction2))[randomizer]
-            buildings2 = np.apply_along_axis(func, 1, buildings2)
-
-            heights2 = np.apply_along_axis(noisify, 1, heights2)
+            rivers2 = rows(mode_file(training_folder, "rivers", reduction2))
+            rivers2 = func(rivers2)
+            roads2 = rows(mode_file(training_folder, "roads", reduction2))
+            roads2 = func(roads2)
+            buildings2 = rows(mode_file(training_folder, "buildings", reduction2))
+            buildings2 = func(buildings2)
+
+            heights2 = noisify_exp_rows(heights2, 20, generator)
             heights2 = rescale(heights2)
-            heights2 = np.apply_along_axis(context_func_b, 1, heights2)
+            heights2 = context_func_b(heights2)
 
             inputs = np.concatenate((
                 heights2,
@@ -300,29 +267,184 @@ def process_training_data(
                 axis=1
             )
 
-        if (reduction0 == 1):
-            make_dir_checked(f"{output_folder_name}/blurry")
-            np.save(f"{output_folder_name}/blurry/inputs", inputs)
-            np.save(f"{output_folder_name}/blurry/outputs", outputs)
-        else:
-            np.save(f"{output_folder_name}/inputs", inputs)
-            np.save(f"{output_folder_name}/outputs", outputs)
+        yield (main_part, inputs, outputs)
 
-        # Sharp
-        #========================
-    
-        if (reduction0 == 1):
-            blurry = np.load(mode_blurred_file(mode, reduction0))[randomizer]
-            blurry = noisify_exp(blurry, 20)
-            blurry = np.apply_along_axis(func, 1, blurry)
+    # Sharp
+    #========================
+
+    if mode != "heights" and reduction0 == 1 and "sharp" in parts:
+        func = lambda t: unary_log_encoding_matrix(t, encoding)
+        blurry = rows(mode_blurred_file(training_folder, mode, reduction0))
+        blurry = noisify_exp(blurry, 20, generator)
+        blurry = func(blurry)
+
+        sharp = rows(mode_file(training_folder, mode, reduction0))
+        outputs = sharp[:, -3]
+        recurrents = sharp[:, :-3]
+
+        inputs = np.concatenate((blurry, recurrents), axis=1)
+
+        yield ("sharp", inputs, outputs)
+
+
+def process_training_data(
+    mode,
+    reduction0,
+    reduction1,
+    reduction2 = None,
+    training_folder = "training_data",
+    size = 150000,
+    layers = None,
+    compact = True
+    ):
+    """Takes parsed layers from training folder and constructs training datasets for networks to train them.
+    mode: str
+        heights, roads, rivers or buildings
+    reduction[0-2]: int
+        Constructs a network that layer_reduction2 and layer_reduction1 as context and generates layer_reduction0.
+    training_folder: str
+        Folder containing parsed layers and where to store the results.
+    size: int
+        Number of training examples in the training dataset.
+    layers: LayerCache
+        Opened layers shared by several calls, see construct_training_datasets.
+    compact: bool
+        Saves the dataset in the compact form, see basic/compact.py. Otherwise as inputs.npy and outputs.npy.
+    """
+    layers = layers or LayerCache()
 
-            sharp = np.load(mode_file(mode, reduction0))[randomizer]
-            outputs = sharp[:, -3]
-            recurrents = sharp[:, :-3]
+    output_folder_name = dataset_folder(training_folder, mode, reduction0, reduction1, reduction2, size)
 
-            inputs = np.concatenate((blurry, recurrents), axis=1)
 
-            make_dir_checked(f"{output_folder_name}/sharp")
-            np.save(f"{output_folder_name}/sharp/inputs", inputs)
-            np.save(f"{output_folder_name}/sharp/outputs", outputs)
-            
\ No newline at end of file
+    def make_dir_checked(dir):
+        if not os.path.exists(dir):
+    	    os.makedirs(dir)
+
+    def check_count(count, size):
+        if (count < size):
+            print("ERROR: Not enough training data.")
+            print(f"{count} viable data, but {size} training size.")
+            sys.exit()
+
+    make_dir_checked(output_folder_name)
+
+    with stage(f"process_training_data {os.path.basename(output_folder_name)}", size, "examples"):
+        viable = candidates(mode, reduction1, training_folder, layers)
+        check_count(len(viable), size)
+        randomizer = np.random.choice(viable, size=size, replace=False)
+
+        for part, inputs, outputs in examples(mode, reduction0, reduction1, reduction2, randomizer, training_folder, layers):
+            folder = f"{output_folder_name}/{part}" if part else output_folder_name
+            make_dir_checked(folder)
+            save_dataset(folder, inputs, outputs, compact)
+
+
+# Generator and opened layers of a worker process of ExampleGenerator.blocks()
+_example_worker = None
+
+def _init_example_worker(data, arrays):
+    global _example_worker
+    _example_worker = (unshare(data, arrays), LayerCache())
+
+def _example_block(index):
+    generator, layers = _example_worker
+    return generator.block(index, layers)
+
+class ExampleGenerator:
+    """Samples training examples from parsed layers during training, instead of reading a constructed dataset.
+    Blocks of examples are built by worker processes the same way as by process_training_data,
+    each from new random windows, so every epoch sees fresh examples.
+    Noise and rescaling are applied to blocks of block_size examples instead of the whole dataset.
+    The workers run while the generator is used as a context manager, see start().
+    part: str
+        Which dataset of the networks generating layer_reduction0 is sampled, see dataset_parts().
+    size: int
+        Number of examples in an epoch.
+    workers: int
+        Number of processes building the examples, all processors by default.
+    seed: int
+        Seed of the sampling, block i is always built from the same examples.
+    """
+
+    def __init__(
+        self,
+        mode,
+        reduction0,
+        reduction1,
+        reduction2 = None,
+        part = None,
+        training_folder = "training_data",
+        size = 150000,
+        block_size = 8192,
+        workers = None,
+        seed = None
+        ):
+        self.mode = mode
+        self.reductions = (reduction0, reduction1, reduction2)
+        self.part = part or dataset_parts(mode, reduction0)[0]
+        self.training_folder = training_folder
+        self.size = size
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count()
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+        self.viable = candidates(mode, reduction1, training_folder)
+        # Index of the next block yielded by blocks()
+        self.next_block = 0
+        self.pool = None
+
+        if len(self.viable) == 0:
+            print("ERROR: Not enough training data.")
+            print(f"No viable data for {mode} {reduction1}x.")
+            sys.exit()
+
+    def block(self, index, layers=None):
+        """Returns (inputs, outputs) of block of examples number index as float32 matrices."""
+        # Own generator of the block, the global random state is not changed
+        generator = np.random.RandomState([self.seed, index])
+        # Drawn with replacement, repeated windows are rare and drawing without it would permute all candidates
+        randomizer = self.viable[generator.randint(len(self.viable), size=self.block_size)]
+        reduction0, reduction1, reduction2 = self.reductions
+
+        for _, inputs, outputs in examples(
+                self.mode, reduction0, reduction1, reduction2, randomizer,
+                self.training_folder, layers, parts=(self.part,), generator=generator):
+            return (inputs.astype(np.float32), np.asarray(outputs, dtype=np.float32))
+
+    def start(self):
+        """Starts the worker processes. They are not forked from this process, see processes.process_context(),
+        so it can be called while Tensorflow runs. blocks() can then be iterated on any thread."""
+        if self.pool is None:
+            context = process_context([__name__])
+            # Candidates are shared by all workers
+            data, arrays = share(self, context)
+            self.pool = context.Pool(self.workers, _init_example_worker, (data, arrays))
+
+    def close(self):
+        """Stops the worker processes."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
+
+    def blocks(self):
+        """Yields blocks of examples endlessly. A few blocks ahead are built by the workers at any time.
+        Without started workers, blocks are built one by one in this process."""
+        pending = []
+        while True:
+            if self.pool is None:
+                self.next_block += 1
+                yield self.block(self.next_block - 1)
+                continue
+
+            while len(pending) <= self.workers:
+                pending.append(self.pool.apply_async(_example_block, (self.next_block,)))
+                self.next_block += 1
+
+            yield pending.pop(0).get()
@@ -0,0 +1,81 @@
+import multiprocessing
+import pickle
+import io
+import numpy as np
+
+# Arrays of at least this many bytes are moved into shared memory by share(), smaller ones are pickled
+SHARED_SIZE = 1 << 16
+
+
+def process_context(preload=()):
+    """Returns a multiprocessing context, whose processes are not forked from this process.
+    A process forked while other threads run (the image writer, networks loaded in the background,
+    Tensorflow) can deadlock on locks held by those threads. With forkserver, processes are forked from
+    a server process, which runs no threads. Modules in preload are imported into the server once,
+    so its processes do not import them again. Spawn is used where forkserver is not available.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Only has an effect before the server is started by the first process
+        context.set_forkserver_preload(list(preload))
+        return context
+
+    return multiprocessing.get_context("spawn")
+
+
+class SharedArray:
+    """Copy of an array in shared memory of a multiprocessing context.
+    Processes, which get it in the arguments of their start (such as initargs of a Pool),
+    map the same memory instead of copying the array."""
+
+    def __init__(self, array, context):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.raw = context.RawArray("b", max(array.nbytes, 1))
+        self.array()[...] = array
+
+    def array(self):
+        return np.reshape(np.frombuffer(self.raw, dtype=self.dtype, count=int(np.prod(self.shape))), self.shape)
+
+
+class SharingPickler(pickle.Pickler):
+    # Replaces big arrays by indices of their shared copies in arrays
+    def __init__(self, file, context):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.context = context
+        self.arrays = []
+        self.indices = {}
+
+    def persistent_id(self, item):
+        if type(item) is not np.ndarray or item.nbytes < SHARED_SIZE or item.dtype.hasobject:
+            return None
+
+        if id(item) not in self.indices:
+            self.indices[id(item)] = len(self.arrays)
+            self.arrays.append(SharedArray(item, self.context))
+        return self.indices[id(item)]
+
+
+class SharingUnpickler(pickle.Unpickler):
+    def __init__(self, file, arrays):
+        super().__init__(file)
+        self.arrays = arrays
+
+    def persistent_load(self, index):
+        return self.arrays[index].array()
+
+
+def share(item, context):
+    """Pickles an object with its arrays of at least SHARED_SIZE bytes moved into shared memory.
+    Returns (data, arrays), which are given to processes of the context at their start, see unshare().
+    Every process then reads the same arrays, they are copied only once."""
+    file = io.BytesIO()
+    pickler = SharingPickler(file, context)
+    pickler.dump(item)
+
+    return (file.getvalue(), pickler.arrays)
+
+
+def unshare(data, arrays):
+    """Unpickles an object pickled by share(). Its big arrays are views of the shared memory."""
+    return SharingUnpickler(io.BytesIO(data), arrays).load()
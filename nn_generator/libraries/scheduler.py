@@ -0,0 +1,138 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .processes import process_context
+import time
+
+
+class Task:
+    """Function call in a graph of tasks run by run_tasks().
+    Tasks run by several workers are pickled, so the function and its arguments have to be picklable,
+    for example functions defined at the top level of a module.
+    name: str
+        Unique name of the task.
+    function, arguments, keywords:
+        The task calls function(*arguments, **keywords).
+    dependencies: [str]
+        Names of tasks, that have to finish before this one starts.
+    memory: int
+        Estimated peak memory of the task in bytes.
+    """
+
+    def __init__(self, name, function, arguments=(), keywords=None, dependencies=(), memory=0):
+        self.name = name
+        self.function = function
+        self.arguments = tuple(arguments)
+        self.keywords = keywords or {}
+        self.dependencies = list(dependencies)
+        self.memory = memory
+
+    def run(self):
+        return self.function(*self.arguments, **self.keywords)
+
+
+def check_graph(tasks):
+    """Raises ValueError if names of tasks repeat, a dependency is unknown or the dependencies have a cycle.
+    Returns the tasks in an order, in which every task follows its dependencies. Tasks keep their order otherwise."""
+    names = [task.name for task in tasks]
+    if len(set(names)) != len(names):
+        raise ValueError("Names of tasks are not unique.")
+
+    for task in tasks:
+        for dependency in task.dependencies:
+            if dependency not in names:
+                raise ValueError(f"Task '{task.name}' depends on unknown task '{dependency}'.")
+
+    ordered = []
+    done = set()
+    remaining = list(tasks)
+    while remaining:
+        ready = [task for task in remaining if all(dependency in done for dependency in task.dependencies)]
+        if not ready:
+            raise ValueError(f"Tasks {[task.name for task in remaining]} have cyclic dependencies.")
+
+        # The first ready task, so that a valid order stays unchanged
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+        remaining.remove(ready[0])
+
+    return ordered
+
+
+def chain_lengths(tasks):
+    """Returns {name: number of tasks in the longest chain of tasks starting with it}.
+    Tasks with longer chains are on the critical path and are started first."""
+    dependents = {task.name: [] for task in tasks}
+    for task in tasks:
+        for dependency in task.dependencies:
+            dependents[dependency].append(task.name)
+
+    lengths = {}
+    for task in reversed(check_graph(tasks)):
+        lengths[task.name] = 1 + max((lengths[name] for name in dependents[task.name]), default=0)
+
+    return lengths
+
+
+def run_tasks(tasks, workers=1, memory_budget=None):
+    """Runs a graph of tasks. Returns {name: result}.
+    workers: int
+        With 1, tasks are run one by one in this process, in the given order if it follows the dependencies.
+        Otherwise independent tasks run in parallel on this many processes. Ready tasks are started
+        as soon as a process is free, the ones with the longest chains of dependent tasks first.
+        The processes are not forked from this process, see processes.process_context(), so code
+        of a script calling it has to be guarded by if __name__ == "__main__".
+    memory_budget: int
+        Bytes of memory for all running tasks. A task is started only if memory estimates of running
+        tasks together with its own fit into it. A task bigger than the budget runs alone.
+        No limit if None.
+    If a task fails, no more tasks are started and its error is raised after the running ones finish.
+    """
+    ordered = check_graph(tasks)
+
+    if workers == 1:
+        results = {}
+        for task in ordered:
+            print(f"Task '{task.name}' started.")
+            results[task.name] = task.run()
+        return results
+
+    lengths = chain_lengths(tasks)
+    # Ready tasks are sorted by chain lengths, the sort keeps the given order otherwise
+    waiting = sorted(ordered, key=lambda task: -lengths[task.name])
+    done = set()
+    results = {}
+    running = {}
+    error = None
+    start = time.time()
+
+    def fits(task):
+        if memory_budget is None or not running:
+            return True
+        return sum(running_task.memory for running_task in running.values()) + task.memory <= memory_budget
+
+    context = process_context([__name__])
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        while (waiting and error is None) or running:
+            if error is None:
+                for task in list(waiting):
+                    if len(running) == workers:
+                        break
+                    if all(dependency in done for dependency in task.dependencies) and fits(task):
+                        print(f"Task '{task.name}' started ({time.time() - start:.0f} s).")
+                        running[executor.submit(task.run)] = task
+                        waiting.remove(task)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    results[task.name] = future.result()
+                    done.add(task.name)
+                    print(f"Task '{task.name}' finished ({time.time() - start:.0f} s).")
+                except BaseException as task_error:
+                    print(f"Task '{task.name}' failed.")
+                    error = error or task_error
+
+    if error is not None:
+        raise error
+
+    return results
@@ -0,0 +1,273 @@
+from contextlib import contextmanager
+import threading
+import json
+import time
+import os
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Tracers recording stages of each thread, see tracing()
+_local = threading.local()
+
+# Upper edges of buckets of model latency histograms in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS = [2.0 ** exponent for exponent in range(-4, 13)]
+
+
+def peak_rss():
+    """Returns peak resident memory of this process in bytes since the last reset_peak_rss(), None if unknown."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    # Peak of the whole life of the process, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Resets the peak of resident memory to the current memory, if the system allows it (Linux only).
+    The peak (VmHWM) belongs to the whole process, not to a thread. Stages running at the same time
+    in several threads reset each other's peaks and include memory of each other in them."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class Tracer:
+    """Records stages and model calls of a process.
+    For every stage: wall time, CPU time of the process, peak resident memory and throughput of items
+    (pixels, examples). For every model call: its latency, collected per stage.
+    Stages of other processes are added by merge(). Results are exported by save() as a Chrome trace
+    (chrome://tracing, https://ui.perfetto.dev) together with a text summary.
+    Stages of several threads can be recorded at once, but their peak memory is not separated, see reset_peak_rss().
+    """
+
+    def __init__(self):
+        # Finished stages as dictionaries, see stage()
+        self.stages = []
+        # {stage name: [(seconds, examples)]}
+        self.calls = {}
+        # {thread: stages open in it, the innermost last}
+        self.open = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Tracers of worker processes are sent back without their open stages and lock
+        return {"stages": self.stages, "calls": self.calls}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.stages = state["stages"]
+        self.calls = state["calls"]
+
+    def open_stages(self):
+        with self.lock:
+            return self.open.setdefault(threading.get_ident(), [])
+
+    @contextmanager
+    def stage(self, name, items=0, unit="pixels"):
+        """Records everything run inside the with block as a stage. items is the number of processed items,
+        throughput is items per second. Stages can be nested."""
+        open_stages = self.open_stages()
+        for parent in open_stages:
+            parent["peak_rss"] = max(parent["peak_rss"] or 0, peak_rss() or 0)
+        reset_peak_rss()
+
+        record = {
+            "name": name,
+            "start": time.time(),
+            "items": items,
+            "unit": unit,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "depth": len(open_stages),
+            "peak_rss": None,
+            "skipped": False
+        }
+        open_stages.append(record)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            record["peak_rss"] = max(record["peak_rss"] or 0, peak_rss() or 0) or None
+            record["throughput"] = record["items"] / record["wall"] if record["wall"] > 0 and not record["skipped"] else None
+            open_stages.pop()
+
+            for parent in open_stages:
+                parent["peak_rss"] = max(parent["peak_rss"] or 0, record["peak_rss"] or 0)
+
+            with self.lock:
+                self.stages.append(record)
+
+    def skip(self):
+        """Marks the innermost stage as skipped, its throughput is not computed."""
+        open_stages = self.open_stages()
+        if open_stages:
+            open_stages[-1]["skipped"] = True
+
+    def record_call(self, seconds, examples):
+        """Records latency of a model call of the innermost stage."""
+        open_stages = self.open_stages()
+        name = open_stages[-1]["name"] if open_stages else ""
+        with self.lock:
+            self.calls.setdefault(name, []).append((seconds, examples))
+
+    def merge(self, tracer):
+        """Adds stages and calls recorded by another tracer, for example in a worker process."""
+        with self.lock:
+            self.stages.extend(tracer.stages)
+            for name, calls in tracer.calls.items():
+                self.calls.setdefault(name, []).extend(calls)
+
+    def latencies(self):
+        """Returns {stage name: statistics and histogram of latencies of model calls in milliseconds}."""
+        latencies = {}
+        for name, calls in self.calls.items():
+            milliseconds = np.array([seconds for seconds, _ in calls]) * 1000
+            examples = np.array([count for _, count in calls])
+            counts, _ = np.histogram(milliseconds, [0] + LATENCY_BUCKETS + [np.inf])
+
+            latencies[name] = {
+                "calls": len(calls),
+                "examples": int(np.sum(examples)),
+                "total_ms": float(np.sum(milliseconds)),
+                "mean_ms": float(np.mean(milliseconds)),
+                "p50_ms": float(np.percentile(milliseconds, 50)),
+                "p90_ms": float(np.percentile(milliseconds, 90)),
+                "p99_ms": float(np.percentile(milliseconds, 99)),
+                "max_ms": float(np.max(milliseconds)),
+                "histogram": {
+                    f"<= {edge:g} ms" if edge != np.inf else f"> {LATENCY_BUCKETS[-1]:g} ms": int(count)
+                    for edge, count in zip(LATENCY_BUCKETS + [np.inf], counts)}
+            }
+
+        return latencies
+
+    def summary(self):
+        """Returns a text table of the stages in the order they started and of latencies of model calls."""
+        lines = [f"{'stage':<48} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'items':>10} {'items/s':>11}"]
+        for record in sorted(self.stages, key=lambda record: record["start"]):
+            peak = f"{record['peak_rss'] / 2 ** 20:.1f}" if record["peak_rss"] else "-"
+            throughput = f"{record['throughput']:.0f}" if record["items"] and record["throughput"] else "-"
+            if record["skipped"]:
+                throughput = "skipped"
+            items = f"{record['items']} {record['unit']}" if record["items"] else "-"
+            name = "  " * record["depth"] + record["name"]
+            lines.append(f"{name:<48} {record['wall']:>9.3f} {record['cpu']:>9.3f} {peak:>9} {items:>10} {throughput:>11}")
+
+        latencies = self.latencies()
+        if latencies:
+            lines.append("")
+            lines.append(f"{'model calls of stage':<48} {'calls':>7} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+            for name, latency in latencies.items():
+                lines.append(
+                    f"{name:<48} {latency['calls']:>7} {latency['mean_ms']:>9.3f} {latency['p50_ms']:>9.3f}"
+                    f" {latency['p90_ms']:>9.3f} {latency['p99_ms']:>9.3f} {latency['max_ms']:>9.3f}")
+
+        return "\n".join(lines)
+
+    def save(self, file_name):
+        """Saves the stages as a Chrome trace into a JSON file, together with latencies of model calls.
+        The text summary is printed and saved next to it with the extension .txt."""
+        events = [{
+            "name": record["name"],
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["wall"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["tid"],
+            "args": {key: record[key] for key in ("cpu", "peak_rss", "items", "unit", "throughput", "skipped")}
+        } for record in self.stages]
+
+        folder = os.path.dirname(file_name)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(file_name, "w") as f:
+            json.dump({
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "stages": self.stages,
+                "latencies": self.latencies()
+            }, f, indent=1)
+
+        summary = self.summary()
+        print(summary)
+        with open(os.path.splitext(file_name)[0] + ".txt", "w") as f:
+            f.write(summary + "\n")
+
+
+def active():
+    """Returns the tracer recording stages of this thread, None if tracing is off."""
+    return getattr(_local, "tracer", None)
+
+
+@contextmanager
+def tracing(tracer):
+    """Makes the tracer record stages of this thread inside the with block. Nothing is recorded if it is None.
+    Threads started inside the block are not traced, unless they call tracing() with active() of this thread."""
+    previous = active()
+    _local.tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _local.tracer = previous
+
+
+@contextmanager
+def stage(name, items=0, unit="pixels"):
+    """Records a stage into the active tracer, see Tracer.stage(). Does nothing if tracing is off."""
+    tracer = active()
+    if tracer is None:
+        yield None
+        return
+
+    with tracer.stage(name, items, unit) as record:
+        yield record
+
+
+def skip():
+    """Marks the innermost stage of the active tracer as skipped, see Tracer.skip()."""
+    tracer = active()
+    if tracer is not None:
+        tracer.skip()
+
+
+def record_call(seconds, examples):
+    """Records latency of a model call into the active tracer, see Tracer.record_call()."""
+    tracer = active()
+    if tracer is not None:
+        tracer.record_call(seconds, examples)
+
+
+class TracedCall:
+    """Function call traced as a stage by a new tracer of the process, that runs it.
+    Returns (result, tracer), so stages recorded in worker processes can be merged, see Tracer.merge()."""
+
+    def __init__(self, name, function, items=0, unit="pixels"):
+        self.name = name
+        self.function = function
+        self.items = items
+        self.unit = unit
+
+    def __call__(self, *arguments, **keywords):
+        tracer = Tracer()
+        with tracing(tracer), tracer.stage(self.name, self.items, self.unit):
+            result = self.function(*arguments, **keywords)
+
+        return (result, tracer)
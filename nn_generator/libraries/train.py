@@ -1,18 +1,61 @@
 from tensorflow.keras.layers import Input, Dropout, Dense
 from tensorflow.keras.models import Sequential
+import tensorflow as tf
 from getopt import getopt
+from .basic.compact import load_dataset, open_dataset, dataset_shards
 import numpy as np
 
-def train(model_file, training_folder, output_name, epochs=10):
-    """Trains RNNs based on given structure and given dataset.
-    model_file: str
-        File containing structures for networks to be trained.
-    training_folder: str
-        File containing training dataset.
-    output_name: str
-        Folder where to store trained networks.
-    epochs: int
+# Number of consecutive rows read from a dataset at once while streaming
+BLOCK_ROWS = 1024
+
+def stream_dataset(training_folder, batch_size=32, shuffle_buffer=100000, block_rows=BLOCK_ROWS):
+    """Returns tf.data.Dataset of batches of (inputs, outputs) read from a dataset folder while training.
+    The dataset is only memory-mapped, see open_dataset(), so it does not have to fit into memory.
+    Blocks of consecutive rows are read in random order by parallel calls, their rows are shuffled
+    in a buffer of shuffle_buffer rows and batches are prefetched. Every epoch uses a new order.
     """
+    shards = [open_dataset(shard) for shard in dataset_shards(training_folder)]
+    blocks = np.array([
+        (shard, start)
+        for shard, (inputs, _) in enumerate(shards)
+        for start in range(0, len(inputs), block_rows)])
+
+    def read_block(shard, start):
+        inputs, outputs = shards[shard]
+        return (
+            np.asarray(inputs[start : start + block_rows], dtype=np.float32),
+            np.asarray(outputs[start : start + block_rows], dtype=np.float32))
+
+    inputs, outputs = shards[0]
+    def read(block):
+        x, y = tf.numpy_function(read_block, [block[0], block[1]], (tf.float32, tf.float32))
+        x.set_shape((None,) + tuple(inputs.shape[1:]))
+        y.set_shape((None,) + tuple(outputs.shape[1:]))
+        return (x, y)
+
+    dataset = tf.data.Dataset.from_tensor_slices(blocks)
+    dataset = dataset.shuffle(len(blocks), reshuffle_each_iteration=True)
+    dataset = dataset.map(read, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.unbatch()
+    dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def generated_dataset(examples, batch_size=32):
+    """Returns endless tf.data.Dataset of batches of examples built during training by ExampleGenerator.
+    Examples of a block are sampled in random order already, so they are not shuffled again.
+    Workers of the generator should be started before, see ExampleGenerator.start(), otherwise the blocks
+    are built one by one."""
+    # Only for the shapes, blocks() yields it again
+    inputs, outputs = examples.block(0)
+    dataset = tf.data.Dataset.from_generator(examples.blocks, output_signature=(
+        tf.TensorSpec((None,) + inputs.shape[1:], tf.float32),
+        tf.TensorSpec((None,) + outputs.shape[1:], tf.float32)))
+
+    return dataset.unbatch().batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def build_model(model_file):
+    """Builds and compiles a randomly initialized network from a file specifying its structure."""
 
     def parse_line(line):
         tags = line.split()
@@ -24,31 +67,6 @@ def train(model_file, training_folder, output_name, epochs=10):
             
         return dictionary
 
-    def parse_model(model_file):
-        with open(model_file) as f:
-            layers = []
-            line = f.readline().strip()
-
-            while (line != "COMPILE"):
-                layers.append(parse_line(line))
-                line = f.readline().strip()
-
-            compile_params = parse_line(f.readline().strip())
-    
-        model = Sequential()
-
-        for params in layers:
-            layer = get_layer(params)
-            model.add(layer)
-
-        optimizer = compile_params["optimizer"]
-        loss = compile_params["loss"]
-        model.compile(optimizer=optimizer, loss=loss)
-
-        return model
-
-        
-
     def get_layer(layer_params):
         layer_type = layer_params["type"]
         if (layer_type == "Input"):
@@ -64,21 +82,66 @@ def train(model_file, training_folder, output_name, epochs=10):
             value = float(layer_params["value"])
             return Dropout(value)
 
+    with open(model_file) as f:
+        layers = []
+        line = f.readline().strip()
 
+        while (line != "COMPILE"):
+            layers.append(parse_line(line))
+            line = f.readline().strip()
+
+        compile_params = parse_line(f.readline().strip())
+
+    model = Sequential()
+
+    for params in layers:
+        layer = get_layer(params)
+        model.add(layer)
+
+    optimizer = compile_params["optimizer"]
+    loss = compile_params["loss"]
+    model.compile(optimizer=optimizer, loss=loss)
+
+    return model
+
+def train(model_file, training_folder, output_name, epochs=10, streaming=False, batch_size=32, shuffle_buffer=100000, examples=None):
+    """Trains RNNs based on given structure and given dataset.
+    model_file: str
+        File containing structures for networks to be trained.
+    training_folder: str
+        File containing training dataset.
+    output_name: str
+        Folder where to store trained networks.
+    epochs: int
+    streaming: bool
+        Reads the dataset in batches during training instead of loading it whole, see stream_dataset().
+        Datasets bigger than memory can be trained this way.
+    batch_size: int
+    shuffle_buffer: int
+        Number of examples shuffled together while streaming.
+    examples: ExampleGenerator
+        Trains on examples built during training instead of a dataset, training_folder is not used.
+        An epoch has examples.size examples.
+    """
 
     # Build the model
     #==================
-    model = parse_model(model_file)
+    model = build_model(model_file)
     model.summary()
 
 
-    # Load training data
-    #========================
-    inputs = np.load(f"{training_folder}/inputs.npy")
-    outputs = np.load(f"{training_folder}/outputs.npy")
-
-
     # Train the model
     #====================
-    model.fit(inputs, outputs, epochs=epochs)
+    if (examples is not None):
+        # Workers are started here, not on the thread of tf.data, which iterates the examples
+        with examples:
+            dataset = generated_dataset(examples, batch_size)
+            model.fit(dataset, epochs=epochs, steps_per_epoch=max(1, examples.size // batch_size))
+    elif (streaming):
+        model.fit(stream_dataset(training_folder, batch_size, shuffle_buffer), epochs=epochs)
+    else:
+        # Compact or .npy files, see basic/compact.py
+        inputs, outputs = load_dataset(training_folder)
+        model.fit(inputs, outputs, epochs=epochs, batch_size=batch_size)
+
     model.save(f"{output_name}.h5")
\ No newline at end of file
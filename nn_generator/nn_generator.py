@@ -1,11 +1,16 @@
 """This file contains main functions for learning and generation using pixel RNNs."""
 
 from cv2 import data
-from .libraries.parse import parse_image
-from .libraries.process_training_data import process_training_data
-from .libraries.normalize_heights import normalize_heights
+from .libraries.parse import parse_image, parse_heights
+from .libraries.process_training_data import process_training_data, dataset_folder, ExampleGenerator
+from .libraries.scheduler import Task, run_tasks
+from .libraries.cache import CachedStage
+from .libraries.tracing import Tracer, TracedCall, tracing, stage
+from .libraries.basic.pgm import read_pgm_header
+from .libraries.basic.parsing import LayerCache
 from .libraries.train import train
-from .libraries.generate import generate_map
+from .libraries.generate import generate_map, generate_many as generate_maps
+from .libraries.model_registry import registry
 import os
 from typing import List
 
@@ -13,7 +18,8 @@ def parse(
     mode,
     image,
     reductions = [1, 4, 16, 64],
-    output_folder = "training_data"
+    output_folder = "training_data",
+    sample_first = False
     ):
     """This function parses an image into layers specified by reductions.
     mode: str
@@ -24,19 +30,36 @@ def parse(
         Specifies the layers.
     output_folder: str
         Creates saves output layers into this folder. Path is created if it doesn't exist.
+    sample_first: bool
+        Stores only block means of the image instead of the layers.
+        Windows are extracted later only for the positions sampled into training datasets.
+        This saves most of the disk space and parsing time for large images.
     """
 
     print(f"Parsing {mode} . . .")
 
-    folder = f"{output_folder}/{mode}_layers"
+    for _, function, arguments, keywords in parse_steps(mode, image, reductions, output_folder, sample_first):
+        function(*arguments, **keywords)
 
-    parse_image(image, folder, reductions=reductions)
+def parse_steps(
+    mode,
+    image,
+    reductions = [1, 4, 16, 64],
+    output_folder = "training_data",
+    sample_first = False
+    ):
+    """Returns steps of parse() in their order as a list of (name, function, arguments, keywords).
+    Every step writes into output_folder/{mode}_layers."""
+    folder = f"{output_folder}/{mode}_layers"
 
+    # Heights are parsed, normalized and differentiated in a single pass
     if (mode == "heights"):
-        normalize_heights(output_folder, reductions)
-        parse_image(image, folder, reductions=reductions, compute_differences=True)
-    else:
-        parse_image(image, folder, reductions=[reductions[0]], blur=True)
+        return [("parse heights", parse_heights, (image, folder), {"reductions": reductions, "sample_first": sample_first})]
+
+    return [
+        (f"parse {mode}", parse_image, (image, folder), {"reductions": reductions, "sample_first": sample_first}),
+        (f"parse {mode} blurry", parse_image, (image, folder), {"reductions": [reductions[0]], "blur": True, "sample_first": sample_first})
+    ]
 
 def construct_training_datasets(
     mode,
@@ -45,7 +68,8 @@ def construct_training_datasets(
     reduction2 = 16,
     reduction3 = 64,
     size = 150000,
-    folder = "training_data"
+    folder = "training_data",
+    compact = True
     ):
     """After parsing images, constructs training datasets from the folder containing parsed images into layers.
     mode : str
@@ -56,6 +80,9 @@ def construct_training_datasets(
         Number of training examples in constructed datasets.
     folder : str
         Folder containing parsed images. Results will be also saved into this folder.
+    compact : bool
+        Saves datasets in a compact form, about 15 times smaller than inputs.npy and outputs.npy.
+        Fractional values of the encodings are quantized to 8 bits.
     """
     print(f"Constructing {mode} datasets . . .")
 
@@ -63,10 +90,68 @@ def construct_training_datasets(
         print(f"{folder} does not exist. Did you parse the data?")
         return
 
+    # Every layer is opened once for all variants
+    layers = LayerCache()
+
     # Do 3 variants
-    process_training_data(mode, reduction0=reduction2, reduction1=reduction3, reduction2=None, size=size, training_folder=folder)
-    process_training_data(mode, reduction0=reduction1, reduction1=reduction2, reduction2=reduction3, size=size, training_folder=folder)
-    process_training_data(mode, reduction0=reduction0, reduction1=reduction1, reduction2=reduction2, size=size, training_folder=folder)
+    for variant0, variant1, variant2 in dataset_variants(reduction0, reduction1, reduction2, reduction3):
+        process_training_data(mode, reduction0=variant0, reduction1=variant1, reduction2=variant2, size=size, training_folder=folder, layers=layers, compact=compact)
+
+def dataset_variants(reduction0 = 1, reduction1 = 4, reduction2 = 16, reduction3 = 64):
+    """Returns (reduction0, reduction1, reduction2) of the 3 datasets constructed for every mode, see process_training_data."""
+    return [
+        (reduction2, reduction3, None),
+        (reduction1, reduction2, reduction3),
+        (reduction0, reduction1, reduction2)
+    ]
+
+def networks(
+    mode,
+    structures_folder,
+    output_folder,
+    reduction0 = 1,
+    reduction1 = 4,
+    reduction2 = 16,
+    reduction3 = 64,
+    size = 150000,
+    data_folder = "training_data"
+    ):
+    """Returns networks of a mode in the order of their epochs in train_networks as a list of
+    (structure file, dataset folder, network file, (reduction0, reduction1, reduction2, dataset part)).
+    Reductions and the part specify the dataset, see process_training_data.
+    """
+    def structure(num):
+        return f"{structures_folder}/{mode}{num}.txt"
+
+    def data(variant0, variant1, variant2, part=None):
+        folder = dataset_folder(data_folder, mode, variant0, variant1, variant2, size)
+        return f"{folder}/{part}" if part else folder
+
+    specs = [
+        (structure(2), data(reduction2, reduction3, None), f"{output_folder}/{mode}_{reduction3}-{reduction2}",
+            (reduction2, reduction3, None, None)),
+        (structure(1), data(reduction1, reduction2, reduction3), f"{output_folder}/{mode}_{reduction3}-{reduction2}-{reduction1}",
+            (reduction1, reduction2, reduction3, None))
+    ]
+
+    if (mode == "heights"):
+        specs.append((structure(0), data(reduction0, reduction1, reduction2), f"{output_folder}/heights_{reduction2}-{reduction1}-{reduction0}",
+            (reduction0, reduction1, reduction2, None)))
+    else:
+        specs.append((structure("0_blurry"), data(reduction0, reduction1, reduction2, "blurry"), f"{output_folder}/{mode}_{reduction2}-{reduction1}-blurry",
+            (reduction0, reduction1, reduction2, "blurry")))
+        specs.append((structure("0_sharp"), data(reduction0, reduction1, reduction2, "sharp"), f"{output_folder}/{mode}_blurry-sharp",
+            (reduction0, reduction1, reduction2, "sharp")))
+
+    return specs
+
+def train_network(mode, structure, data, network, epochs, variant, data_folder, size, streaming = False, generate_examples = False):
+    """Trains a single network returned by networks(), see train_networks."""
+    examples = None
+    if generate_examples:
+        examples = ExampleGenerator(mode, *variant, training_folder=data_folder, size=size)
+
+    train(structure, data, network, epochs=epochs, streaming=streaming, examples=examples)
 
 def train_networks(
     mode,
@@ -78,7 +163,9 @@ def train_networks(
     reduction3 = 64,
     size = 150000,
     epochs = (1, 1, 1, 1),
-    data_folder = "training_data"
+    data_folder = "training_data",
+    streaming = False,
+    generate_examples = False
     ):
     """Trains networks based on given parameters.
     mode: str
@@ -99,6 +186,12 @@ def train_networks(
         For the rest 4 is needed, due to the blurry and sharp layer.
     data_folder: str
         Folder containing training data.
+    streaming: bool
+        Reads the datasets in batches during training instead of loading them into memory.
+        Needed for datasets bigger than memory. A dataset can be split into subfolders shard_*.
+    generate_examples: bool
+        Builds new training examples from the parsed layers in data_folder during training instead
+        of reading constructed datasets. 'size' is then the number of examples in an epoch.
     """
     print(f"Training {mode} . . .")
     if mode != "heights" and len(epochs) < 4:
@@ -111,41 +204,16 @@ def train_networks(
         print(f"See help(nn_generator.train_networks)")
         return
 
-    def structure(num):
-        return f"{structures_folder}/{mode}{num}.txt"
-    
-    def check_data(data):
-        if not os.path.exists(data):
-            print(f"{data} does not exist.")
-            return False
-        
-        return True
-
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    data2 = f"{data_folder}/{mode}_{reduction3}-{reduction2}_{size}"
-    data1 = f"{data_folder}/{mode}_{reduction3}-{reduction2}-{reduction1}_{size}"
-
-    if not check_data(data2) or not check_data(data1):
-        return
-
-    train(structure(2), data2, f"{output_folder}/{mode}_{reduction3}-{reduction2}", epochs=epochs[0])
-    train(structure(1), data1, f"{output_folder}/{mode}_{reduction3}-{reduction2}-{reduction1}", epochs=epochs[1])
-
-    if (mode == "heights"):
-        data0 = f"{data_folder}/heights_{reduction2}-{reduction1}-{reduction0}_{size}"
-        if not check_data(data0): return
-        train(structure(0), data0, f"{output_folder}/heights_{reduction2}-{reduction1}-{reduction0}", epochs=epochs[2])
-    else:
-        data_blurry = f"{data_folder}/{mode}_{reduction2}-{reduction1}-{reduction0}_{size}/blurry"
-        data_focus = f"{data_folder}/{mode}_{reduction2}-{reduction1}-{reduction0}_{size}/sharp"
-
-        if not check_data(data_blurry) or not check_data(data_focus):
+    specs = networks(mode, structures_folder, output_folder, reduction0, reduction1, reduction2, reduction3, size, data_folder)
+    for (structure, data, network, variant), network_epochs in zip(specs, epochs):
+        if not generate_examples and not os.path.exists(data):
+            print(f"{data} does not exist.")
             return
 
-        train(structure("0_blurry"), data_blurry, f"{output_folder}/{mode}_{reduction2}-{reduction1}-blurry", epochs=epochs[2])
-        train(structure("0_sharp"), data_focus, f"{output_folder}/{mode}_blurry-sharp", epochs=epochs[3])
+        train_network(mode, structure, data, network, network_epochs, variant, data_folder, size, streaming, generate_examples)
 
 def learn(
     training_data,
@@ -158,7 +226,13 @@ def learn(
         "buildings" : (6, 6, 6, 6)
     },
     network_structures = "nn_generator/examples/model_structures",
-    network_folder = "models"
+    network_folder = "models",
+    sample_first = False,
+    generate_examples = False,
+    workers = 1,
+    memory_budget = None,
+    cache = True,
+    trace_file = None
     ):
     """Parses the images, constructs datasets and creates and trains neural networks for heights, roads, rivers and buildings.
     After executing this function, the networks are ready to generate images.
@@ -181,65 +255,136 @@ def learn(
     network_folder: str
         Folder, where networks will be saved.
         The path is created if it does not exist.
+    sample_first: bool
+        Parse images without storing all the layers, see help(nn_generator.parse).
+    generate_examples: bool
+        Trains on examples built from the parsed layers during training, no datasets are constructed.
+        dataset_sizes are then numbers of examples in an epoch, see help(nn_generator.train_networks).
+    workers: int
+        Number of processes running parsing, dataset construction and training in parallel.
+        Every step starts as soon as the steps it needs are finished, for example training
+        of a network right after its dataset is constructed. 1 runs everything in order in this process.
+        With more, code of a script calling it has to be guarded by if __name__ == "__main__".
+    memory_budget: float
+        Gigabytes of memory for steps running in parallel. Steps are started only if estimates of their
+        memory fit into it together. No limit if None.
+    cache: bool
+        Skips steps, whose input files, parameters and code did not change since their last run,
+        and reuses their results from training_folder and network_folder.
+        Manifests of the steps are saved into training_folder/manifests.
+    trace_file: str
+        Records wall time, CPU time, peak memory and throughput of every step and saves them as a Chrome trace
+        into this JSON file, together with a text summary, see tracing.Tracer.save(). Not recorded if None.
     """
 
-    heights_image = f"{training_data}/heights.pgm"
-    roads_image = f"{training_data}/roads.pgm"
-    rivers_image = f"{training_data}/rivers.pgm"
-    buildings_image = f"{training_data}/buildings.pgm"
-    
-    print()
-    print("PARSING IMAGES")
-    print("===================")
-    parse("heights", heights_image, output_folder=training_folder)
-    parse("roads", roads_image, output_folder=training_folder)
-    parse("rivers", rivers_image, output_folder=training_folder)
-    parse("buildings", buildings_image, output_folder=training_folder)
-
-    print()
-    print("CONSTRUCTING TRAINING DATA")
-    print("==============================")
-    construct_training_datasets("heights", folder=training_folder, size=dataset_sizes["heights"])
-    construct_training_datasets("roads", folder=training_folder, size=dataset_sizes["roads"])
-    construct_training_datasets("rivers", folder=training_folder, size=dataset_sizes["rivers"])
-    construct_training_datasets("buildings", folder=training_folder, size=dataset_sizes["buildings"])
-
-    print()
-    print("TRAINING THE NETWORKS")
-    print("=========================")
-    train_networks(
-        "heights",
-        structures_folder=network_structures,
-        output_folder=network_folder,
-        size=dataset_sizes["heights"],
-        epochs=epochs["heights"])
-    
-    train_networks(
-        "roads",
-        structures_folder=network_structures,
-        output_folder=network_folder,
-        size=dataset_sizes["roads"],
-        epochs=epochs["roads"])
-    
-    train_networks(
-        "rivers",
-        structures_folder=network_structures,
-        output_folder=network_folder,
-        size=dataset_sizes["rivers"],
-        epochs=epochs["rivers"])
-    
-    train_networks(
-        "buildings",
-        structures_folder=network_structures,
-        output_folder=network_folder,
-        size=dataset_sizes["buildings"],
-        epochs=epochs["buildings"])
+    modes = ["heights", "roads", "rivers", "buildings"]
+    # Parsed images needed by datasets of each mode
+    parsed = {
+        "heights": ["heights"],
+        "roads": ["heights", "roads"],
+        "rivers": ["heights", "rivers"],
+        "buildings": modes
+    }
+    # Widest inputs of datasets of each mode
+    columns = {"heights": 600, "roads": 1776, "rivers": 1776, "buildings": 2400}
+
+    for mode in modes:
+        needed = 3 if mode == "heights" else 4
+        if len(epochs[mode]) < needed:
+            print(f"At least {needed} numbers needed in 'epochs' argument for {mode}.")
+            print(f"See help(nn_generator.learn)")
+            return
+
+    def image_pixels(image):
+        if not os.path.exists(image):
+            return 0
+        _, (rows, cols), _, _ = read_pgm_header(image)
+        return rows * cols
+
+    def image_memory(image):
+        # The image, its rescaled copy, differences and block means in float64
+        return image_pixels(image) * 8 * 8
+
+    def dataset_memory(mode):
+        # Inputs with their unary encodings in float64
+        return dataset_sizes[mode] * columns[mode] * 8 * 4
+
+    manifests = f"{training_folder}/manifests"
+
+    tasks = []
+    def add_task(name, function, arguments, keywords, dependencies, memory, inputs=(), outputs=(), code=(), items=0, unit="pixels"):
+        if cache:
+            function = CachedStage(manifests, name, function, inputs, outputs, code, dependencies)
+        if trace_file:
+            # Traced in the process running the step, stages it records are merged below
+            function = TracedCall(name, function, items, unit)
+        tasks.append(Task(name, function, arguments, keywords, dependencies, memory))
+
+    # Name of the last step parsing each image
+    parsed_steps = {}
+    for mode in modes:
+        image = f"{training_data}/{mode}.pgm"
+        dependencies = []
+        for name, function, arguments, keywords in parse_steps(mode, image, output_folder=training_folder, sample_first=sample_first):
+            add_task(name, function, arguments, keywords, dependencies, image_memory(image),
+                inputs=[image], outputs=[f"{training_folder}/{mode}_layers"], items=image_pixels(image))
+            dependencies = [name]
+        parsed_steps[mode] = name
+
+    if not generate_examples:
+        for mode in modes:
+            for variant in dataset_variants():
+                folder = dataset_folder(training_folder, mode, *variant, dataset_sizes[mode])
+                add_task(
+                    f"dataset {os.path.basename(folder)}",
+                    process_training_data, (mode,) + variant,
+                    {"training_folder": training_folder, "size": dataset_sizes[mode]},
+                    [parsed_steps[parsed_mode] for parsed_mode in parsed[mode]],
+                    dataset_memory(mode),
+                    outputs=[folder], items=dataset_sizes[mode], unit="examples")
+
+    if not os.path.exists(network_folder):
+        os.makedirs(network_folder)
+
+    for mode in modes:
+        specs = networks(mode, network_structures, network_folder, size=dataset_sizes[mode], data_folder=training_folder)
+        for (structure, data, network, variant), network_epochs in zip(specs, epochs[mode]):
+            if generate_examples:
+                dependencies = [parsed_steps[parsed_mode] for parsed_mode in parsed[mode]]
+            else:
+                folder = dataset_folder(training_folder, mode, *variant[:3], dataset_sizes[mode])
+                dependencies = [f"dataset {os.path.basename(folder)}"]
+
+            add_task(
+                f"train {os.path.basename(network)}", train_network,
+                (mode, structure, data, network, network_epochs, variant, training_folder, dataset_sizes[mode]),
+                {"generate_examples": generate_examples},
+                dependencies,
+                dataset_memory(mode) // 4,
+                inputs=[structure], outputs=[f"{network}.h5"], code=[train, ExampleGenerator],
+                items=dataset_sizes[mode] * network_epochs, unit="examples")
+
+    results = run_tasks(tasks, workers, None if memory_budget is None else memory_budget * 2 ** 30)
+
+    if trace_file:
+        tracer = Tracer()
+        for _, step_tracer in results.values():
+            tracer.merge(step_tracer)
+        tracer.save(trace_file)
 
 def generate(
     generation_data,
     output_folder,
     config_file = "nn_generator/examples/generation_config.txt",
-    random_modifier = 5
+    random_modifier = 5,
+    block_rows = None,
+    backend = "tensorflow",
+    tile_size = None,
+    workers = None,
+    seed = None,
+    save_stages = True,
+    trace_file = None,
+    row_independent = False
     ):
     """Uses neural networks to generate images.
     generation_data: str
@@ -251,6 +396,32 @@ def generate(
         Name of a text file containing locations of neural networks used for the generation.
     random_modifier: float
         SMALLER the number, BIGGER the randomness applied to the process. '0' turns the randomness off.
+    block_rows: int
+        Inputs of the networks are prepared for this many rows of an image at once.
+        Lower it, if the generation of big images does not fit into memory. By default the inputs
+        of as many rows as fit into 256 MB are prepared at once.
+    backend: str
+        "tensorflow" evaluates the networks as Keras models.
+        "numpy" evaluates them with plain NumPy, which is much faster for the small networks used here.
+        Its outputs differ from Tensorflow by float32 rounding (about 1e-6), so the images differ slightly.
+        "prefix" is the same, but skips the encoding of the inputs of the first layers.
+    tile_size: int
+        Generates images by tiles of this size on multiple processes. The images are the same as without tiles
+        with row_independent. Code of a script calling it has to be guarded by if __name__ == "__main__".
+    workers: int
+        Number of processes used with tiles, all processors by default.
+    seed: int
+        Seed of the noise, the same seed gives the same images, with or without tiles.
+    save_stages: bool
+        Saves images of the input and of all intermediate layers. Otherwise only the final images are saved,
+        which is faster for big images.
+    trace_file: str
+        Records wall time, CPU time, peak memory and throughput of every stage together with latencies
+        of the network calls and saves them as a Chrome trace into this JSON file, with a text summary,
+        see tracing.Tracer.save(). Not recorded if None.
+    row_independent: bool
+        Evaluates the NumPy networks more slowly, but so that the images are exactly the same as with tiles
+        or with generate_many(). Otherwise they may differ slightly.
 
     returns dictionary of created images:
     {
@@ -267,4 +438,69 @@ def generate(
         for line in f:
             print(line)
 
-    return generate_map(generation_data, output_folder, config_file, random_modifier)
\ No newline at end of file
+    if not trace_file:
+        return generate_map(generation_data, output_folder, config_file, random_modifier, block_rows, backend, tile_size, workers, seed, save_stages=save_stages, row_independent=row_independent)
+
+    tracer = Tracer()
+    with tracing(tracer), stage("generate"):
+        generated = generate_map(generation_data, output_folder, config_file, random_modifier, block_rows, backend, tile_size, workers, seed, save_stages=save_stages, row_independent=row_independent)
+    tracer.save(trace_file)
+
+    return generated
+
+def generate_many(
+    input_folders,
+    output_root,
+    config_file = "nn_generator/examples/generation_config.txt",
+    random_modifier = 5,
+    backend = "numpy",
+    seeds = None,
+    save_stages = True,
+    max_batch = 8
+    ):
+    """Uses neural networks to generate images for several inputs in one call.
+    Groups of max_batch maps are generated in parallel threads and inputs of the same network
+    from all maps of a group are evaluated together.
+    With the NumPy backends, every map is the same as generated by generate() with the same seed,
+    backend and row_independent. It is not faster than calling generate() for each map, most of
+    the time is spent preparing the inputs of the networks, not calling them.
+    With "tensorflow", it saves the overhead of calls of Keras models and is faster than calling
+    generate() for each map, but the maps differ slightly from the ones generate() would create.
+    input_folders: [str]
+        Names of folders containing user input for generation of all images.
+    output_root: str
+        Images generated from each input folder are stored in a folder of the same name in it.
+    config_file: str
+        Name of a text file containing locations of neural networks used for the generation.
+    random_modifier: float
+        SMALLER the number, BIGGER the randomness applied to the process. '0' turns the randomness off.
+    backend: str
+        The same as in generate(), "numpy" by default.
+    seeds: [int]
+        Seeds of the noise of each map.
+    save_stages: bool
+        The same as in generate().
+    max_batch: int
+        Number of maps generated together. Maps of a group wait for each other.
+
+    returns dictionary {input folder: dictionary of created images, see generate()}
+    """
+    return generate_maps(input_folders, output_root, config_file, random_modifier, backend, seeds, save_stages, max_batch)
+
+def load_models(
+    config_file = "nn_generator/examples/generation_config.txt",
+    backend = "tensorflow"
+    ):
+    """Starts loading networks of a config file in the background.
+    Loaded networks stay in memory, so following calls of generate() do not load them again.
+    Networks of several config files can be kept loaded and used alternately.
+    config_file: str
+        Name of a text file containing locations of neural networks used for the generation.
+    backend: str
+        The same as in generate().
+    """
+    registry.model_set(config_file, backend).preload()
+
+def unload_models():
+    """Forgets all networks loaded for generate()."""
+    registry.clear()
\ No newline at end of file
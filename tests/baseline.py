@@ -0,0 +1,311 @@
+"""Implementations of the first version of the library, kept unchanged as a reference for the tests.
+Results of the rewritten stages are compared with them. Layers are returned instead of saved,
+and datasets are built from given layers instead of layer files.
+"""
+
+from nn_generator.libraries.basic.matrix_manipulation import rescale, rescale2, cutout, scale_down
+from nn_generator.libraries.basic.utilities import unary_log_encoding_array, noisify_exp, relativization, unary_linear_encoding, unary_log_encoding_array_reversed
+import numpy as np
+import cv2
+
+
+def read_image(image_name):
+    image = cv2.imread(image_name, cv2.IMREAD_GRAYSCALE)
+    return rescale(image)
+
+
+def derivatives(matrix):
+    rows = matrix.shape[0]
+    cols = matrix.shape[1]
+    r_ders = np.zeros((rows, cols))
+    c_ders = np.zeros((rows, cols))
+
+    for r in range(rows - 1):
+        for c in range(cols):
+            r_ders[r, c] = matrix[r + 1, c] - matrix[r, c]
+
+    for r in range(rows):
+        for c in range(cols - 1):
+            c_ders[r, c] = matrix[r, c + 1] - matrix[r, c]
+
+    return (r_ders, c_ders)
+
+
+def get_window(image, row, col, reduction, cut):
+    window_size = cut * reduction
+    window = cutout(image,
+    row - 2 - window_size // 2,
+    col - window_size // 2,
+    window_size, window_size)
+    window = scale_down(window, reduction)
+
+    return window
+
+
+def parse(image, cut, reduction):
+    """Returns the layer, which parse() saved."""
+    rows = image.shape[0]
+    cols = image.shape[1]
+
+    half_width = 160
+    row_start = half_width + 2
+    row_end = rows - half_width
+    row_range = row_end - row_start
+    col_start = half_width
+    col_end = cols - half_width
+    col_range = col_end - col_start
+
+    tokens = [None] * (row_range * col_range)
+    for i in range(len(tokens)):
+        row = row_start + i // col_range
+        col = col_start + i % col_range
+        tokens[i] = get_window(image, row, col, reduction, cut).flatten()
+
+    return np.asarray(tokens)
+
+
+def normalize(layer):
+    return (layer - np.mean(layer)) / np.std(layer)
+
+
+def process_training_data(mode, reduction0, reduction1, reduction2, layer, size):
+    """Returns {part: (inputs, outputs)} of the datasets, which process_training_data() saved.
+    layer(name) returns the layer of a file name relative to the training folder, for example heights_layers/layer_1x.npy.
+    """
+    encoding = 8
+    datasets = {}
+
+    def heights_file(reduction):
+        return f"heights_layers/normalized_layer_{reduction}x.npy"
+
+    def heights_diff_file(reduction):
+        rows = f"heights_layers/differences_rows_layer_{reduction}x.npy"
+        columns = f"heights_layers/differences_columns_layer_{reduction}x.npy"
+
+        return (rows, columns)
+
+    def mode_file(mode, reduction):
+        return f"{mode}_layers/layer_{reduction}x.npy"
+
+    def mode_blurred_file(mode, reduction):
+        return f"{mode}_layers/layer_blurry_{reduction}x.npy"
+
+    if mode == "heights":
+        layer0 = layer(heights_file(reduction0))
+        count = layer0.shape[0]
+        randomizer = np.random.choice(count, size=size, replace=False)
+        func = lambda t : unary_log_encoding_array_reversed(t, encoding)
+        noisify = lambda t : noisify_exp(t, 20)
+
+        def context_func(arr):
+            absolute = relativization(arr)
+            a = unary_log_encoding_array_reversed(arr, encoding)
+            b = unary_linear_encoding(absolute, encoding)
+            return np.concatenate(( a, b ))
+
+        absolutes = []
+
+        def recurrent_func(arr):
+            absolute = relativization(arr)
+            absolutes.append(absolute)
+            a = unary_log_encoding_array_reversed(arr, encoding)
+            b = unary_linear_encoding(absolute, encoding)
+            return np.concatenate(( a, b ))
+
+        layer0 = layer0[randomizer]
+        layer0 = np.apply_along_axis(noisify, 1, layer0)
+        layer0 = rescale(layer0)
+        outputs = layer0[:, -3]
+        recurrents = layer0[:, :-3]
+        recurrents = np.apply_along_axis(recurrent_func, 1, recurrents)
+        outputs -= np.asarray(absolutes)
+        outputs = np.reshape(outputs, (size, 1))
+        outputs = np.apply_along_axis(func, 1, outputs)
+
+        layer1 = layer(heights_file(reduction1))
+        layer1 = layer1[randomizer]
+        layer1 = np.apply_along_axis(noisify, 1, layer1)
+        layer1 = rescale(layer1)
+        layer1 = np.apply_along_axis(context_func, 1, layer1)
+
+        inputs = np.concatenate((layer1, recurrents), axis=1)
+
+        if (reduction2 != None):
+            layer2 = layer(heights_file(reduction2))
+            layer2 = layer2[randomizer]
+            layer2 = np.apply_along_axis(noisify, 1, layer2)
+            layer2 = rescale(layer2)
+            layer2 = np.apply_along_axis(context_func, 1, layer2)
+
+            inputs = np.concatenate((layer2, inputs), axis=1)
+
+        datasets[""] = (inputs, outputs)
+
+    if mode == "roads" or mode == "rivers":
+        paths1 = layer(mode_file(mode, reduction1))
+        nonzero_indices = np.argwhere(np.any(paths1 != 0, axis=1)).flatten()
+        randomizer = np.random.choice(nonzero_indices, size=size, replace=False)
+
+        paths1 = paths1[randomizer]
+        func = lambda t: unary_log_encoding_array(t, encoding)
+        paths1 = np.apply_along_axis(func, 1, paths1)
+
+        file0 = mode_file(mode, reduction0) if reduction0 != 1 else mode_blurred_file(mode, reduction0)
+        paths0 = layer(file0)[randomizer]
+        outputs = paths0[:, -3]
+        recurrents = paths0[:, :-3]
+
+        outputs = np.reshape(outputs, (len(outputs), 1))
+        outputs = np.apply_along_axis(func, 1, outputs)
+        recurrents = np.apply_along_axis(func, 1, recurrents)
+
+        def diff_func(arr):
+            arr = rescale2(arr)
+            arr = unary_log_encoding_array(arr, 8)
+            return arr
+
+        row_file, col_file = heights_diff_file(reduction0)
+        height0_diff_rows = layer(row_file)
+        height0_diff_rows = height0_diff_rows[randomizer]
+        height0_diff_cols = layer(col_file)[randomizer]
+        height0_diff_rows = np.apply_along_axis(diff_func, 1, height0_diff_rows)
+        height0_diff_cols = np.apply_along_axis(diff_func, 1, height0_diff_cols)
+
+        row_file, col_file = heights_diff_file(reduction1)
+        height1_diff_rows = layer(row_file)[randomizer]
+        height1_diff_cols = layer(col_file)[randomizer]
+        height1_diff_rows = np.apply_along_axis(diff_func, 1, height1_diff_rows)
+        height1_diff_cols = np.apply_along_axis(diff_func, 1, height1_diff_cols)
+
+        inputs = np.concatenate((
+            height1_diff_rows,
+            height1_diff_cols,
+            paths1,
+            height0_diff_rows,
+            height0_diff_cols,
+            recurrents),
+            axis=1
+        )
+
+        if (reduction2 != None):
+            paths2 = layer(mode_file(mode, reduction2))[randomizer]
+            paths2 = np.apply_along_axis(func, 1, paths2)
+            row_file, col_file = heights_diff_file(reduction2)
+            height2_diff_rows = layer(row_file)[randomizer]
+            height2_diff_cols = layer(col_file)[randomizer]
+            height2_diff_rows = np.apply_along_axis(diff_func, 1, height2_diff_rows)
+            height2_diff_cols = np.apply_along_axis(diff_func, 1, height2_diff_cols)
+
+            inputs = np.concatenate((height2_diff_rows, height2_diff_cols, paths2, inputs), axis=1)
+
+        datasets["blurry" if reduction0 == 1 else ""] = (inputs, outputs)
+
+        if (reduction0 == 1):
+            blurry = layer(mode_blurred_file(mode, reduction0))[randomizer]
+            blurry = noisify_exp(blurry, 20)
+            blurry = np.apply_along_axis(func, 1, blurry)
+
+            sharp = layer(mode_file(mode, reduction0))[randomizer]
+            outputs = sharp[:, -3]
+            recurrents = sharp[:, :-3]
+
+            inputs = np.concatenate((blurry, recurrents), axis=1)
+            datasets["sharp"] = (inputs, outputs)
+
+    if mode == "buildings":
+        buildings1 = layer(mode_file("buildings", reduction1))
+        nonzero_indices = np.argwhere(np.any(buildings1 != 0, axis=1)).flatten()
+        randomizer = np.random.choice(nonzero_indices, size=size, replace=False)
+
+        buildings1 = buildings1[randomizer]
+        func = lambda t: unary_log_encoding_array(t, encoding)
+        noisify = lambda t: noisify_exp(t, 20)
+        buildings1 = np.apply_along_axis(func, 1, buildings1)
+
+        buildings0 = layer(mode_file("buildings", reduction0))[randomizer]
+        outputs = buildings0[:, -3]
+        recurrents = buildings0[:, :-3]
+
+        roads0 = layer(mode_file("roads", reduction0))[randomizer]
+        roads1 = layer(mode_file("roads", reduction1))[randomizer]
+        roads1 = np.apply_along_axis(func, 1, roads1)
+
+        rivers0 = layer(mode_file("rivers", reduction0))[randomizer]
+        rivers1 = layer(mode_file("rivers", reduction1))[randomizer]
+        rivers1 = np.apply_along_axis(func, 1, rivers1)
+
+        heights0 = layer(heights_file(reduction0))[randomizer]
+        heights1 = layer(heights_file(reduction1))[randomizer]
+
+        def context_func_b(arr):
+            absolute = relativization(arr)
+            a = unary_log_encoding_array(arr, encoding)
+            b = unary_linear_encoding(absolute, encoding)
+            return np.concatenate(( a, b ))
+
+        heights0 = np.apply_along_axis(noisify, 1, heights0)
+        heights0 = rescale(heights0)
+        heights0 = np.apply_along_axis(context_func_b, 1, heights0)
+
+        heights1 = np.apply_along_axis(noisify, 1, heights1)
+        heights1 = rescale(heights1)
+        heights1 = np.apply_along_axis(context_func_b, 1, heights1)
+
+        roads0 = np.apply_along_axis(func, 1, roads0)
+        rivers0 = np.apply_along_axis(func, 1, rivers0)
+        buildings0 = np.apply_along_axis(func, 1, buildings0)
+        recurrents = np.apply_along_axis(func, 1, recurrents)
+
+        outputs = np.reshape(outputs, (len(outputs), 1))
+        outputs = np.apply_along_axis(func, 1, outputs)
+
+        inputs = np.concatenate((
+            heights1,
+            rivers1,
+            roads1,
+            buildings1,
+            heights0,
+            rivers0,
+            roads0,
+            recurrents),
+            axis=1
+        )
+
+        if reduction2 != None:
+            heights2 = layer(heights_file(reduction2))[randomizer]
+            heights2 = rescale(heights2)
+            rivers2 = layer(mode_file("rivers", reduction2))[randomizer]
+            rivers2 = np.apply_along_axis(func, 1, rivers2)
+            roads2 = layer(mode_file("roads", reduction2))[randomizer]
+            roads2 = np.apply_along_axis(func, 1, roads2)
+            buildings2 = layer(mode_file("buildings", reduction2))[randomizer]
+            buildings2 = np.apply_along_axis(func, 1, buildings2)
+
+            heights2 = np.apply_along_axis(noisify, 1, heights2)
+            heights2 = rescale(heights2)
+            heights2 = np.apply_along_axis(context_func_b, 1, heights2)
+
+            inputs = np.concatenate((
+                heights2,
+                rivers2,
+                roads2,
+                buildings2,
+                inputs),
+                axis=1
+            )
+
+        datasets["blurry" if reduction0 == 1 else ""] = (inputs, outputs)
+
+        if (reduction0 == 1):
+            blurry = layer(mode_blurred_file(mode, reduction0))[randomizer]
+            blurry = noisify_exp(blurry, 20)
+            blurry = np.apply_along_axis(func, 1, blurry)
+
+            sharp = layer(mode_file(mode, reduction0))[randomizer]
+            outputs = sharp[:, -3]
+            recurrents = sharp[:, :-3]
+
+            inputs = np.concatenate((blurry, recurrents), axis=1)
+            datasets["sharp"] = (inputs, outputs)
+
+    return datasets
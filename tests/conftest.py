@@ -0,0 +1,33 @@
+from nn_generator.benchmark import synthetic_images, MODES
+from nn_generator.nn_generator import parse
+import pytest
+
+# Layers are parsed only for pixels at least 162 pixels from the border, smaller maps have empty layers
+SIZE = 400
+
+
+@pytest.fixture(scope="session")
+def images(tmp_path_factory):
+    """Folder with synthetic heights.pgm, roads.pgm, rivers.pgm and buildings.pgm of shape (SIZE, SIZE)."""
+    folder = tmp_path_factory.mktemp("images")
+    synthetic_images(str(folder), SIZE)
+    return str(folder)
+
+
+def parsed(tmp_path_factory, images, sample_first):
+    folder = str(tmp_path_factory.mktemp("training_data"))
+    for mode in MODES:
+        parse(mode, f"{images}/{mode}.pgm", output_folder=folder, sample_first=sample_first)
+    return folder
+
+
+@pytest.fixture(scope="session")
+def training_folder(tmp_path_factory, images):
+    """Training folder with layers of all the images."""
+    return parsed(tmp_path_factory, images, False)
+
+
+@pytest.fixture(scope="session")
+def sampled_folder(tmp_path_factory, images):
+    """Training folder with block means of all the images, parsed with sample_first."""
+    return parsed(tmp_path_factory, images, True)
@@ -0,0 +1,26 @@
+from nn_generator.libraries.basic.compact import save_dataset, load_dataset, open_dataset, LEVELS
+from nn_generator.libraries.basic.utilities import unary_log_encoding_matrix, unary_linear_encoding_matrix
+import numpy as np
+
+
+def test_compact_dataset_round_trip(tmp_path):
+    rng = np.random.RandomState(0)
+    values = rng.standard_normal((500, 12)) * rng.choice([1e-3, 1], size=(500, 12))
+    inputs = np.concatenate((unary_log_encoding_matrix(values, 8), unary_linear_encoding_matrix(values, 8)), axis=1)
+    outputs = unary_log_encoding_matrix(values[:, :1], 8)
+
+    save_dataset(str(tmp_path), inputs, outputs)
+    loaded_inputs, loaded_outputs = load_dataset(str(tmp_path))
+
+    for matrix, loaded in ((inputs, loaded_inputs), (outputs, loaded_outputs)):
+        assert loaded.shape == matrix.shape
+        exact = (matrix == 0) | (matrix == 1) | (matrix == -1)
+        assert np.array_equal(loaded[exact], matrix[exact])
+
+        column_range = np.max(np.where(exact, -np.inf, matrix), axis=0) - np.min(np.where(exact, np.inf, matrix), axis=0)
+        error = np.abs(loaded - matrix)[~exact]
+        assert np.all(error <= np.broadcast_to(column_range, matrix.shape)[~exact] / (2 * LEVELS) + 1e-6)
+
+    # Rows can be read in any order
+    indices = [499, 3, 250, 3]
+    assert np.array_equal(open_dataset(str(tmp_path))[0][indices], loaded_inputs[indices])
@@ -0,0 +1,91 @@
+from nn_generator.benchmark import synthetic_images, random_models
+from nn_generator.libraries.generate import generate_map, generate_many, tile_pixels
+from nn_generator.libraries.model_registry import registry, read_config, load_network
+import numpy as np
+import pytest
+import shutil
+import threading
+import os
+
+STRUCTURES = os.path.join(os.path.dirname(__file__), "..", "nn_generator", "examples", "model_structures")
+
+
+@pytest.fixture(scope="module")
+def generation(tmp_path_factory):
+    """(folder with a synthetic input of shape (64, 64), config file of randomly initialized networks)."""
+    folder = str(tmp_path_factory.mktemp("generation"))
+    synthetic_images(f"{folder}/input", 64)
+    return (f"{folder}/input", random_models(STRUCTURES, f"{folder}/models"))
+
+
+def test_numpy_networks_match_tensorflow(generation):
+    _, config = generation
+    for model_file in read_config(config).values():
+        network = load_network(model_file, "numpy")
+        inputs = np.random.RandomState(0).rand(100, network.input_size).astype(np.float32)
+        expected = np.asarray(load_network(model_file, "tensorflow")(inputs))
+
+        assert np.allclose(network(inputs), expected, rtol=1e-5, atol=1e-6)
+        assert np.allclose(network.row_independent()(inputs), expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("rows, cols, height, width", [(16, 16, 4, 14), (64, 64, 8, 14), (13, 30, 5, 20)])
+def test_tiles_cover_every_pixel_once(rows, cols, height, width):
+    pixels = [tile_pixels(rows, cols, i, j, height, width)
+        for i in range(-(-rows // height)) for j in range(-(-(cols + 3 * rows) // width))]
+    covered = np.zeros((rows, cols), dtype=int)
+    for rs, cs in pixels:
+        np.add.at(covered, (rs, cs), 1)
+        # Pixels of a tile are generated in the order of wavefronts
+        assert np.all(np.diff(cs + 3 * rs) >= 0)
+
+    assert np.all(covered == 1)
+
+
+@pytest.mark.parametrize("tile_size, workers", [(4, 2), (16, 1)])
+def test_tiles_match_generation_without_tiles(tmp_path, generation, tile_size, workers):
+    folder, config = generation
+    expected = generate_map(folder, f"{tmp_path}/whole", config, seed=1, backend="numpy", save_stages=False, row_independent=True)
+    result = generate_map(folder, f"{tmp_path}/tiles", config, tile_size=tile_size, workers=workers, seed=1, backend="numpy", save_stages=False)
+
+    for name, image in expected.items():
+        assert np.array_equal(result[name], image)
+
+
+def test_blocks_match_generation_of_whole_stages(tmp_path, generation):
+    folder, config = generation
+    # A 64 px map fits into a single block by default
+    expected = generate_map(folder, f"{tmp_path}/whole", config, seed=1, backend="numpy", save_stages=False, row_independent=True)
+    result = generate_map(folder, f"{tmp_path}/blocks", config, block_rows=5, seed=1, backend="numpy", save_stages=False, row_independent=True)
+
+    for name, image in expected.items():
+        assert np.array_equal(result[name], image)
+
+
+def test_many_maps_match_separate_generation(tmp_path, generation):
+    folder, config = generation
+    other = shutil.copytree(folder, f"{tmp_path}/other")
+    last = shutil.copytree(folder, f"{tmp_path}/last")
+    # The last map is generated in a group of its own
+    results = generate_many([folder, other, last], f"{tmp_path}/many", config, seeds=[1, 2, 3], save_stages=False, max_batch=2)
+
+    for input_folder, seed in [(folder, 1), (other, 2), (last, 3)]:
+        expected = generate_map(input_folder, f"{tmp_path}/single", config, seed=seed, backend="numpy", save_stages=False, row_independent=True)
+        for name, image in expected.items():
+            assert np.array_equal(results[input_folder][name], image)
+
+
+def test_writer_is_closed_when_generation_fails(tmp_path, generation):
+    folder, config = generation
+    broken = shutil.copytree(folder, f"{tmp_path}/broken")
+    os.remove(f"{broken}/rivers.pgm")
+    # Starts the thread loading networks
+    registry.model_set(config).preload()
+    threads = threading.active_count()
+
+    with pytest.raises(SystemExit):
+        generate_map(broken, f"{tmp_path}/result", config, seed=1)
+
+    # Images queued before the error are written and the writing thread is stopped
+    assert os.path.exists(f"{tmp_path}/result/roads.png")
+    assert threading.active_count() == threads
@@ -0,0 +1,222 @@
+from nn_generator.libraries.basic import parsing
+from nn_generator.libraries.basic.parsing import parse, get_windows_at, level_windows_at, SummedAreaTable, load_layer, nonzero_rows, RunningStatistics, pyramid, level_means
+from nn_generator.libraries.basic.matrix_manipulation import derivatives, padded_derivatives, block_means, scale_down, block_sums, coarser_sums, quantize, rescale_quantized
+from nn_generator.libraries.basic.pgm import read_pgm, write_pgm
+from nn_generator.libraries.parse import read_image, parse_image, parse_heights
+from nn_generator.libraries.normalize_heights import normalize_heights, layer_statistics
+from . import baseline
+import numpy as np
+import pytest
+import cv2
+
+REDUCTIONS = [1, 4, 16, 64]
+
+
+@pytest.mark.parametrize("reduction", REDUCTIONS)
+@pytest.mark.parametrize("differences", [False, True])
+def test_parse_matches_baseline(tmp_path, images, reduction, differences):
+    image, _ = read_image(f"{images}/heights.pgm", str(tmp_path))
+    if differences:
+        image = derivatives(image)[0]
+
+    parse(image, 5, reduction, f"{tmp_path}/layer")
+    layer = np.load(f"{tmp_path}/layer.npy")
+
+    assert np.array_equal(layer, baseline.parse(image, 5, reduction).astype(layer.dtype))
+
+
+@pytest.mark.parametrize("reduction", REDUCTIONS)
+def test_get_windows_at_matches_get_window(reduction):
+    rng = np.random.RandomState(reduction)
+    image = rng.standard_normal((400, 400))
+    rows = rng.randint(162, 240, size=50)
+    cols = rng.randint(160, 240, size=50)
+
+    windows = get_windows_at(image, rows, cols, reduction, 5)
+    expected = [baseline.get_window(image, row, col, reduction, 5).flatten() for row, col in zip(rows, cols)]
+
+    assert np.array_equal(windows, expected)
+
+
+@pytest.mark.parametrize("reduction", [4, 16, 64])
+def test_level_windows_at_match_get_windows_at(reduction):
+    rng = np.random.RandomState(reduction)
+    image = rng.standard_normal((400, 400))
+    rows = rng.randint(162, 240, size=50)
+    cols = rng.randint(160, 240, size=50)
+
+    windows = level_windows_at(block_means(image, reduction), rows, cols, reduction, 5)
+
+    assert np.array_equal(windows, get_windows_at(image, rows, cols, reduction, 5))
+
+
+@pytest.mark.parametrize("reduction", [4, 16, 64])
+def test_summed_area_table_is_exact_on_large_maps(reduction):
+    # 16-bit plateaus with a checkerboard ripple, so that many blocks of differences sum to exactly zero.
+    # Integral images in float64 get signs of such blocks wrong.
+    rng = np.random.RandomState(reduction)
+    coarse = rng.randint(0, (1 << 16) - 1, size=(100, 100))
+    ripple = np.indices((3000, 3000)).sum(0) % 2
+    heights, scale = rescale_quantized((np.repeat(np.repeat(coarse, 30, axis=0), 30, axis=1) + ripple).astype(np.uint16))
+    rows = rng.randint(162, 2838, size=200)
+    cols = rng.randint(160, 2840, size=200)
+
+    for image, signed in [(heights, False), *((differences, True) for differences in derivatives(heights))]:
+        windows = SummedAreaTable(image, scale).windows_at(rows, cols, reduction, 5)
+        exact = level_windows_at(level_means(image, reduction, scale), rows, cols, reduction, 5)
+        expected = np.array([baseline.get_window(image, row, col, reduction, 5).flatten() for row, col in zip(rows, cols)])
+
+        assert np.array_equal(windows, exact)
+        assert np.any(exact < 0) == signed
+        # Only zeros of the direct means can differ, they are rounding errors of the sums
+        nonzero = exact != 0
+        assert np.array_equal(np.sign(windows[nonzero]), np.sign(expected[nonzero]))
+        assert np.allclose(windows, expected, rtol=1e-12, atol=1e-15)
+
+
+def test_block_means_match_scale_down():
+    image = np.random.RandomState(0).standard_normal((100, 95))
+    means = block_means(image, 16)
+
+    # Windows of 5 * 5 blocks, as cut out by get_window
+    for row, col in [(0, 0), (7, 11), (20, 10)]:
+        window = image[row : row + 80, col : col + 80]
+        assert np.array_equal(means[row : row + 80 : 16, col : col + 80 : 16], scale_down(window, 16))
+
+
+def test_derivatives_match_baseline():
+    image = np.random.RandomState(0).rand(40, 30)
+
+    for result, expected in zip(derivatives(image), baseline.derivatives(image)):
+        assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize("padding", [3, 40, 75])
+def test_padded_derivatives_match_np_pad(padding):
+    image = np.random.RandomState(0).rand(20, 30)
+
+    for result, expected in zip(padded_derivatives(image, padding), derivatives(image)):
+        assert np.array_equal(result, np.pad(expected, padding, "reflect"))
+
+
+def test_read_pgm_matches_cv2(tmp_path, images):
+    for name in ["roads", "heights"]:
+        file_name = f"{images}/{name}.pgm"
+        assert np.array_equal(read_pgm(file_name), cv2.imread(file_name, cv2.IMREAD_UNCHANGED))
+        assert np.array_equal(read_pgm(file_name, mmap=True), read_pgm(file_name))
+
+    # ASCII images of the examples
+    file_name = "nn_generator/examples/generation_input/M/heights.pgm"
+    assert np.array_equal(read_pgm(file_name), cv2.imread(file_name, cv2.IMREAD_GRAYSCALE))
+
+    # 8-bit images are read the same as before
+    file_name = f"{images}/roads.pgm"
+    assert np.array_equal(read_image(file_name, str(tmp_path))[0], baseline.read_image(file_name))
+
+
+@pytest.mark.parametrize("maxval", [255, 1000, 65535])
+def test_write_pgm_round_trip(tmp_path, maxval):
+    matrix = np.random.RandomState(0).randint(maxval + 1, size=(30, 20))
+    write_pgm(matrix, f"{tmp_path}/image.pgm", maxval)
+
+    assert np.array_equal(read_pgm(f"{tmp_path}/image.pgm"), matrix)
+
+
+def test_parse_heights_matches_separate_steps(tmp_path, images):
+    image_name = f"{images}/heights.pgm"
+    separate = f"{tmp_path}/separate/heights_layers"
+    single = f"{tmp_path}/single/heights_layers"
+
+    parse_image(image_name, separate)
+    parse_image(image_name, separate, compute_differences=True)
+    normalize_heights(f"{tmp_path}/separate")
+    parse_heights(image_name, single)
+
+    for reduction in REDUCTIONS:
+        for name in ["layer", "normalized_layer", "differences_rows_layer", "differences_columns_layer"]:
+            file_name = f"{name}_{reduction}x.npy"
+            assert np.array_equal(load_layer(f"{separate}/{file_name}")[:], load_layer(f"{single}/{file_name}")[:])
+
+
+def test_running_statistics_match_numpy():
+    rng = np.random.RandomState(0)
+    values = (1000 + rng.standard_normal((3000, 25))).astype(np.float32)
+    weights = rng.randint(1, 5, size=3000).astype(np.float64)
+
+    statistics = RunningStatistics()
+    weighted = RunningStatistics()
+    for start in range(0, 3000, 700):
+        statistics.update(values[start : start + 700])
+        weighted.update(values[start : start + 700], weights[start : start + 700, None])
+
+    exact = values.astype(np.float64)
+    assert statistics.mean == pytest.approx(np.mean(exact), rel=1e-12)
+    assert statistics.std == pytest.approx(np.std(exact), rel=1e-9)
+
+    repeated = np.repeat(exact, weights.astype(np.intp), axis=0)
+    assert weighted.mean == pytest.approx(np.mean(repeated), rel=1e-12)
+    assert weighted.std == pytest.approx(np.std(repeated), rel=1e-9)
+
+
+def test_layer_statistics_match_baseline(training_folder):
+    layer = load_layer(f"{training_folder}/heights_layers/layer_4x.npy")
+    mean, std = layer_statistics(layer)
+    exact = np.asarray(layer, dtype=np.float64)
+
+    assert mean == pytest.approx(np.mean(exact), rel=1e-12)
+    assert std == pytest.approx(np.std(exact), rel=1e-9)
+
+
+def test_nonzero_rows_of_empty_layers():
+    for layer in (np.zeros((0, 25), dtype=np.float32), np.zeros((10, 25), dtype=np.float32)):
+        rows = nonzero_rows(layer)
+        assert rows.dtype == np.intp
+        assert len(rows) == 0
+
+
+@pytest.mark.parametrize("mode", ["roads", "buildings"])
+@pytest.mark.parametrize("reduction", REDUCTIONS)
+@pytest.mark.parametrize("chunk_size", [parsing.CHUNK_SIZE, 500])
+def test_source_layer_nonzero_rows_match_layer(monkeypatch, training_folder, sampled_folder, mode, reduction, chunk_size):
+    monkeypatch.setattr(parsing, "CHUNK_SIZE", chunk_size)
+    file_name = f"{mode}_layers/layer_{reduction}x.npy"
+    layer = np.load(f"{training_folder}/{file_name}")
+    source = load_layer(f"{sampled_folder}/{file_name}")
+
+    assert np.array_equal(source[:], layer)
+    assert np.array_equal(nonzero_rows(source), np.flatnonzero(np.any(layer != 0, axis=1)))
+
+
+def test_block_sums_are_exact():
+    matrix = np.random.RandomState(0).randint(-65535, 65536, size=(150, 140))
+    sums = block_sums(matrix, 16)
+
+    for row, col in [(0, 0), (7, 11), (134, 124)]:
+        assert sums[row, col] == np.sum(matrix[row : row + 16, col : col + 16])
+    assert np.array_equal(coarser_sums(block_sums(matrix, 4), 4, 4), sums)
+
+
+@pytest.mark.parametrize("differences", [False, True])
+def test_pyramid_matches_direct_means(tmp_path, images, differences):
+    image, scale = read_image(f"{images}/heights.pgm", str(tmp_path))
+    if differences:
+        image = derivatives(image)[0]
+
+    for reduction, means in pyramid(image, REDUCTIONS, scale):
+        assert np.array_equal(means, level_means(image, reduction, scale))
+
+        # Signs are the signs of the exact sums, encodings of the layers depend on them
+        integers = quantize(image, scale)
+        sums = block_sums(integers, reduction) if reduction != 1 else integers
+        assert np.array_equal(np.sign(means), np.sign(sums))
+
+        # Otherwise the means differ from the means summed in floating point only by rounding
+        assert np.allclose(means, block_means(image, reduction), rtol=0, atol=1e-15)
+
+
+def test_pyramid_of_real_values_matches_block_means():
+    image = np.random.RandomState(0).standard_normal((200, 200))
+
+    for reduction, means in pyramid(image, REDUCTIONS):
+        assert np.array_equal(means, level_means(image, reduction))
+        assert np.array_equal(means, block_means(image, reduction) if reduction != 1 else image)
@@ -0,0 +1,111 @@
+from nn_generator.libraries.process_training_data import process_training_data, dataset_folder, ExampleGenerator
+from nn_generator.libraries.basic.compact import load_dataset
+from nn_generator.libraries.basic.parsing import load_layer, parse, RunningStatistics
+from nn_generator.libraries.basic.matrix_manipulation import derivatives
+from nn_generator.libraries.parse import read_image
+from nn_generator.libraries.normalize_heights import save_normalization
+from nn_generator.benchmark import MODES
+from . import baseline
+import numpy as np
+import pytest
+import cv2
+
+SIZE = 300
+VARIANTS = [(16, 64, None), (4, 16, 64), (1, 4, 16)]
+REDUCTIONS = [1, 4, 16, 64]
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("reductions", VARIANTS)
+def test_datasets_match_baseline(training_folder, mode, reductions):
+    reduction0, reduction1, reduction2 = reductions
+
+    np.random.seed(0)
+    process_training_data(mode, reduction0, reduction1, reduction2, training_folder, SIZE, compact=False)
+
+    np.random.seed(0)
+    expected = baseline.process_training_data(
+        mode, reduction0, reduction1, reduction2, lambda name: np.array(load_layer(f"{training_folder}/{name}")[:]), SIZE)
+
+    folder = dataset_folder(training_folder, mode, reduction0, reduction1, reduction2, SIZE)
+    for part, (inputs, outputs) in expected.items():
+        loaded_inputs, loaded_outputs = load_dataset(f"{folder}/{part}" if part else folder)
+        assert np.array_equal(loaded_inputs, inputs)
+        assert np.array_equal(loaded_outputs, outputs)
+
+
+def parse_directly(images, folder):
+    """Parses the images into folder like nn_generator.parse, but every layer directly from the image
+    instead of from the pyramid of block means."""
+    for mode in MODES:
+        layers = f"{folder}/{mode}_layers"
+        image, scale = read_image(f"{images}/{mode}.pgm", layers)
+
+        if mode == "heights":
+            ders_r, ders_c = derivatives(image)
+            for reduction in REDUCTIONS:
+                statistics = RunningStatistics()
+                parse(image, 5, reduction, f"{layers}/layer_{reduction}x", statistics, scale=scale)
+                save_normalization(layers, reduction, statistics.mean, statistics.std)
+                parse(ders_r, 5, reduction, f"{layers}/differences_rows_layer_{reduction}x", scale=scale)
+                parse(ders_c, 5, reduction, f"{layers}/differences_columns_layer_{reduction}x", scale=scale)
+        else:
+            blurry = cv2.GaussianBlur(image, (5,5), cv2.BORDER_DEFAULT)
+            for reduction in REDUCTIONS:
+                parse(image, 5, reduction, f"{layers}/layer_{reduction}x", scale=scale)
+                parse(blurry, 5, reduction, f"{layers}/layer_blurry_{reduction}x")
+
+
+@pytest.fixture(scope="module")
+def direct_folder(tmp_path_factory, images):
+    folder = str(tmp_path_factory.mktemp("direct_training_data"))
+    parse_directly(images, folder)
+    return folder
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("reductions", VARIANTS)
+@pytest.mark.parametrize("sample_first", [False, True])
+def test_datasets_match_direct_computation(training_folder, sampled_folder, direct_folder, mode, reductions, sample_first):
+    reduction0, reduction1, reduction2 = reductions
+    folders = [sampled_folder if sample_first else training_folder, direct_folder]
+    # Other size than in test_datasets_match_baseline, which writes datasets into the same training folder
+    size = SIZE // 2
+
+    for folder in folders:
+        np.random.seed(0)
+        process_training_data(mode, reduction0, reduction1, reduction2, folder, size, compact=False)
+
+    pyramid_folder, direct_folder = (dataset_folder(folder, mode, reduction0, reduction1, reduction2, size) for folder in folders)
+    for part in ["blurry", "sharp"] if reduction0 == 1 and mode != "heights" else [""]:
+        inputs, outputs = load_dataset(f"{pyramid_folder}/{part}" if part else pyramid_folder)
+        expected_inputs, expected_outputs = load_dataset(f"{direct_folder}/{part}" if part else direct_folder)
+        assert np.array_equal(inputs, expected_inputs)
+        assert np.array_equal(outputs, expected_outputs)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_example_workers_build_the_same_blocks(training_folder, mode):
+    examples = ExampleGenerator(mode, 4, 16, 64, training_folder=str(training_folder), block_size=64, workers=2, seed=1)
+    with examples:
+        blocks = examples.blocks()
+        for index in range(4):
+            inputs, outputs = next(blocks)
+            expected_inputs, expected_outputs = examples.block(index)
+            assert np.array_equal(inputs, expected_inputs)
+            assert np.array_equal(outputs, expected_outputs)
+
+    assert examples.pool is None
+
+
+def test_example_blocks_keep_global_random_state(training_folder):
+    examples = ExampleGenerator("heights", 4, 16, 64, training_folder=str(training_folder), block_size=64, seed=1)
+    np.random.seed(0)
+    expected = np.random.rand()
+    np.random.seed(0)
+    first = examples.block(0)
+
+    assert np.random.rand() == expected
+    # Blocks depend only on the seed and their index
+    for matrix, other in zip(first, examples.block(0)):
+        assert np.array_equal(matrix, other)
@@ -0,0 +1,46 @@
+from nn_generator.libraries.scheduler import Task, run_tasks
+import pytest
+import os
+
+
+def write(folder, name, *dependencies):
+    """Writes a file of the task, after checking that files of its dependencies exist."""
+    for dependency in dependencies:
+        assert os.path.exists(f"{folder}/{dependency}")
+    with open(f"{folder}/{name}", "w") as f:
+        f.write(name)
+    return (name, os.getpid())
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def graph(folder):
+    return [
+        Task("a", write, (folder, "a")),
+        Task("b", write, (folder, "b", "a"), dependencies=["a"]),
+        Task("c", write, (folder, "c", "a"), dependencies=["a"]),
+        Task("d", write, (folder, "d", "b", "c"), dependencies=["b", "c"]),
+        Task("e", write, (folder, "e")),
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_tasks_run_after_their_dependencies(tmp_path, workers):
+    results = run_tasks(graph(str(tmp_path)), workers)
+
+    assert {name: result[0] for name, result in results.items()} == {name: name for name in "abcde"}
+    pids = {pid for _, pid in results.values()}
+    if workers == 1:
+        assert pids == {os.getpid()}
+    else:
+        assert os.getpid() not in pids
+
+
+def test_error_of_a_task_is_raised(tmp_path):
+    tasks = graph(str(tmp_path)) + [Task("f", fail, dependencies=["a"]), Task("g", write, (str(tmp_path), "g"), dependencies=["f"])]
+
+    with pytest.raises(ValueError, match="failed"):
+        run_tasks(tasks, 2)
+    assert not os.path.exists(f"{tmp_path}/g")
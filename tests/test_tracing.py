@@ -0,0 +1,43 @@
+from nn_generator.libraries.tracing import Tracer, tracing, stage, record_call, active
+import threading
+
+
+def test_threads_record_into_their_own_tracers():
+    tracers = [Tracer(), Tracer()]
+    barrier = threading.Barrier(len(tracers))
+
+    def run(index):
+        with tracing(tracers[index]):
+            with stage(f"stage {index}"):
+                # Both stages are open at the same time
+                barrier.wait()
+                record_call(0.001, index + 1)
+                barrier.wait()
+        assert active() is None
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(tracers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for index, tracer in enumerate(tracers):
+        assert [record["name"] for record in tracer.stages] == [f"stage {index}"]
+        assert tracer.calls == {f"stage {index}": [(0.001, index + 1)]}
+
+
+def test_threads_started_while_tracing_are_not_traced():
+    def run():
+        with stage("other"):
+            pass
+
+    tracer = Tracer()
+    with tracing(tracer):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        with stage("own"):
+            pass
+
+    assert [record["name"] for record in tracer.stages] == ["own"]
+    assert active() is None
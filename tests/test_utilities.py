@@ -0,0 +1,60 @@
+from nn_generator.libraries.basic import utilities
+from nn_generator.libraries.basic.matrix_manipulation import rescale2, rescale2_rows
+import numpy as np
+import pytest
+
+
+def values(dtype):
+    """Matrix with zeros, negative values, values above 1 and tiny values, which all the encoders treat differently."""
+    rng = np.random.RandomState(0)
+    matrix = rng.standard_normal((60, 7)) * rng.choice([1e-4, 0.1, 1, 3], size=(60, 7))
+    matrix[rng.rand(60, 7) < 0.1] = 0
+    matrix[0] = [0, 1, -1, 0.5, -0.25, 2 ** -8, 300]
+    return matrix.astype(dtype)
+
+
+def rows(function, matrix, *arguments):
+    return np.asarray([function(row, *arguments) for row in matrix])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("encoder, matrix_encoder", [
+    (utilities.unary_log_encoding_array, utilities.unary_log_encoding_matrix),
+    (utilities.unary_log_encoding_array_reversed, utilities.unary_log_encoding_matrix_reversed),
+    (utilities.unary_linear_encoding_array, utilities.unary_linear_encoding_matrix),
+])
+def test_encoders_match_scalar_encoders(dtype, encoder, matrix_encoder):
+    matrix = values(dtype)
+    assert np.array_equal(matrix_encoder(matrix, 8), rows(encoder, matrix, 8))
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_decoders_match_scalar_decoders(dtype):
+    matrix = values(dtype)
+    encoded = utilities.unary_log_encoding_matrix(matrix, 8).astype(dtype)
+    encoded_reversed = utilities.unary_log_encoding_matrix_reversed(matrix[:, :1], 8).astype(dtype)
+
+    assert np.array_equal(
+        utilities.unary_log_decoding_matrix(encoded, 8),
+        rows(utilities.unary_log_decoding_array, encoded, 8))
+    assert np.array_equal(
+        utilities.unary_log_decoding_matrix_reversed(encoded_reversed),
+        rows(utilities.unary_log_decoding_reversed, encoded_reversed))
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_row_functions_match_scalar_functions(dtype):
+    matrix = values(dtype)
+
+    np.random.seed(0)
+    noisy = utilities.noisify_exp_rows(matrix, 20)
+    np.random.seed(0)
+    assert np.array_equal(noisy, rows(utilities.noisify_exp, matrix, 20))
+
+    assert np.array_equal(rescale2_rows(matrix), rows(rescale2, matrix))
+
+    relative = matrix.copy()
+    absolutes = utilities.relativization_matrix(relative)
+    expected = matrix.copy()
+    assert np.array_equal(absolutes, [utilities.relativization(row) for row in expected])
+    assert np.array_equal(relative, expected)